@@ -0,0 +1,331 @@
+"""asyncio runtime: all devices on one event loop instead of one thread each.
+
+The PMS5003 port is read from the event loop when it becomes readable, I2C
+transactions go through a single worker thread (which also serializes bus
+1), and periodic work runs on monotonic deadlines.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import serial
+import signal
+import smbus2
+import time
+
+import bme680
+import ccs811
+import metrics
+import pm25
+import readings
+import ssd1306
+import util
+
+
+class I2C(object):
+    """Runs blocking I2C calls on one worker thread."""
+
+    def __init__(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='i2c')
+
+    async def __call__(self, f, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(f, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+async def every(interval, f):
+    """Awaits f() every interval seconds on monotonic deadlines. Missed
+    deadlines are skipped, not made up for."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while True:
+        await f()
+        deadline += interval
+        now = loop.time()
+        if deadline < now:
+            deadline += (now - deadline) // interval * interval + interval
+        await asyncio.sleep(deadline - now)
+
+
+async def pm25_task(registry=readings.default, history=None, device='/dev/ttyAMA0',
+                    max_bytes=1024, port=None, retry_interval=1):
+    """Reads the PMS5003 on port or, if None, on device. After an error of
+    the port it stops watching it, and device is opened again (or port
+    watched again) retry_interval seconds later, like pm25.pm25_loop."""
+    loop = asyncio.get_running_loop()
+    reader = pm25.PMS5003Reader()
+    reader.export_metrics()
+
+    def on_readable(failed):
+        try:
+            data = port.read(port.in_waiting or 1)
+            if not data:
+                raise OSError('end of the PMS5003 stream')
+            messages = reader.feed(data)
+        except Exception as e:
+            print(e)
+            registry.publish('pm25', e)
+            # An unplugged port stays readable.
+            loop.remove_reader(port.fileno())
+            if not failed.done():
+                failed.set_result(e)
+            return
+        for m in messages:
+            registry.publish('pm25', m)
+            if history is not None:
+                history.append(m)
+            print(time.gmtime(), 'PM25:', m)
+        if not messages and max_bytes > 0 and reader.bytes_since_last_frame >= max_bytes:
+            e = RuntimeError('%d bytes read without seeing a valid PMS5003 message (%s).' %
+                             (reader.bytes_since_last_frame, reader.stats()))
+            print(e)
+            registry.publish('pm25', e)
+            reader.bytes_since_last_frame = 0
+
+    with util.flock('/tmp/pm25.lock'):
+        reopen = port is None
+        try:
+            while True:
+                if port is None:
+                    try:
+                        port = serial.Serial(device, 9600, timeout=0)
+                    except Exception as e:
+                        print(e)
+                        registry.publish('pm25', e)
+                        await asyncio.sleep(retry_interval)
+                        continue
+                failed = loop.create_future()
+                loop.add_reader(port.fileno(), on_readable, failed)
+                try:
+                    await failed
+                finally:
+                    loop.remove_reader(port.fileno())
+                if reopen:
+                    port.close()
+                    port = None
+                await asyncio.sleep(retry_interval)
+        finally:
+            if port is not None:
+                port.close()
+            print('exit pm25')
+
+
+async def ccs811_task(addr, bus, i2c, registry=readings.default, history=None,
+                      checkpoint=None, env=None, interval=1, interrupt_pin=None, gpio=None):
+    """The asyncio version of ccs811.ccs811_loop. The nINT wait blocks a
+    thread of the default executor, not the I2C one."""
+    loop = asyncio.get_running_loop()
+
+    def log(*args, **kwargs):
+        print('CCS811.{:x}:'.format(addr), *args, **kwargs)
+
+    key = 'tvoc.{}'.format(hex(addr))
+    baseline_throttle = util.Throttle(24 * 3600)
+    baseline_throttle.maybe_run(lambda: None)
+    dev = ccs811.CCS811(bus, addr)
+    polls = metrics.default.counter('ccs811_status_polls_total', 'CCS811 status reads.',
+                                    device=hex(addr))
+    errors = metrics.default.counter('ccs811_errors_total',
+                                     'CCS811 error reports and failed polls.',
+                                     device=hex(addr))
+    interrupts = metrics.default.counter('ccs811_interrupts_total',
+                                         'CCS811 results read after an nINT edge.',
+                                         device=hex(addr))
+    nint = None
+
+    async def error():
+        errors.inc()
+        error = await i2c(dev.error)
+        log(error)
+        registry.publish(key, RuntimeError(str(error)))
+
+    async def publish(result):
+        registry.publish(key, result)
+        if history is not None and result.raw is not None:
+            history.append((result.e_co2, result.tvoc,
+                            result.raw.current, result.raw.voltage))
+        if result.e_co2 <= 8192 and result.tvoc <= 1187:
+            log(result)
+            await i2c(baseline_throttle.maybe_run,
+                      lambda: dev.save_baseline('baseline'))
+
+    async def poll():
+        polls.inc()
+        status = await i2c(dev.status)
+        if status.error:
+            await error()
+        elif status.data_ready:
+            await publish(await i2c(dev.result))
+
+    async def read():
+        try:
+            data = env and env.take(addr)
+            if data:
+                await i2c(dev.set_env_data, *data)
+            if nint is None:
+                await poll()
+            elif await loop.run_in_executor(None, nint.wait_low, 2 * interval):
+                # The result carries status and error id too, so one read
+                # also releases nINT.
+                interrupts.inc()
+                result = await i2c(dev.result)
+                if result.status.error:
+                    await error()
+                elif result.status.data_ready:
+                    await publish(result)
+            else:
+                await poll()
+        except Exception as e:
+            errors.inc()
+            print(e)
+            if nint is not None:
+                await asyncio.sleep(interval)
+
+    with util.flock('/tmp/tvoc.{}.lock'.format(hex(addr))), contextlib.ExitStack() as stack:
+        assert await i2c(dev.is_device)
+        if await i2c(dev.bring_up, checkpoint):
+            log('app still running, keeping its baseline')
+        if interrupt_pin is not None:
+            try:
+                (nint,), _ = stack.enter_context(
+                    util.gpio(inputs=[(interrupt_pin, True)], GPIO=gpio))
+            except Exception as e:
+                log('no interrupt pin, polling:', e)
+        steps = dev.switch_mode_steps(1, interrupt=int(nint is not None))
+        while True:
+            secs = await i2c(next, steps, None)
+            if secs is None:
+                break
+            await asyncio.sleep(secs)
+        if checkpoint is not None:
+            await i2c(dev.save_checkpoint, checkpoint)
+        try:
+            if nint is None:
+                await every(interval, read)
+            else:
+                while True:
+                    await read()
+        finally:
+            print('exit ccs811', hex(addr))
+
+
+async def bme680_task(addr, bus, i2c, registry=readings.default, interval=3,
+                      heater_temp=None):
+    key = 'bme680.{}'.format(hex(addr))
+    errors = metrics.default.counter('bme680_errors_total', 'Failed BME680 measurements.',
+                                     device=hex(addr))
+    dev = bme680.BME680(bus, addr, heater_temp=heater_temp)
+
+    async def measure():
+        # Waits for the conversion on the loop, not on the I2C thread.
+        try:
+            await i2c(dev.trigger)
+            await asyncio.sleep(dev.duration())
+            for _ in range(10):
+                m = await i2c(dev.read)
+                if m is not None:
+                    break
+                await asyncio.sleep(0.005)
+            else:
+                raise RuntimeError('BME680 measurement did not finish')
+            registry.publish(key, m)
+            print('BME680.{:x}:'.format(addr), m)
+        except Exception as e:
+            errors.inc()
+            print(e)
+            registry.publish(key, e)
+
+    with util.flock('/tmp/bme680.{}.lock'.format(hex(addr))):
+        assert await i2c(dev.is_device)
+        await i2c(dev.setup)
+        try:
+            await every(interval, measure)
+        finally:
+            print('exit bme680', hex(addr))
+
+
+async def display_task(addr, bus, i2c, registry=readings.default, checkpoint=None,
+                       flip=False, spi=None, graph=None):
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+
+    def on_publish(key):
+        if key in ssd1306.Display.KEYS:
+            loop.call_soon_threadsafe(changed.set)
+
+    def draw(show, half):
+        try:
+            display.draw(show, half)
+        except Exception as e:
+            print('Exception:', e)
+
+    with util.flock('/tmp/ssd1306.{}.lock'.format(hex(addr))), \
+            ssd1306.open_device(addr, bus, spi) as dev:
+        print('resumed' if await i2c(dev.bring_up, checkpoint) else 'init done')
+        display = ssd1306.Display(dev, registry, flip=flip, graph=graph)
+        await i2c(display.start)
+        half = 0
+        registry.add_listener(on_publish)
+        try:
+            while True:
+                for show, duration in display.screens():
+                    half ^= 1
+                    end = loop.time() + duration
+                    now = loop.time()
+                    while now < end:
+                        changed.clear()
+                        await i2c(draw, show, half)
+                        with contextlib.suppress(asyncio.TimeoutError):
+                            await asyncio.wait_for(
+                                changed.wait(), min(end - now, display.INTERVAL))
+                        now = loop.time()
+        finally:
+            registry.remove_listener(on_publish)
+            await asyncio.shield(i2c(dev.shut_down, checkpoint))
+            print('exit ssd1306')
+
+
+async def run(tasks):
+    """Runs tasks (coroutines) until one fails or SIGTERM arrives."""
+    loop = asyncio.get_running_loop()
+    main = asyncio.current_task()
+
+    def sigterm_handler():
+        print('caught sigterm')
+        main.cancel()
+
+    loop.add_signal_handler(signal.SIGTERM, sigterm_handler)
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+
+
+def main(pm25_history=None, tvoc_histories=None, registry=readings.default,
+         bus=None, port=None, checkpoint=None, flip=False, spi=None, graph=None,
+         device='/dev/ttyAMA0', bme680_addr=None, bme680_interval=3, env=None,
+         ccs811_interval=1, interrupt_pins=None, gpio=None):
+    i2c = I2C()
+    with smbus2.SMBus(1) if bus is None else bus as bus:
+        tasks = [
+            display_task(0x3c, bus, i2c, registry, checkpoint, flip, spi, graph),
+            pm25_task(registry, pm25_history, device, port=port)]
+        # A CCS811 is read if it has a history, as in the threaded mode.
+        tasks += [ccs811_task(addr, bus, i2c, registry, h, checkpoint, env, ccs811_interval,
+                              (interrupt_pins or {}).get(addr), gpio)
+                  for addr, h in sorted((tvoc_histories or {}).items())]
+        if bme680_addr:
+            tasks.append(bme680_task(bme680_addr, bus, i2c, registry, bme680_interval))
+        try:
+            asyncio.run(run(tasks))
+        finally:
+            i2c.shutdown()
+    print('exit')
@@ -1,35 +1,371 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
 import signal
+import smbus2
 import threading
 import time
 
+import aqi
+import bme680
+import checkpoint
+import history
+import i2cbus
+import metrics
 import pm25
+import readings
+import readlog
+import rollup
 import ccs811
+import spool
 import ssd1306
+import util
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--asyncio', action='store_true',
+                    help='run all devices on one asyncio event loop instead of a thread each')
+parser.add_argument('--log-dir', help='append every reading to a binary log in this directory')
+parser.add_argument('--spool-dir', help='upload readings through a spool in this directory')
+parser.add_argument('--pms5003', action='append', metavar='DEVICE',
+                    help='serial port of a PMS5003 (default /dev/ttyAMA0); repeat for more '
+                    'sensors (not with --asyncio), which are read from one thread and published as '
+                    'pm25.<n>')
+parser.add_argument('--ccs811', action='append', default=[], metavar='ADDR',
+                    help='read the CCS811 at ADDR (0x5a or 0x5b); repeat for both (with --fake '
+                    'both are simulated by default)')
+parser.add_argument('--ccs811-interrupt', action='append', default=[], metavar='ADDR:PIN',
+                    help='read the CCS811 at ADDR (e.g. 0x5a) when its nINT, wired to board '
+                    'pin PIN, goes low instead of polling it')
+parser.add_argument('--bme680', nargs='?', const='0x77', metavar='ADDR',
+                    help='read a BME680 (default address 0x77) and feed its humidity and '
+                    'temperature to the CCS811s')
+parser.add_argument('--processes', action='store_true',
+                    help='run each sensor loop in a process of its own, restarted if it exits, '
+                    'publishing through a shared memory page (see shm.py)')
+parser.add_argument('--warm-start', action='store_true',
+                    help='keep a checkpoint of the device set-up in /tmp and, after a restart '
+                    'within the same boot, skip the steps the devices still have applied')
+parser.add_argument('--display-flip', action='store_true',
+                    help='keep two screens in the display RAM and switch between them with one '
+                    'command instead of redrawing (the display then shows 32 rows)')
+parser.add_argument('--display-spi', metavar='BUS.DEVICE:DC[:RES]',
+                    help='drive the display over SPI, e.g. 0.0:18:22 for /dev/spidev0.0 with D/C '
+                    'on board pin 18 and RES on pin 22, instead of I2C')
+parser.add_argument('--graph', metavar='SPAN',
+                    help='add display screens graphing PM2.5 (and TVOC when read) over the last '
+                    'SPAN, e.g. 30m or 6h (needs numpy)')
+parser.add_argument('--history', type=float, default=24, metavar='HOURS',
+                    help='keep this many hours of readings per sensor in memory for the display')
+parser.add_argument('--metrics-file',
+                    help='write Prometheus metrics to this file every 10s (node_exporter textfile)')
+parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port')
+parser.add_argument('--fake', nargs='?', const='synthetic', metavar='CAPTURE',
+                    help='run against simulated devices, replaying a captured PMS5003 byte stream '
+                    'if given, and report readings/s and CPU time per reading at exit')
+parser.add_argument('--speed', type=float, default=1, help='speed up simulated devices this much')
+parser.add_argument('--corrupt', type=float, default=0.01,
+                    help='fraction of corrupted synthetic PMS5003 frames')
+parser.add_argument('--duration', type=float, help='stop after this many seconds')
+args = parser.parse_args()
+devices = args.pms5003 or ['/dev/ttyAMA0']
+if args.asyncio and len(devices) > 1:
+    parser.error('--asyncio reads a single PMS5003')
+if args.asyncio and args.processes:
+    parser.error('--processes does not work with --asyncio')
+bme680_addr = int(args.bme680, 16) if args.bme680 else None
+env = ccs811.EnvData('bme680.' + hex(bme680_addr)) if bme680_addr else None
+device_state = checkpoint.Checkpoint() if args.warm_start else None
+display_spi = None
+if args.display_spi:
+    spi_dev, _, spi_pins = args.display_spi.partition(':')
+    spi_pins = [int(_) for _ in spi_pins.split(':')]
+    display_spi = dict(zip(('bus', 'device'), (int(_) for _ in spi_dev.split('.'))),
+                       dc_pin=spi_pins[0], reset_pin=(spi_pins[1:] or [None])[0])
+interrupt_pins = {int(addr, 16): int(pin) for addr, pin in
+                  (_.split(':') for _ in args.ccs811_interrupt)}
+
+ccs811_addrs = [int(_, 16) for _ in args.ccs811] or ([0x5a, 0x5b] if args.fake else [])
+if not set(ccs811_addrs) <= {0x5a, 0x5b}:
+    parser.error('a CCS811 is at 0x5a or 0x5b')
+# --history hours of readings at 1 Hz, for the sensors that run.
+history_size = max(1, int(args.history * 3600))
+pm25_history = history.History(pm25.Message._fields, history_size)
+tvoc_histories = {addr: history.History(ccs811.HISTORY_CHANNELS, history_size)
+                  for addr in ccs811_addrs}
+
+display_graph = None
+if args.graph:
+    import graph
+    display_graph = graph.Graph(
+        [graph.Plot('PM25', pm25_history, 'pm2_5')] +
+        [graph.Plot('TVOC' + hex(addr)[2:], h, 'tvoc') for addr, h in tvoc_histories.items()],
+        graph.parse_span(args.graph))
+
+# Status files for external tools; the display reads readings.default
+# directly.
+status_files = {
+    'pm25': ('/tmp/pm25.txt', lambda m: m.pm2_5),
+    'tvoc.0x5a': ('/tmp/tvoc.0x5a.txt', lambda r: r.tvoc),
+    'tvoc.0x5b': ('/tmp/tvoc.0x5b.txt', lambda r: r.tvoc),
+}
 
 stop = threading.Event()
 
-def sigterm_handler(*_):
-    print('caught sigterm')
-    stop.set()
+background = [threading.Thread(target=readings.export_loop,
+                               args=(readings.default, status_files, stop))]
+if args.metrics_file:
+    background.append(threading.Thread(target=metrics.default.export_loop,
+                                       args=(args.metrics_file, stop)))
+if args.log_dir:
+    log = readlog.Writer(args.log_dir)
+    readings.default.add_listener(log.on_publish(readings.default))
+    background.append(threading.Thread(target=log.run, args=(stop,)))
+
+# Per-minute/hour/day rollups; uploads send the per-minute means.
+uploads = {
+    'pm25': ('pm25', pm25.Message._fields),
+    'tvoc.0x5a': ('ccs811.0x5a', ccs811.UPLOAD_CHANNELS),
+    'tvoc.0x5b': ('ccs811.0x5b', ccs811.UPLOAD_CHANNELS),
+}
+aggregator = rollup.Aggregator({key: channels for key, (_, channels) in uploads.items()})
+readings.default.add_listener(aggregator.on_publish(readings.default))
+
+# AQI from the hourly PM2.5 means, back-computed from the log at startup.
+nowcast = aqi.NowCast(readings.default)
+aggregator.subscribe(nowcast.on_window, key='pm25', period=rollup.HOUR)
+# Finishes windows without new readings, in the threaded and asyncio modes.
+background.append(threading.Thread(target=aggregator.run, args=(stop,)))
+if args.log_dir:
+    end = int(time.time()) // 3600 * 3600
+    start = end - 12 * 3600
+    # Sensor 0 publishes as 'pm25', the key the NowCast follows.
+    records = readlog.Reader(args.log_dir).range(start, end, kind=readlog.PMS5003, sensor=0)
+    pm2_5 = pm25.Message._fields.index('pm2_5')
+    means = aqi.hourly_means(((r.when, r.values[pm2_5]) for r in records), start, end)
+    for hour, mean in zip(range(start, end, 3600), means):
+        if mean is not None:
+            nowcast.add_hour(hour, mean)
+
+if args.spool_dir:
+    posters = {'pm25': util.GoogleFormPoster(pm25.FORM_URL)}
+    for addr, url in ccs811.FORM_URLS.items():
+        posters['ccs811.' + hex(addr)] = util.GoogleFormPoster(url)
+    spooler = spool.Spooler(args.spool_dir, posters)
+    background.append(threading.Thread(target=spooler.run, args=(stop,)))
+
+    def upload(window):
+        form, channels = uploads[window.key]
+        spooler.put(form, window.start, [round(window.stats[c].mean) for c in channels])
+
+    aggregator.subscribe(upload, period=rollup.MINUTE)
+
+ports = None
+smbus = None
+gpio = None
+if args.fake:
+    import fakes
+
+    def fake_ports():
+        if args.fake == 'synthetic':
+            return [fakes.FakeSerial(fakes.synthetic_pms5003(corrupt=args.corrupt, seed=n),
+                                     args.speed)
+                    for n in range(len(devices))]
+        return [fakes.FakeSerial(fakes.replay(args.fake, repeat=True), args.speed)
+                for _ in devices]
+
+    def fake_smbus():
+        return fakes.FakeSMBus({0x3c: fakes.FakeSSD1306(),
+                                0x5a: fakes.FakeCCS811(args.speed),
+                                0x5b: fakes.FakeCCS811(args.speed),
+                                0x76: fakes.FakeBME680(),
+                                0x77: fakes.FakeBME680()})
+
+    def fake_gpio(smbus):
+        return fakes.FakeGPIO({pin: smbus.devices[addr].nint
+                               for addr, pin in interrupt_pins.items()})
+
+    if display_spi:
+        display_gpio = fakes.FakeGPIO()
+        spi_display = fakes.FakeSSD1306()
+        spi_devs = []
+
+        def fake_spidev():
+            spi_devs.append(fakes.FakeSpiDev(spi_display, display_gpio, display_spi['dc_pin']))
+            return spi_devs[-1]
+
+        display_spi.update(GPIO=display_gpio, SpiDev=fake_spidev)
 
-signal.signal(signal.SIGTERM, sigterm_handler)
+    # With --processes the workers make their own (the feeder threads of
+    # the fakes do not survive a fork).
+    smbus = fake_smbus()
+    if not args.processes:
+        ports = fake_ports()
+        gpio = fake_gpio(smbus)
+    published = [0]
+    readings.default.add_listener(lambda key: published.__setitem__(0, published[0] + 1))
+    started = time.monotonic(), time.process_time()
 
-threads = [
-    threading.Thread(target=ssd1306.display_loop, args=(0x3c, stop)),
-    threading.Thread(target=pm25.pm25_loop, args=(stop,))]
-    #threading.Thread(target=ccs811.ccs811_loop, args=(0x5a, stop)),
-    #threading.Thread(target=ccs811.ccs811_loop, args=(0x5b, stop))]
+    def report():
+        wall = time.monotonic() - started[0]
+        cpu = time.process_time() - started[1]
+        n = max(1, published[0])
+        print('%d readings in %.1fs: %.1f readings/s, %.3f ms CPU per reading' %
+              (published[0], wall, published[0] / wall, 1000 * cpu / n))
+        if ports:
+            print('pm25:', sum(p.bytes_written for p in ports), 'bytes written')
+        print('i2c:', smbus.transactions, 'transactions', smbus.bytes, 'bytes')
+        if display_spi:
+            print('spi:', sum(d.calls for d in spi_devs), 'writes',
+                  sum(d.bytes for d in spi_devs), 'bytes')
 
+if args.processes:
+    # The display, aggregators and uploads stay here and get the readings
+    # of the workers through the page. Each worker opens the bus for
+    # itself, so BusManager priorities only apply within a process. The
+    # supervisor forks before any thread starts here, see shm.Supervisor.
+    import shm
+    tvoc_keys = {'tvoc.' + hex(addr): addr for addr in tvoc_histories}
+    keys = [pm25.sensor_key(n) for n in range(len(devices))] + list(tvoc_keys)
+    if bme680_addr:
+        keys.append('bme680.' + hex(bme680_addr))
+    page = shm.Page.create(keys)
+    supervisor = shm.Supervisor(page.path)
 
-for _ in threads:
-    _.start()
+    def append_history(key):
+        r = readings.default.get(key)
+        if isinstance(r.value, Exception):
+            return
+        if key == 'pm25':
+            pm25_history.append(r.value, r.when)
+        elif key in tvoc_keys and r.value.raw is not None:
+            tvoc_histories[tvoc_keys[key]].append(
+                (r.value.e_co2, r.value.tvoc, r.value.raw.current, r.value.raw.voltage), r.when)
 
-while not stop.is_set():
-    time.sleep(1)
+    readings.default.add_listener(append_history)
 
-for _ in threads:
-    _.join()
+    def pm25_worker(stop, registry):
+        ports = fake_ports() if args.fake else None
+        if len(devices) > 1:
+            pm25.multi_pm25_loop(ports or devices, stop, {}, registry)
+        else:
+            pm25.pm25_loop(stop, None, registry, ports and ports[0], devices[0])
 
-print('exit')
+    def ccs811_worker(addr):
+        def run(stop, registry):
+            smbus = gpio = None
+            if args.fake:
+                smbus = fake_smbus()
+                gpio = fake_gpio(smbus)
+            worker_env = None
+            if env:
+                # The BME680 readings come from another worker.
+                env_registry = readings.Registry()
+                threading.Thread(target=shm.Page.open(page.path).mirror,
+                                 args=(env_registry, stop), daemon=True).start()
+                worker_env = ccs811.EnvData(env.key, env_registry)
+            ccs811.ccs811_loop(addr, stop, None, registry, smbus, 1 / args.speed,
+                               interrupt_pins.get(addr), gpio, worker_env,
+                               device_state)
+        return run
+
+    def bme680_worker(stop, registry):
+        bme680.bme680_loop(bme680_addr, stop, registry, fake_smbus() if args.fake else None,
+                           3 / args.speed if args.fake else 3)
+
+    supervisor.add('pm25', pm25_worker, [pm25.sensor_key(n) for n in range(len(devices))])
+    for addr in ccs811_addrs:
+        supervisor.add('ccs811.' + hex(addr), ccs811_worker(addr), ['tvoc.' + hex(addr)])
+    if bme680_addr:
+        supervisor.add('bme680', bme680_worker, ['bme680.' + hex(bme680_addr)])
+    supervisor.start()
+
+# Without stop() the supervisor and its workers outlive an error below.
+try:
+    if args.duration:
+        threading.Timer(args.duration, stop.set).start()
+
+    for _ in background:
+        _.start()
+    if args.metrics_port:
+        metrics.default.serve(args.metrics_port)
+
+    if args.asyncio:
+        import aio
+        if args.duration:
+            threading.Timer(args.duration, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        try:
+            aio.main(pm25_history, tvoc_histories, bus=smbus, port=ports and ports[0],
+                     checkpoint=device_state, flip=args.display_flip, spi=display_spi,
+                     graph=display_graph, device=devices[0], bme680_addr=bme680_addr,
+                     bme680_interval=3 / args.speed if args.fake else 3, env=env,
+                     ccs811_interval=1 / args.speed, interrupt_pins=interrupt_pins, gpio=gpio)
+        finally:
+            stop.set()
+            for _ in background:
+                _.join()
+            if args.fake:
+                report()
+        raise SystemExit
+
+    def sigterm_handler(*_):
+        print('caught sigterm')
+        stop.set()
+
+    signal.signal(signal.SIGTERM, sigterm_handler)
+
+    # All devices on bus 1 share it through one manager, sensor reads first.
+    bus = i2cbus.BusManager(smbus2.SMBus(1) if smbus is None else smbus)
+
+    display_thread = threading.Thread(
+        target=ssd1306.display_loop,
+        args=(0x3c, stop, readings.default, bus.client('ssd1306.0x3c', i2cbus.DISPLAY), device_state,
+              args.display_flip, display_spi, display_graph))
+
+    if args.processes:
+        threads = [
+            display_thread,
+            threading.Thread(target=page.mirror, args=(readings.default, stop))]
+    else:
+        if len(devices) > 1:
+            pm25_thread = threading.Thread(target=pm25.multi_pm25_loop,
+                                           args=(ports or devices, stop, {0: pm25_history}))
+        else:
+            pm25_thread = threading.Thread(target=pm25.pm25_loop,
+                                           args=(stop, pm25_history, readings.default,
+                                                 ports and ports[0], devices[0]))
+
+        threads = [display_thread, pm25_thread]
+        threads += [threading.Thread(target=ccs811.ccs811_loop,
+                                     args=(addr, stop, tvoc_histories[addr], readings.default,
+                                           bus.client('ccs811.' + hex(addr), i2cbus.SENSOR),
+                                           1 / args.speed, interrupt_pins.get(addr), gpio, env,
+                                           device_state))
+                    for addr in ccs811_addrs]
+        if bme680_addr:
+            threads.append(threading.Thread(target=bme680.bme680_loop,
+                                            args=(bme680_addr, stop, readings.default,
+                                                  bus.client('bme680.' + hex(bme680_addr), i2cbus.SENSOR),
+                                                  3 / args.speed if args.fake else 3)))
+
+    for _ in threads:
+        _.start()
+
+    while not stop.is_set():
+        time.sleep(1)
+
+    for _ in threads + background:
+        _.join()
+    if args.processes:
+        supervisor.stop()
+
+    print('i2c:', bus.stats())
+    bus.close()
+    if args.fake:
+        report()
+    print('exit')
+finally:
+    stop.set()
+    # A no-op unless the code above failed.
+    if args.processes:
+        supervisor.stop()
@@ -0,0 +1,116 @@
+import bisect
+import collections
+import math
+
+# EPA PM2.5 breakpoints (2024 revision): (high concentration in ug/m3, low
+# AQI, high AQI, category, short name for the display). Concentrations are
+# truncated to one decimal before the lookup, so each range starts 0.1
+# above the previous high.
+_BREAKPOINTS = [
+    (9.0, 0, 50, 'Good', 'GOOD'),
+    (35.4, 51, 100, 'Moderate', 'MODERATE'),
+    (55.4, 101, 150, 'Unhealthy for Sensitive Groups', 'USG'),
+    (125.4, 151, 200, 'Unhealthy', 'UNHEALTHY'),
+    (225.4, 201, 300, 'Very Unhealthy', 'V.UNHEALTHY'),
+    (325.4, 301, 500, 'Hazardous', 'HAZARDOUS'),
+]
+_HIGHS = [b[0] for b in _BREAKPOINTS]
+# (low concentration, low AQI, AQI per ug/m3, category, short name)
+_TABLE = []
+for i, (high, i_low, i_high, category, short) in enumerate(_BREAKPOINTS):
+    low = _BREAKPOINTS[i - 1][0] + 0.1 if i else 0.0
+    _TABLE.append((low, i_low, (i_high - i_low) / (high - low), category, short))
+
+AQI = collections.namedtuple('AQI', ['nowcast', 'aqi', 'category', 'short'])
+
+
+def _truncate(c):
+    return math.floor(c * 10 + 1e-9) / 10
+
+
+def aqi(concentration):
+    """Returns the AQI of a PM2.5 concentration (ug/m3) as an AQI tuple.
+    Concentrations above the table are extrapolated along the top range."""
+    c = _truncate(max(0.0, concentration))
+    i = min(bisect.bisect_left(_HIGHS, c), len(_TABLE) - 1)
+    low, i_low, slope, category, short = _TABLE[i]
+    return AQI(c, int(round(i_low + slope * (c - low))), category, short)
+
+
+def nowcast(hours):
+    """NowCast of hourly means, most recent first (None for missing hours).
+    Returns None unless 2 of the 3 most recent hours are present."""
+    hours = hours[:12]
+    if sum(1 for c in hours[:3] if c is not None) < 2:
+        return None
+    present = [c for c in hours if c is not None]
+    high = max(present)
+    w = max(0.5, min(present) / high) if high > 0 else 1.0
+    num = den = 0.0
+    f = 1.0
+    for c in hours:
+        if c is not None:
+            num += f * c
+            den += f
+        f *= w
+    return _truncate(num / den)
+
+
+class NowCast(object):
+    """Keeps the NowCast and AQI of PM2.5 up to date as hourly windows
+    close; see rollup.Aggregator. Readings only feed the hourly windows, so
+    the 12-hour NowCast is computed once an hour.
+    """
+
+    def __init__(self, registry=None, key='aqi', channel='pm2_5'):
+        self._registry = registry
+        self._key = key
+        self._channel = channel
+        # Hourly means, most recent first, None for missing hours.
+        self._hours = collections.deque(maxlen=12)
+        self._last = None
+        self.value = None
+
+    def add_hour(self, start, mean):
+        """Adds the mean of the hour starting at start (seconds)."""
+        if self._last is not None:
+            if start <= self._last:
+                return
+            gap = min(12, (start - self._last) // 3600 - 1)
+            self._hours.extendleft([None] * gap)
+        self._last = start
+        self._hours.appendleft(mean)
+        c = nowcast(list(self._hours))
+        self.value = None if c is None else aqi(c)
+        if self._registry is not None and self.value is not None:
+            self._registry.publish(self._key, self.value)
+
+    def on_window(self, window):
+        """rollup.Aggregator subscriber for the hourly PM2.5 windows."""
+        self.add_hour(window.start, window.stats[self._channel].mean)
+
+
+def hourly_means(readings, start, end):
+    """Means over each hour from start to end (multiples of an hour) of
+    readings, an iterable of (time, value) such as a readlog.Reader range;
+    None for hours without readings. Keeps only a sum and count per hour."""
+    sums = [0.0] * ((end - start) // 3600)
+    counts = [0] * len(sums)
+    for when, value in readings:
+        if start <= when < end:
+            i = int(when - start) // 3600
+            sums[i] += value
+            counts[i] += 1
+    return [s / n if n else None for s, n in zip(sums, counts)]
+
+
+def batch(hours):
+    """Back-computes the AQI at the end of every hour of hourly means
+    (oldest first). Returns a list with an AQI or None per hour."""
+    result = []
+    recent = collections.deque(maxlen=12)
+    for c in hours:
+        recent.appendleft(c)
+        n = nowcast(list(recent))
+        result.append(None if n is None else aqi(n))
+    return result
@@ -0,0 +1,64 @@
+import unittest
+
+import aqi
+import readings
+import rollup
+
+
+class AQITest(unittest.TestCase):
+
+    def test_aqi(self):
+        self.assertEqual(0, aqi.aqi(0).aqi)
+        self.assertEqual(50, aqi.aqi(9.0).aqi)
+        self.assertEqual(50, aqi.aqi(9.09).aqi)
+        self.assertEqual(51, aqi.aqi(9.1).aqi)
+        self.assertEqual(56, aqi.aqi(12.0).aqi)
+        self.assertEqual('Moderate', aqi.aqi(12.0).category)
+        self.assertEqual(101, aqi.aqi(35.5).aqi)
+        self.assertEqual(150, aqi.aqi(55.4).aqi)
+        self.assertEqual(500, aqi.aqi(325.4).aqi)
+        self.assertEqual('HAZARDOUS', aqi.aqi(400).short)
+
+    def test_nowcast(self):
+        self.assertIsNone(aqi.nowcast([10]))
+        self.assertIsNone(aqi.nowcast([10, None, None, 10]))
+        self.assertEqual(12.0, aqi.nowcast([12.0] * 12))
+        # w = 0.5
+        self.assertEqual(33.3, aqi.nowcast([40, 20]))
+        self.assertEqual(36.0, aqi.nowcast([40, None, 20, None]))
+        # Only the last 12 hours count.
+        self.assertEqual(12.0, aqi.nowcast([12.0] * 12 + [500]))
+
+    def test_incremental(self):
+        registry = readings.Registry()
+        n = aqi.NowCast(registry)
+        n.add_hour(0, 40)
+        self.assertIsNone(n.value)
+        self.assertIsNone(registry.get('aqi'))
+        n.add_hour(3600, 20)
+        self.assertEqual(aqi.aqi(aqi.nowcast([20, 40])), n.value)
+        self.assertEqual(n.value, registry.get('aqi').value)
+        # A gap of two hours.
+        n.add_hour(3 * 3600, 20)
+        self.assertEqual(aqi.nowcast([20, None, 20, 40]), n.value.nowcast)
+
+    def test_on_window(self):
+        n = aqi.NowCast()
+        summary = rollup.Summary(1, 10, 10, 10.0, 0, {})
+        n.on_window(rollup.Window('pm25', 3600, 0, {'pm2_5': summary}))
+        n.on_window(rollup.Window('pm25', 3600, 3600, {'pm2_5': summary}))
+        self.assertEqual(10.0, n.value.nowcast)
+
+    def test_batch(self):
+        readings = [(1800.0, 10), (3000.0, 20), (5400.0, 30), (12600.0, 40), (14400.0, 50)]
+        hours = aqi.hourly_means(iter(readings), 0, 4 * 3600)
+        self.assertEqual([15, 30, None, 40], hours)
+        result = aqi.batch(hours)
+        self.assertIsNone(result[0])
+        self.assertEqual(aqi.aqi(aqi.nowcast([30, 15])), result[1])
+        self.assertEqual(aqi.aqi(aqi.nowcast([None, 30, 15])), result[2])
+        self.assertEqual(aqi.aqi(aqi.nowcast([40, None, 30, 15])), result[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import collections
+import os
+import struct
+import time
+import zlib
+
+# Sequence number, wall clock time, baseline and CRC-32 of the rest.
+RECORD = struct.Struct('<IdH2xI')
+_BODY = struct.Struct('<IdH2x')
+
+Record = collections.namedtuple('Record', ['seq', 'when', 'baseline'])
+
+
+class BaselineStore(object):
+    """Fixed-size ring of checksummed baseline records in one file.
+
+    Record n goes to slot n % slots with a single pwrite, so appending
+    never rewrites the file and a torn write loses at most the record being
+    written: its checksum fails and the previous one is the latest again.
+    The slots are scanned once on open.
+
+    A new file is created with all its slots (zeros, which fail the
+    checksum), so the size of an existing file gives its number of slots.
+    """
+
+    def __init__(self, path, slots=30):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size >= RECORD.size:
+            slots = size // RECORD.size
+        else:
+            os.ftruncate(self.fd, slots * RECORD.size)
+        self.slots = slots
+        self._latest = None
+        for r in self.records():
+            self._latest = r
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def records(self):
+        """Returns the valid records, oldest first."""
+        data = os.pread(self.fd, self.slots * RECORD.size, 0)
+        records = []
+        for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+            seq, when, baseline, crc = RECORD.unpack_from(data, offset)
+            if crc == zlib.crc32(data[offset:offset + _BODY.size]):
+                records.append(Record(seq, when, baseline))
+        records.sort()
+        return records
+
+    def latest(self):
+        """Returns the newest valid Record or None."""
+        return self._latest
+
+    def append(self, baseline, when=None, fsync=True):
+        seq = self._latest.seq + 1 if self._latest else 0
+        body = _BODY.pack(seq, time.time() if when is None else when, baseline)
+        os.pwrite(self.fd, body + struct.pack('<I', zlib.crc32(body)),
+                  seq % self.slots * RECORD.size)
+        if fsync:
+            os.fsync(self.fd)
+        self._latest = Record(*_BODY.unpack(body))
+        return self._latest
+
+
+def open_store(prefix, addr, slots=30):
+    """Opens the store of the CCS811 at addr, importing the old text file
+    of one baseline per line (oldest first) if the store is new."""
+    path = '%s.%s.ring' % (prefix, hex(addr))
+    exists = os.path.exists(path)
+    store = BaselineStore(path, slots)
+    if not exists:
+        text = '%s.%s' % (prefix, hex(addr))
+        lines = []
+        try:
+            with open(text) as f:
+                for line in f:
+                    try:
+                        lines.append(int(line))
+                    except ValueError:
+                        pass
+            mtime = os.stat(text).st_mtime
+        except IOError:
+            pass
+        for baseline in lines[-store.slots:]:
+            store.append(baseline, when=mtime, fsync=False)
+        os.fsync(store.fd)
+    return store
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+import baselines
+
+
+class BaselineStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'baseline.0x5a.ring')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_empty(self):
+        with baselines.BaselineStore(self.path) as store:
+            self.assertIsNone(store.latest())
+            self.assertEqual(store.records(), [])
+
+    def test_keeps_newest(self):
+        with baselines.BaselineStore(self.path, slots=4) as store:
+            for i in range(10):
+                store.append(1000 + i, when=i + 1)
+            self.assertEqual(store.latest(), baselines.Record(9, 10, 1009))
+        self.assertEqual(os.path.getsize(self.path), 4 * baselines.RECORD.size)
+        # The size of an existing file wins over slots.
+        with baselines.BaselineStore(self.path, slots=30) as store:
+            self.assertEqual(store.slots, 4)
+            self.assertEqual([r.baseline for r in store.records()], [1006, 1007, 1008, 1009])
+            self.assertEqual(store.latest().baseline, 1009)
+            store.append(1010)
+            self.assertEqual([r.baseline for r in store.records()], [1007, 1008, 1009, 1010])
+
+    def test_reopen_partly_filled(self):
+        for i in range(5):
+            with baselines.BaselineStore(self.path, slots=30) as store:
+                self.assertEqual(store.slots, 30)
+                self.assertEqual([r.baseline for r in store.records()], list(range(100, 100 + i)))
+                store.append(100 + i)
+        self.assertEqual(os.path.getsize(self.path), 30 * baselines.RECORD.size)
+
+    def test_torn_write(self):
+        with baselines.BaselineStore(self.path, slots=4) as store:
+            for i in range(6):
+                store.append(1000 + i, when=i + 1)
+        # Record 5 lives in slot 1; tear it.
+        with open(self.path, 'r+b') as f:
+            f.seek(baselines.RECORD.size + 10)
+            f.write(b'\xff\xff')
+        with baselines.BaselineStore(self.path) as store:
+            self.assertEqual(store.latest(), baselines.Record(4, 5, 1004))
+            self.assertEqual(store.append(2000).seq, 5)
+
+    def test_migrate_text_file(self):
+        prefix = os.path.join(self.tmp.name, 'baseline')
+        with open(prefix + '.0x5a', 'w') as f:
+            f.write('\n'.join(str(i) for i in range(100, 140)) + '\nbad\n')
+        with baselines.open_store(prefix, 0x5a, slots=30) as store:
+            self.assertEqual(store.latest().baseline, 139)
+            self.assertEqual(len(store.records()), 30)
+            store.append(7)
+        # Imported once only.
+        with baselines.open_store(prefix, 0x5a) as store:
+            self.assertEqual(store.latest().baseline, 7)
+            self.assertEqual(len(store.records()), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Microbenchmarks of the decode and render hot paths; no hardware needed.
+
+Reports ns/op and the bytes and blocks allocated per op (tracemalloc peak
+above the starting point, and blocks still held afterwards). Save a
+baseline with --save and compare later runs against it with --compare:
+
+    ./bench.py --save
+    ./bench.py --compare > bench_output.txt
+"""
+
+import argparse
+import collections
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import smbus2  # pip install smbus2
+
+import ccs811
+import fakes
+import history
+import pm25
+import ssd1306
+import util
+
+BASELINE = 'bench_baseline.json'
+
+Result = collections.namedtuple('Result', ['ns', 'alloc_bytes', 'blocks'])
+
+
+class RecordingBus(object):
+    """Counts the I2C block writes and bytes of a device."""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self.writes += 1
+        self.bytes += len(data)
+
+
+class MarshallingBus(RecordingBus):
+    """A RecordingBus that also takes i2c_rdwr messages and builds the
+    ioctl arguments smbus2 would, to compare SMBus blocks with combined
+    transfers short of the system calls."""
+
+    def write_i2c_block_data(self, addr, reg, data):
+        super(MarshallingBus, self).write_i2c_block_data(addr, reg, data)
+        msg = smbus2.smbus2.i2c_smbus_ioctl_data.create(
+            read_write=smbus2.smbus2.I2C_SMBUS_WRITE, command=reg,
+            size=smbus2.smbus2.I2C_SMBUS_I2C_BLOCK_DATA)
+        msg.data.contents.byte = len(data)
+        msg.data.contents.block[1:len(data) + 1] = data
+
+    def i2c_rdwr(self, *msgs):
+        self.writes += 1
+        self.bytes += sum(m.len for m in msgs)
+        smbus2.smbus2.i2c_rdwr_ioctl_data.create(*msgs)
+
+
+def _frame():
+    return next(fakes.synthetic_pms5003(1, seed=0))
+
+
+def bench_is_valid():
+    frame = _frame()
+    return lambda: pm25.is_valid(frame)
+
+
+def bench_parse():
+    frame = _frame()
+    return lambda: pm25.parse_pms5003_message(frame)
+
+
+def bench_reader_feed():
+    reader = pm25.PMS5003Reader()
+    frame = _frame()
+    return lambda: reader.feed(frame)
+
+
+def bench_ring_buffer_put():
+    buf = util.RingBuffer(3600)
+    return lambda: buf.put(1)
+
+
+def bench_ring_buffer_get():
+    buf = util.RingBuffer(3600)
+    return buf.get
+
+
+def bench_ccs811_result():
+    data = [0x01, 0x90, 0x00, 0x20, 0x98, 0x00, 0x84, 0x10]
+    return lambda: ccs811.Result(data)
+
+
+def _puts(method, text, **kwargs):
+    dev = ssd1306.SSD1306Device(RecordingBus(), 0x3c)
+    texts = [text, text[::-1]]
+    i = [0]
+
+    def op():
+        i[0] ^= 1
+        getattr(dev, method)(texts[i[0]], **kwargs)
+        dev.flush()
+
+    return op
+
+
+def _full_frame(**kwargs):
+    dev = ssd1306.SSD1306Device(MarshallingBus(), 0x3c, **kwargs)
+
+    def op():
+        dev.fb.invalidate()
+        dev.flush()
+
+    return op
+
+
+def bench_full_frame_blocks():
+    return _full_frame(max_transfer=ssd1306.SMBUS_BLOCK)
+
+
+def bench_full_frame_i2c_rdwr():
+    return _full_frame()
+
+
+def bench_puts():
+    return _puts('puts', 'PM2.5 12 ug/m3', row=3)
+
+
+def bench_puts2():
+    return _puts('puts2', 'PM2.5 12', row=2)
+
+
+def bench_puts4():
+    return _puts('puts4', '12.3', row=0)
+
+
+def bench_graph():
+    # Only this benchmark needs numpy.
+    import graph
+    # A full day at 1 Hz, drawn as two alternating plots.
+    h = history.History(['a', 'b'], 24 * 3600)
+    for i in range(24 * 3600):
+        h.append([i % 500, (7 * i) % 300], i)
+    now = 24 * 3600
+    g = graph.Graph([graph.Plot('A', h, 'a'), graph.Plot('B', h, 'b')], span=24 * 3600)
+    dev = ssd1306.SSD1306Device(RecordingBus(), 0x3c)
+    i = [0]
+
+    def op():
+        i[0] ^= 1
+        title, pages = g.render(g.plots[i[0]], 3, now)
+        dev.puts(title, row=0)
+        dev.blit(pages, row=1)
+        dev.flush()
+
+    return op
+
+
+BENCHMARKS = collections.OrderedDict(
+    (name[len('bench_'):], f) for name, f in sorted(globals().items())
+    if name.startswith('bench_'))
+
+
+def _time(op, n):
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        op()
+    return time.perf_counter_ns() - start
+
+
+def measure(make, min_time=0.2, repeat=5, alloc_ops=100):
+    """Returns the Result of the op made by make(): the best of repeat
+    timings of min_time / repeat seconds each, like timeit."""
+    op = make()
+    op()
+    n = 1
+    while _time(op, n) < min_time / repeat * 1e9:
+        n *= 2
+    ns = min(_time(op, n) for _ in range(repeat)) / n
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(alloc_ops):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            op()
+            peak += tracemalloc.get_traced_memory()[1] - current
+        before = sys.getallocatedblocks()
+        for _ in range(alloc_ops):
+            op()
+        blocks = (sys.getallocatedblocks() - before) / alloc_ops
+    finally:
+        tracemalloc.stop()
+    return Result(ns, peak / alloc_ops, blocks)
+
+
+def compare(results, baseline, threshold):
+    """Prints results next to baseline; returns the names of the benchmarks
+    more than threshold (a fraction) slower."""
+    regressions = []
+    print('%-20s %12s %12s %8s %12s %8s' % ('benchmark', 'ns/op', 'baseline', 'change',
+                                             'alloc B/op', 'blocks'))
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base:
+            change = r.ns / base['ns'] - 1
+            if change > threshold:
+                regressions.append(name)
+            print('%-20s %12.0f %12.0f %+7.1f%% %12.1f %8.2f%s' % (
+                name, r.ns, base['ns'], 100 * change, r.alloc_bytes, r.blocks,
+                ' REGRESSION' if change > threshold else ''))
+        else:
+            print('%-20s %12.0f %12s %8s %12.1f %8.2f' % (
+                name, r.ns, '-', '-', r.alloc_bytes, r.blocks))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='exit with status 1 if a benchmark regressed')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown counted as a regression (default 0.2 = 20%%)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to time each benchmark for')
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    results = collections.OrderedDict()
+    for name in names:
+        try:
+            results[name] = measure(BENCHMARKS[name], args.min_time)
+        except ImportError as e:
+            print('%s: skipped (%s)' % (name, e))
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    regressions = compare(results, baseline, args.threshold)
+    if args.save:
+        baseline.update((name, r._asdict()) for name, r in results.items())
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+    if args.compare and regressions:
+        print('regressed:', ' '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
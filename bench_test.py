@@ -0,0 +1,33 @@
+import contextlib
+import io
+import unittest
+
+import bench
+
+
+class BenchTest(unittest.TestCase):
+
+    def test_all_benchmarks_run(self):
+        for name, make in bench.BENCHMARKS.items():
+            r = bench.measure(make, min_time=0.001, alloc_ops=2)
+            self.assertGreater(r.ns, 0, name)
+
+    def test_recording_bus(self):
+        bus = bench.RecordingBus()
+        dev = bench.ssd1306.SSD1306Device(bus, 0x3c)
+        dev.puts('AB', row=0)
+        dev.flush()
+        self.assertGreater(bus.writes, 0)
+        self.assertGreaterEqual(bus.bytes, 12)
+
+    def test_compare(self):
+        results = {'a': bench.Result(130, 0, 0), 'b': bench.Result(100, 0, 0),
+                   'c': bench.Result(100, 0, 0)}
+        baseline = {'a': {'ns': 100}, 'b': {'ns': 100}}
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(bench.compare(results, baseline, 0.2), ['a'])
+        self.assertIn('REGRESSION', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
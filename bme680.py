@@ -0,0 +1,247 @@
+import collections
+import struct
+import sys
+import time
+
+import i2cbus
+import metrics
+import readings
+import util
+
+CHIP_ID = 0x61
+
+# Oversampling setting (1..5 for x1..x16) -> measurement cycles.
+_CYCLES = [0, 1, 2, 4, 8, 16]
+
+# Gas range -> constants of the integer gas resistance formula.
+_GAS_K1 = [2147483647, 2147483647, 2147483647, 2147483647, 2147483647, 2126008810,
+           2147483647, 2130303777, 2147483647, 2147483647, 2143188679, 2136746228,
+           2147483647, 2126008810, 2147483647, 2147483647]
+_GAS_K2 = [4096000000, 2048000000, 1024000000, 512000000, 255744255, 127110228,
+           64000000, 32258064, 16016016, 8000000, 4000000, 2000000, 1000000, 500000,
+           250000, 125000]
+
+# 0x8a..0xa0, 0xe1..0xee and 0x00..0x04 concatenated, see Calibration.
+_COEFF = struct.Struct('<hbxHhbxhhbbxxhhB' '3x3bBbHhbb' 'bxBxb')
+
+
+def _div(a, b):
+    """C integer division, which rounds towards zero."""
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+class Calibration(collections.namedtuple('Calibration', [
+        't1', 't2', 't3', 'p1', 'p2', 'p3', 'p4', 'p5', 'p6', 'p7', 'p8', 'p9', 'p10',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'h7', 'gh1', 'gh2', 'gh3',
+        'res_heat_val', 'res_heat_range', 'range_sw_err'])):
+
+    def __new__(cls, coeff1, coeff2, coeff3):
+        """Parses the 23, 14 and 5 bytes read from 0x8a, 0xe1 and 0x00."""
+        (t2, t3, p1, p2, p3, p4, p5, p7, p6, p8, p9, p10,
+         h3, h4, h5, h6, h7, t1, gh2, gh1, gh3,
+         res_heat_val, res_heat_range, range_sw_err) = _COEFF.unpack(
+             bytes(coeff1) + bytes(coeff2) + bytes(coeff3))
+        # h1 and h2 are 12 bits, sharing the nibbles of 0xe2.
+        h1 = coeff2[2] << 4 | coeff2[1] & 0xf
+        h2 = coeff2[0] << 4 | coeff2[1] >> 4
+        return super(Calibration, cls).__new__(
+            cls, t1, t2, t3, p1, p2, p3, p4, p5, p6, p7, p8, p9, p10,
+            h1, h2, h3, h4, h5, h6, h7, gh1, gh2, gh3,
+            res_heat_val, (res_heat_range & 0x30) >> 4, range_sw_err >> 4)
+
+    def t_fine(self, temp_adc):
+        var1 = (temp_adc >> 3) - (self.t1 << 1)
+        var2 = (var1 * self.t2) >> 11
+        var3 = ((((var1 >> 1) * (var1 >> 1)) >> 12) * (self.t3 << 4)) >> 14
+        return var2 + var3
+
+    def temperature(self, t_fine):
+        """In 0.01 degC."""
+        return (t_fine * 5 + 128) >> 8
+
+    def pressure(self, t_fine, pres_adc):
+        """In Pa."""
+        var1 = (t_fine >> 1) - 64000
+        var2 = ((((var1 >> 2) * (var1 >> 2)) >> 11) * self.p6) >> 2
+        var2 = var2 + ((var1 * self.p5) << 1)
+        var2 = (var2 >> 2) + (self.p4 << 16)
+        var1 = (((((var1 >> 2) * (var1 >> 2)) >> 13) * (self.p3 << 5)) >> 3) + \
+            ((self.p2 * var1) >> 1)
+        var1 = var1 >> 18
+        var1 = ((32768 + var1) * self.p1) >> 15
+        if not var1:
+            return 0
+        p = (1048576 - pres_adc - (var2 >> 12)) * 3125
+        p = _div(p, var1) << 1 if p >= 1 << 30 else _div(p << 1, var1)
+        var1 = (self.p9 * (((p >> 3) * (p >> 3)) >> 13)) >> 12
+        var2 = ((p >> 2) * self.p8) >> 13
+        var3 = ((p >> 8) * (p >> 8) * (p >> 8) * self.p10) >> 17
+        return p + ((var1 + var2 + var3 + (self.p7 << 7)) >> 4)
+
+    def humidity(self, t_fine, hum_adc):
+        """In 0.001 %RH."""
+        t = (t_fine * 5 + 128) >> 8
+        var1 = hum_adc - self.h1 * 16 - (_div(t * self.h3, 100) >> 1)
+        var2 = (self.h2 * (_div(t * self.h4, 100) +
+                           _div((t * _div(t * self.h5, 100)) >> 6, 100) + (1 << 14))) >> 10
+        var3 = var1 * var2
+        var4 = ((self.h6 << 7) + _div(t * self.h7, 100)) >> 4
+        var5 = ((var3 >> 14) * (var3 >> 14)) >> 10
+        var6 = (var4 * var5) >> 1
+        h = (((var3 + var6) >> 10) * 1000) >> 12
+        return min(100000, max(0, h))
+
+    def gas_resistance(self, gas_adc, gas_range):
+        """In ohms."""
+        var1 = ((1340 + 5 * self.range_sw_err) * _GAS_K1[gas_range]) >> 16
+        var2 = (gas_adc << 15) - 16777216 + var1
+        var3 = (_GAS_K2[gas_range] * var1) >> 9
+        return _div(var3 + (var2 >> 1), var2)
+
+    def heater_resistance(self, target, ambient=25):
+        """res_heat_0 for a heater target temperature in degC."""
+        target = min(target, 400)
+        var1 = _div(ambient * self.gh3, 1000) * 256
+        var2 = (self.gh1 + 784) * _div(_div((self.gh2 + 154009) * target * 5, 100) + 3276800, 10)
+        var3 = var1 + _div(var2, 2)
+        var4 = _div(var3, self.res_heat_range + 4)
+        var5 = 131 * self.res_heat_val + 65536
+        return (_div((_div(var4, var5) - 250) * 34 + 50, 100)) & 0xff
+
+
+def gas_wait(ms):
+    """gas_wait_0 for a heating duration in ms (up to about 4 s)."""
+    if ms >= 0xfc0:
+        return 0xff
+    factor = 0
+    while ms > 0x3f:
+        ms //= 4
+        factor += 1
+    return ms + factor * 64
+
+
+# temperature in degC, pressure in hPa, humidity in %RH and gas_resistance
+# in ohms (None without a valid gas measurement).
+Measurement = collections.namedtuple(
+    'Measurement', ['temperature', 'pressure', 'humidity', 'gas_resistance'])
+
+
+class BME680(object):
+    """Forced mode BME680. The calibration is read once; afterwards every
+    measurement is one register write and one 15-byte burst read."""
+
+    def __init__(self, bus, addr=0x77, osrs_t=2, osrs_p=1, osrs_h=1, filter=0,
+                 heater_temp=None, heater_ms=150):
+        """Oversampling settings are 1..5 for x1..x16. Without heater_temp
+        (degC) the gas sensor stays off."""
+        assert addr in (0x76, 0x77)
+        self.bus = bus
+        self.addr = addr
+        self.osrs_t = osrs_t
+        self.osrs_p = osrs_p
+        self.osrs_h = osrs_h
+        self.filter = filter
+        self.heater_temp = heater_temp
+        self.heater_ms = heater_ms
+        self.calibration = None
+
+    def is_device(self):
+        return self.bus.read_byte_data(self.addr, 0xd0) == CHIP_ID
+
+    def reset(self, wait=0.010):
+        self.bus.write_byte_data(self.addr, 0xe0, 0xb6)
+        time.sleep(wait)
+
+    def read_calibration(self):
+        self.calibration = Calibration(
+            self.bus.read_i2c_block_data(self.addr, 0x8a, 23),
+            self.bus.read_i2c_block_data(self.addr, 0xe1, 14),
+            self.bus.read_i2c_block_data(self.addr, 0x00, 5))
+        return self.calibration
+
+    def setup(self):
+        """Reads the calibration and writes the configuration."""
+        if self.calibration is None:
+            self.read_calibration()
+        self.bus.write_byte_data(self.addr, 0x72, self.osrs_h)
+        self.bus.write_byte_data(self.addr, 0x75, self.filter << 2)
+        if self.heater_temp is None:
+            self.bus.write_byte_data(self.addr, 0x71, 0)
+        else:
+            self.bus.write_byte_data(self.addr, 0x5a,
+                                     self.calibration.heater_resistance(self.heater_temp))
+            self.bus.write_byte_data(self.addr, 0x64, gas_wait(self.heater_ms))
+            # run_gas, heater set point 0.
+            self.bus.write_byte_data(self.addr, 0x71, 0x10)
+
+    def duration(self):
+        """Seconds a forced measurement takes."""
+        us = (_CYCLES[self.osrs_t] + _CYCLES[self.osrs_p] + _CYCLES[self.osrs_h]) * 1963
+        us += 477 * 4 + 477 * 5 + 1000
+        if self.heater_temp is not None:
+            us += self.heater_ms * 1000
+        return us / 1e6
+
+    def trigger(self):
+        self.bus.write_byte_data(self.addr, 0x74,
+                                 self.osrs_t << 5 | self.osrs_p << 2 | 1)
+
+    def read(self):
+        """Returns the Measurement of the last triggered conversion, or
+        None if it is not done yet."""
+        d = self.bus.read_i2c_block_data(self.addr, 0x1d, 15)
+        if not d[0] & 0x80:
+            return None
+        pres_adc = d[2] << 12 | d[3] << 4 | d[4] >> 4
+        temp_adc = d[5] << 12 | d[6] << 4 | d[7] >> 4
+        hum_adc = d[8] << 8 | d[9]
+        cal = self.calibration
+        t_fine = cal.t_fine(temp_adc)
+        gas = None
+        if self.heater_temp is not None and d[14] & 0x30 == 0x30:
+            # Valid and the heater reached its target.
+            gas = cal.gas_resistance(d[13] << 2 | d[14] >> 6, d[14] & 0xf)
+        return Measurement(cal.temperature(t_fine) / 100, cal.pressure(t_fine, pres_adc) / 100,
+                           cal.humidity(t_fine, hum_adc) / 1000, gas)
+
+    def measure(self):
+        self.trigger()
+        time.sleep(self.duration())
+        for _ in range(10):
+            m = self.read()
+            if m is not None:
+                return m
+            time.sleep(0.005)
+        raise RuntimeError('BME680 measurement did not finish')
+
+
+def bme680_loop(addr=0x77, stop=None, registry=readings.default, bus=None, interval=3,
+                heater_temp=None):
+    """Publishes a Measurement every interval seconds under
+    'bme680.<addr>'."""
+    key = 'bme680.{}'.format(hex(addr))
+    errors = metrics.default.counter('bme680_errors_total', 'Failed BME680 measurements.',
+                                     device=hex(addr))
+    with util.flock('/tmp/bme680.{}.lock'.format(hex(addr))):
+        with i2cbus.maybe_open(bus) as bus:
+            dev = BME680(bus, addr, heater_temp=heater_temp)
+            assert dev.is_device()
+            dev.setup()
+            deadline = time.monotonic()
+            while stop is None or not stop.is_set():
+                try:
+                    m = dev.measure()
+                    registry.publish(key, m)
+                    print('BME680.{:x}:'.format(addr), m)
+                except Exception as e:
+                    errors.inc()
+                    print(e)
+                    registry.publish(key, e)
+                deadline += interval
+                time.sleep(max(0, deadline - time.monotonic()))
+        print('exit bme680', hex(addr))
+
+
+if __name__ == '__main__':
+    bme680_loop(int(sys.argv[1], 16) if len(sys.argv) > 1 else 0x77)
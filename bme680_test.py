@@ -0,0 +1,136 @@
+import time
+import unittest
+
+import bme680
+import ccs811
+import fakes
+import readings
+
+_GAS_C1 = [1, 1, 1, 1, 1, 0.99, 1, 0.992, 1, 1, 0.998, 0.995, 1, 0.99, 1, 1]
+_GAS_C2 = [8000000, 4000000, 2000000, 1000000, 499500.4995, 248262.1648, 125000,
+           63004.03226, 31281.28128, 15625, 7812.5, 3906.25, 1953.125, 976.5625,
+           488.28125, 244.140625]
+
+
+def float_compensation(c, temp_adc, pres_adc, hum_adc):
+    """The floating point formulas of the datasheet."""
+    var1 = (temp_adc / 16384 - c.t1 / 1024) * c.t2
+    var2 = (temp_adc / 131072 - c.t1 / 8192) ** 2 * c.t3 * 16
+    t_fine = var1 + var2
+    t = t_fine / 5120
+
+    var1 = t_fine / 2 - 64000
+    var2 = var1 * var1 * c.p6 / 131072
+    var2 = var2 + var1 * c.p5 * 2
+    var2 = var2 / 4 + c.p4 * 65536
+    var1 = (c.p3 * var1 * var1 / 16384 + c.p2 * var1) / 524288
+    var1 = (1 + var1 / 32768) * c.p1
+    p = 1048576 - pres_adc
+    p = (p - var2 / 4096) * 6250 / var1
+    var1 = c.p9 * p * p / 2147483648
+    var2 = p * c.p8 / 32768
+    var3 = (p / 256) ** 3 * c.p10 / 131072
+    p = p + (var1 + var2 + var3 + c.p7 * 128) / 16
+
+    var1 = hum_adc - (c.h1 * 16 + c.h3 / 2 * t)
+    var2 = var1 * (c.h2 / 262144 * (1 + c.h4 / 16384 * t + c.h5 / 1048576 * t * t))
+    h = var2 + (c.h6 / 16384 + c.h7 / 2097152 * t) * var2 * var2
+    return t, p, h
+
+
+class CalibrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fakes.FakeBME680()
+        self.cal = self.fake.calibration
+
+    def test_parse(self):
+        self.assertEqual(self.cal._asdict(), fakes.FakeBME680.CALIBRATION)
+
+    def test_integer_matches_float_compensation(self):
+        for temp_adc in (400000, 485000, 560000):
+            for pres_adc in (300000, 400000):
+                for hum_adc in (15000, 22000, 30000):
+                    t, p, h = float_compensation(self.cal, temp_adc, pres_adc, hum_adc)
+                    t_fine = self.cal.t_fine(temp_adc)
+                    self.assertAlmostEqual(self.cal.temperature(t_fine) / 100, t, delta=0.02)
+                    self.assertAlmostEqual(self.cal.pressure(t_fine, pres_adc), p, delta=p * 2e-4)
+                    if 0 < h < 100:
+                        self.assertAlmostEqual(self.cal.humidity(t_fine, hum_adc) / 1000, h,
+                                               delta=0.05)
+
+    def test_gas_resistance(self):
+        for gas_range in range(16):
+            for gas_adc in (100, 512, 900):
+                var1 = 1340 * _GAS_C1[gas_range]
+                expected = var1 * _GAS_C2[gas_range] / (gas_adc - 512 + var1)
+                self.assertAlmostEqual(self.cal.gas_resistance(gas_adc, gas_range) / expected,
+                                       1, delta=0.005)
+
+    def test_gas_wait(self):
+        self.assertEqual(bme680.gas_wait(100), 0x59)
+        self.assertEqual(bme680.gas_wait(63), 63)
+        self.assertEqual(bme680.gas_wait(5000), 0xff)
+
+
+class BME680Test(unittest.TestCase):
+
+    def test_measure(self):
+        fake = fakes.FakeBME680(temperature=23.5, humidity=40, pressure=990, seed=1)
+        bus = fakes.FakeSMBus({0x77: fake})
+        dev = bme680.BME680(bus)
+        self.assertTrue(dev.is_device())
+        dev.setup()
+        self.assertIsNone(dev.read())
+        before = bus.transactions
+        m = dev.measure()
+        # One trigger and one burst read.
+        self.assertEqual(bus.transactions - before, 2)
+        self.assertAlmostEqual(m.temperature, 23.5, delta=0.2)
+        self.assertAlmostEqual(m.humidity, 40, delta=1)
+        self.assertAlmostEqual(m.pressure, 990, delta=0.1)
+        self.assertIsNone(m.gas_resistance)
+
+    def test_gas(self):
+        fake = fakes.FakeBME680()
+        dev = bme680.BME680(fakes.FakeSMBus({0x77: fake}), heater_temp=320, heater_ms=1)
+        dev.setup()
+        self.assertEqual(fake.regs[0x5a], fake.calibration.heater_resistance(320))
+        self.assertEqual(fake.regs[0x71], 0x10)
+        self.assertGreater(dev.measure().gas_resistance, 0)
+
+
+class EnvDataTest(unittest.TestCase):
+
+    def test_rate_limit(self):
+        registry = readings.Registry()
+        env = ccs811.EnvData('bme680.0x77', registry, min_interval=0)
+        self.assertIsNone(env.take(0x5a))
+        registry.publish('bme680.0x77', bme680.Measurement(21.0, 1000, 40.0, None))
+        self.assertEqual(env.take(0x5a), (40.0, 21.0))
+        self.assertEqual(env.take(0x5b), (40.0, 21.0))
+        self.assertIsNone(env.take(0x5a))
+        registry.publish('bme680.0x77', bme680.Measurement(21.2, 1000, 40.5, None))
+        self.assertIsNone(env.take(0x5a))
+        registry.publish('bme680.0x77', bme680.Measurement(21.6, 1000, 40.5, None))
+        self.assertEqual(env.take(0x5a), (40.5, 21.6))
+
+        env.min_interval = 60
+        registry.publish('bme680.0x77', bme680.Measurement(30, 1000, 60, None))
+        self.assertIsNone(env.take(0x5a))
+
+    def test_stale(self):
+        registry = readings.Registry()
+        env = ccs811.EnvData('bme680.0x77', registry)
+        registry.publish('bme680.0x77', bme680.Measurement(21.0, 1000, 40.0, None),
+                         when=time.time() - 600)
+        self.assertIsNone(env.take(0x5a))
+
+    def test_set_env_data(self):
+        fake = fakes.FakeCCS811()
+        ccs811.CCS811(fakes.FakeSMBus({0x5a: fake}), 0x5a).set_env_data(48.5, 25)
+        self.assertEqual(fake.env_data, [0x61, 0x00, 0x64, 0x00])
+
+
+if __name__ == '__main__':
+    unittest.main()
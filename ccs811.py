@@ -1,8 +1,12 @@
 import collections
-import smbus2  # pip install smbus2
+import contextlib
 import sys
 import time
 
+import baselines
+import i2cbus
+import metrics
+import readings
 import util
 
 
@@ -17,6 +21,9 @@ class Error(collections.namedtuple('Error', ['msg_invalid', 'read_reg_invalid',
                                          heater_fault=(byte >> 4) & 1,
                                          heater_supply=(byte >> 5) & 1)
 
+    def to_byte(self):
+        return sum(bit << i for i, bit in enumerate(self))
+
 
 class Status(collections.namedtuple('Status',
                                     ['error', 'data_ready', 'app_valid', 'fw_mode'])):
@@ -27,6 +34,9 @@ class Status(collections.namedtuple('Status',
                                           app_valid=(byte >> 4) & 1,
                                           fw_mode=(byte >> 7) & 1)
 
+    def to_byte(self):
+        return self.error | self.data_ready << 3 | self.app_valid << 4 | self.fw_mode << 7
+
 
 class Mode(collections.namedtuple('Mode', ['drive_mode', 'interrupt', 'thresh'])):
 
@@ -75,6 +85,26 @@ class Result(collections.namedtuple('Result', ['e_co2', 'tvoc', 'status', 'error
         return super(Result, cls).__new__(cls, e_co2=e_co2,
                                           tvoc=tvoc, status=status, error=error, raw=raw)
 
+    def to_bytes(self):
+        """The ALG_RESULT_DATA bytes this was parsed from."""
+        bs = [self.e_co2 >> 8, self.e_co2 & 0xff, self.tvoc >> 8, self.tvoc & 0xff,
+              self.status.to_byte(), self.error.to_byte()]
+        if self.raw is not None:
+            word = self.raw.current << 10 | self.raw.voltage
+            bs += [word >> 8, word & 0xff]
+        return bs
+
+
+FORM_URLS = {
+    0x5a: 'https://docs.google.com/forms/d/e/1FAIpQLScsxaGES6uXJMzOmJDOpCVJCjaX8EZpAb1HOx6McEIwVqGeFw/viewform?usp=pp_url&entry.806682994=0&entry.1017453344=1&entry.1050656656=2&entry.815754693=3',
+    0x5b: 'https://docs.google.com/forms/d/e/1FAIpQLSeOFDSIc_vW59OKUwnwN1jf0D9qm7vZS5ISo0YgSNhd0rwW1A/viewform?usp=pp_url&entry.806682994=0&entry.1017453344=1&entry.1050656656=2&entry.815754693=3',
+}
+
+# Channels of the readings that ccs811_loop appends to a history.History.
+HISTORY_CHANNELS = ('e_co2', 'tvoc', 'current', 'voltage')
+# Attributes of a Result, in the order of the FORM_URLS entries.
+UPLOAD_CHANNELS = ('e_co2', 'tvoc', 'raw.current', 'raw.voltage')
+
 
 class CCS811(object):
 
@@ -110,21 +140,37 @@ class CCS811(object):
             drive_mode=drive_mode, interrupt=interrupt, thresh=thresh).to_byte()
         self.bus.write_byte_data(self.addr, 0x1, byte)
 
-    def switch_mode(self, drive_mode, interrupt=0, thresh=0):
+    def switch_mode_steps(self, drive_mode, interrupt=0, thresh=0):
+        """Switches mode step by step, yielding the number of seconds to wait
+        before the next step. Lets callers wait without blocking a thread."""
         current_mode = self.mode()
         if (current_mode.drive_mode == drive_mode and current_mode.interrupt == interrupt and current_mode.thresh == thresh):
             return
         # TODO: do we need to wait before switching to mode 4?
-        if current_mode.drive_mode and current_mode.drive_mode <= drive_mode:
+        # Only the sample rate matters; toggling the interrupt bit needs no
+        # wait.
+        if current_mode.drive_mode and current_mode.drive_mode < drive_mode:
             print('sleep for 10 minutes before going from mode %d to mode %d' %
                   (current_mode.drive_mode, drive_mode))
             self._set_mode(0)
-            time.sleep(10 * 60)
+            yield 10 * 60
         self._set_mode(drive_mode, interrupt, thresh)
 
+    def switch_mode(self, drive_mode, interrupt=0, thresh=0):
+        for secs in self.switch_mode_steps(drive_mode, interrupt, thresh):
+            time.sleep(secs)
+
     def result(self):
         return Result(self.bus.read_i2c_block_data(self.addr, 0x2, 8))
 
+    def set_env_data(self, humidity, temperature):
+        """Sets the humidity (%RH) and temperature (degC) the readings get
+        compensated for; both are sent in units of 1/512, temperature offset
+        by 25."""
+        h = max(0, min(0xffff, int(round(humidity * 512))))
+        t = max(0, min(0xffff, int(round((temperature + 25) * 512))))
+        self.bus.write_i2c_block_data(self.addr, 0x05, [h >> 8, h & 0xff, t >> 8, t & 0xff])
+
     def baseline(self):
         return self.bus.read_word_data(self.addr, 0x11)
 
@@ -132,28 +178,19 @@ class CCS811(object):
         self.bus.write_word_data(self.addr, 0x11, 0xffff & word)
 
     def save_baseline(self, prefix, max_keep=30):
+        """Appends the current baseline to the ring in
+        <prefix>.<addr>.ring, which keeps the newest max_keep."""
         baseline = self.baseline()
-        path = prefix + '.' + hex(self.addr)
-        with open(path, 'a') as f:
-            pass
-        with open(path) as f:
-            baselines = [int(i) for i in f]
-        with open(path, 'w') as f:
-            for i in baselines[:max_keep - 1]:
-                print(i, file=f)
-            print(baseline, file=f)
+        with baselines.open_store(prefix, self.addr, max_keep) as store:
+            store.append(baseline)
         return hex(baseline)
 
     def maybe_load_baseline(self, prefix):
-        path = prefix + '.' + hex(self.addr)
-        try:
-            with open(path) as f:
-                baselines = [int(i) for i in f]
-        except IOError:
-            baselines = None
-        if baselines:
-            print('setting baseline to', baselines[-1])
-            self.set_baseline(baselines[-1])
+        with baselines.open_store(prefix, self.addr) as store:
+            latest = store.latest()
+        if latest is not None:
+            print('setting baseline to', latest.baseline)
+            self.set_baseline(latest.baseline)
 
     def maybe_start_app(self, max_tries=100):
         num_tries = 0
@@ -173,44 +210,151 @@ class CCS811(object):
         raise RuntimeError(
             'failed to start app after %d tries' % num_tries)
 
-def ccs811_loop(addr, stop=None):
+    def bring_up(self, checkpoint=None, prefix='baseline'):
+        """Starts the app and loads the saved baseline, unless checkpoint (a
+        checkpoint.Checkpoint) shows that was done earlier in this boot and
+        the app still runs in the mode saved by save_checkpoint(). The
+        baseline the app has been adjusting since is newer than the saved
+        one anyway. Returns True for a warm start."""
+        state = checkpoint and checkpoint.load('ccs811.' + hex(self.addr))
+        if state:
+            status = self.status()
+            if (status.fw_mode and not status.error and
+                    self.mode().to_byte() == state['mode']):
+                return True
+        self.maybe_start_app()
+        self.maybe_load_baseline(prefix)
+        return False
+
+    def save_checkpoint(self, checkpoint):
+        checkpoint.save('ccs811.' + hex(self.addr), mode=self.mode().to_byte())
+
+class EnvData(object):
+    """Hands the humidity and temperature published under key (e.g. by
+    bme680.bme680_loop) to CCS811 loops for ENV_DATA. Each device gets them
+    at most every min_interval seconds, and only once they moved by
+    min_humidity %RH or min_temperature degC, so they cost next to no bus
+    time.
+    """
+
+    def __init__(self, key, registry=readings.default, min_interval=60, min_humidity=1.0,
+                 min_temperature=0.5, max_age=300):
+        self.key = key
+        self.registry = registry
+        self.min_interval = min_interval
+        self.min_humidity = min_humidity
+        self.min_temperature = min_temperature
+        self.max_age = max_age
+        # addr -> (monotonic time, humidity, temperature) last handed out
+        self._sent = {}
+
+    def take(self, addr):
+        """Returns (humidity, temperature) if addr is due an update, else
+        None."""
+        r = self.registry.get(self.key)
+        if r is None or isinstance(r.value, Exception) or time.time() - r.when > self.max_age:
+            return None
+        now = time.monotonic()
+        h, t = r.value.humidity, r.value.temperature
+        last = self._sent.get(addr)
+        if last is not None:
+            if now - last[0] < self.min_interval:
+                return None
+            if abs(h - last[1]) < self.min_humidity and abs(t - last[2]) < self.min_temperature:
+                return None
+        self._sent[addr] = now, h, t
+        return h, t
+
+
+def ccs811_loop(addr, stop=None, history=None, registry=readings.default, bus=None,
+                interval=1, interrupt_pin=None, gpio=None, env=None, checkpoint=None):
+    """Reads results every interval seconds (drive mode 1). With the nINT
+    pin wired to board channel interrupt_pin, sleeps until the sensor pulls
+    it low instead and reads each result in one burst, falling back to a
+    status poll when no interrupt comes within 2 intervals. gpio is the
+    RPi.GPIO module or a fake; polling is used if it can't be set up. env
+    is an EnvData for humidity and temperature compensation. With a
+    checkpoint.Checkpoint, a restart skips the set-up the sensor still has.
+    """
 
     def log(*args, **kwargs):
         print('CCS811.{:x}:'.format(addr), *args, **kwargs)
 
     with util.flock('/tmp/tvoc.{}.lock'.format(hex(addr))):
-        status_file = '/tmp/tvoc.{}.txt'.format(hex(addr))
-        throttle = util.Throttle(60)
-        if addr == 0x5a:
-            poster = util.GoogleFormPoster(
-            'https://docs.google.com/forms/d/e/1FAIpQLScsxaGES6uXJMzOmJDOpCVJCjaX8EZpAb1HOx6McEIwVqGeFw/viewform?usp=pp_url&entry.806682994=0&entry.1017453344=1&entry.1050656656=2&entry.815754693=3')
-        else:
-            poster = util.GoogleFormPoster('https://docs.google.com/forms/d/e/1FAIpQLSeOFDSIc_vW59OKUwnwN1jf0D9qm7vZS5ISo0YgSNhd0rwW1A/viewform?usp=pp_url&entry.806682994=0&entry.1017453344=1&entry.1050656656=2&entry.815754693=3')
+        key = 'tvoc.{}'.format(hex(addr))
         baseline_throttle = util.Throttle(24 * 3600)
         baseline_throttle.maybe_run(lambda: None)
-        with smbus2.SMBus(1) as bus:
+        polls = metrics.default.counter('ccs811_status_polls_total', 'CCS811 status reads.',
+                                        device=hex(addr))
+        errors = metrics.default.counter('ccs811_errors_total',
+                                         'CCS811 error reports and failed polls.',
+                                         device=hex(addr))
+        interrupts = metrics.default.counter('ccs811_interrupts_total',
+                                             'CCS811 results read after an nINT edge.',
+                                             device=hex(addr))
+        with i2cbus.maybe_open(bus) as bus, contextlib.ExitStack() as stack:
             dev = CCS811(bus, addr)
             assert dev.is_device()
-            dev.maybe_start_app()
-            dev.maybe_load_baseline('baseline')
-            dev.switch_mode(1)
+            if dev.bring_up(checkpoint):
+                log('app still running, keeping its baseline')
+            nint = None
+            if interrupt_pin is not None:
+                try:
+                    (nint,), _ = stack.enter_context(
+                        util.gpio(inputs=[(interrupt_pin, True)], GPIO=gpio))
+                except Exception as e:
+                    log('no interrupt pin, polling:', e)
+            dev.switch_mode(1, interrupt=int(nint is not None))
+            if checkpoint is not None:
+                dev.save_checkpoint(checkpoint)
+
+            def error():
+                errors.inc()
+                error = dev.error()
+                log(error)
+                registry.publish(key, RuntimeError(str(error)))
+
+            def publish(result):
+                registry.publish(key, result)
+                if history is not None and result.raw is not None:
+                    history.append((result.e_co2, result.tvoc,
+                                    result.raw.current, result.raw.voltage))
+                if result.e_co2 <= 8192 and result.tvoc <= 1187:
+                    log(result)
+                    baseline_throttle.maybe_run(
+                        lambda: dev.save_baseline('baseline'))
+
+            def poll():
+                polls.inc()
+                status = dev.status()
+                if status.error:
+                    error()
+                elif status.data_ready:
+                    publish(dev.result())
+
             while stop is None or not stop.is_set():
                 try:
-                    status = dev.status()
-                    if status.error:
-                        log(dev.error())
-                        util.dump('error', status_file)
-                    elif status.data_ready:
+                    data = env and env.take(addr)
+                    if data:
+                        dev.set_env_data(*data)
+                    if nint is None:
+                        poll()
+                        time.sleep(interval)
+                    elif nint.wait_low(2 * interval):
+                        # The result carries status and error id too, so
+                        # one read also releases nINT.
+                        interrupts.inc()
                         result = dev.result()
-                        util.dump(result.tvoc, status_file)
-                        if result.e_co2 <= 8192 and result.tvoc <= 1187:
-                            log(result, throttle.maybe_run(lambda: poster.post(
-                                None, [result.e_co2, result.tvoc, result.raw.current, result.raw.voltage])))
-                            baseline_throttle.maybe_run(
-                                lambda: dev.save_baseline('baseline'))
+                        if result.status.error:
+                            error()
+                        elif result.status.data_ready:
+                            publish(result)
+                    else:
+                        poll()
                 except Exception as e:
+                    errors.inc()
                     print(e)
-                time.sleep(1)
+                    time.sleep(interval)
         print('exit ccs811', hex(addr))
 
 
@@ -1,7 +1,14 @@
+import os
 import random
+import tempfile
+import threading
 import unittest
 
+import baselines
 import ccs811
+import checkpoint
+import fakes
+import readings
 
 
 def random8():
@@ -59,5 +66,119 @@ class RawDataTest(unittest.TestCase):
         self.assertEqual(0b1010101010, raw.voltage)
 
 
+class RecordingCCS811(fakes.FakeCCS811):
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingCCS811, self).__init__(*args, **kwargs)
+        self.reads = []
+
+    def read(self, reg, length):
+        self.reads.append(reg)
+        return super(RecordingCCS811, self).read(reg, length)
+
+
+class WarmStartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.checkpoint = checkpoint.Checkpoint(self.tmp.name, boot='a')
+        self.fake = RecordingCCS811()
+        self.bus = fakes.FakeSMBus({0x5a: self.fake})
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def start(self):
+        dev = ccs811.CCS811(self.bus, 0x5a)
+        warm = dev.bring_up(self.checkpoint)
+        dev.switch_mode(1)
+        dev.save_checkpoint(self.checkpoint)
+        return warm
+
+    def test_cold_then_warm(self):
+        with baselines.open_store('baseline', 0x5a) as store:
+            store.append(0x1234)
+        self.assertFalse(self.start())
+        self.assertEqual(self.fake.baseline, 0x1234)
+        # The app adjusts its baseline; a restart must not undo that.
+        self.fake.baseline = 0x2345
+        self.fake.reads = []
+        self.assertTrue(self.start())
+        self.assertEqual(self.fake.baseline, 0x2345)
+        # Status and mode, then the mode again in switch_mode and the
+        # checkpoint.
+        self.assertEqual(self.fake.reads, [0x00, 0x01, 0x01, 0x01])
+
+    def test_reset(self):
+        self.start()
+        self.fake.fw_mode = 0
+        self.assertFalse(self.start())
+        self.assertEqual(self.fake.fw_mode, 1)
+
+
+class LoopTest(unittest.TestCase):
+
+    def setUp(self):
+        # The loop loads and saves baselines in the working directory.
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def run_loop(self, dev, **kwargs):
+        registry = readings.Registry()
+        stop = threading.Event()
+        results = []
+
+        def listener(key):
+            results.append(registry.get(key).value)
+            if len(results) >= 3:
+                stop.set()
+
+        registry.add_listener(listener)
+        bus = fakes.FakeSMBus({0x5a: dev})
+        thread = threading.Thread(target=ccs811.ccs811_loop,
+                                  args=(0x5a, stop, None, registry, bus), kwargs=kwargs)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(results), 3)
+        for r in results:
+            self.assertIsInstance(r, ccs811.Result)
+
+    def test_interrupt(self):
+        dev = RecordingCCS811(speed=20)
+        gpio = fakes.FakeGPIO({7: dev.nint})
+        self.run_loop(dev, interval=0.2, interrupt_pin=7, gpio=gpio)
+        self.assertEqual(dev.mode, 0x18)
+        # No status polls once running: a single burst read per result.
+        start = dev.reads.index(0x02)
+        self.assertEqual(dev.reads[start:], [0x02] * 3)
+        self.assertEqual(gpio.channels, {})
+
+    def test_polling_fallback_without_gpio(self):
+        class BrokenGPIO(fakes.FakeGPIO):
+            def setmode(self, mode):
+                raise RuntimeError('not on a Pi')
+
+        dev = RecordingCCS811(speed=20)
+        self.run_loop(dev, interval=0.01, interrupt_pin=7, gpio=BrokenGPIO())
+        self.assertEqual(dev.mode, 0x10)
+        self.assertIn(0x00, dev.reads[dev.reads.index(0x02) - 1:])
+
+    def test_polling_fallback_on_missed_interrupt(self):
+        dev = RecordingCCS811(speed=20)
+        # nINT stuck high.
+        self.run_loop(dev, interval=0.01, interrupt_pin=7, gpio=fakes.FakeGPIO({7: lambda: 1}))
+        self.assertEqual(dev.mode, 0x18)
+        self.assertEqual(dev.reads.count(0x02), 3)
+
+
 if __name__ == '__main__':
     unittest.main()
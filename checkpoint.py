@@ -0,0 +1,56 @@
+import json
+import os
+
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+
+def boot_id():
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+class Checkpoint(object):
+    """What each device was set up with, in a small JSON file per device
+    (<dir>/air_quality.<device>.state) so that device loops in separate
+    processes don't share a file.
+
+    States saved before the last reboot are ignored: the devices lost
+    power since. Within a boot they let a restarted service skip the
+    set-up steps a device still has applied, after checking the device
+    agrees.
+    """
+
+    def __init__(self, dir='/tmp', boot=None):
+        self.dir = dir
+        self.boot = boot_id() if boot is None else boot
+
+    def _path(self, device):
+        return os.path.join(self.dir, 'air_quality.%s.state' % device)
+
+    def load(self, device):
+        """Returns the state dict saved for device during this boot, or
+        None."""
+        try:
+            with open(self._path(device)) as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(saved, dict) or saved.get('boot') != self.boot:
+            return None
+        return saved.get('state')
+
+    def save(self, device, **state):
+        path = self._path(device)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'boot': self.boot, 'state': state}, f)
+        os.replace(tmp, path)
+
+    def clear(self, device):
+        try:
+            os.remove(self._path(device))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+import checkpoint
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_save_load(self):
+        c = checkpoint.Checkpoint(self.tmp.name, boot='a')
+        self.assertIsNone(c.load('ssd1306.0x3c'))
+        c.save('ssd1306.0x3c', on=True)
+        c.save('ccs811.0x5a', mode=0x10)
+        self.assertEqual(checkpoint.Checkpoint(self.tmp.name, boot='a').load('ssd1306.0x3c'),
+                         {'on': True})
+        self.assertEqual(c.load('ccs811.0x5a'), {'mode': 0x10})
+        c.clear('ccs811.0x5a')
+        c.clear('ccs811.0x5a')
+        self.assertIsNone(c.load('ccs811.0x5a'))
+
+    def test_other_boot(self):
+        checkpoint.Checkpoint(self.tmp.name, boot='a').save('ssd1306.0x3c', on=True)
+        self.assertIsNone(checkpoint.Checkpoint(self.tmp.name, boot='b').load('ssd1306.0x3c'))
+
+    def test_corrupt(self):
+        c = checkpoint.Checkpoint(self.tmp.name, boot='a')
+        with open(os.path.join(self.tmp.name, 'air_quality.ssd1306.0x3c.state'), 'w') as f:
+            f.write('{"boot": "a", "st')
+        self.assertIsNone(c.load('ssd1306.0x3c'))
+
+    def test_boot_id(self):
+        if os.path.exists(checkpoint.BOOT_ID_PATH):
+            self.assertEqual(checkpoint.boot_id(), checkpoint.boot_id())
+            self.assertTrue(checkpoint.boot_id())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,532 @@
+"""Simulated devices for running the pipeline without hardware.
+
+FakeSerial stands in for the PMS5003 port, FakeSMBus for I2C bus 1 with
+simulated CCS811 and SSD1306 devices, FakeSpiDev for an SSD1306 on SPI
+and FakeGPIO for RPi.GPIO. They can run faster than real time.
+"""
+
+import array
+import errno
+import fcntl
+import os
+import random
+import struct
+import termios
+import threading
+import time
+
+import bme680
+
+# Seconds between PMS5003 frames in active mode.
+PMS5003_PERIOD = 1.0
+# 9600 baud, 10 bits per byte.
+SERIAL_BYTES_PER_SEC = 960
+
+
+def pms5003_frame(words):
+    """Returns a valid PMS5003 frame carrying 13 data words, each clamped
+    to 0..0xffff like the sensor's own counts."""
+    data = struct.pack('>2sH13H', b'BM', 28, *(min(0xffff, max(0, w)) for w in words))
+    return data + struct.pack('>H', sum(data))
+
+
+def synthetic_pms5003(count=None, corrupt=0.0, seed=None):
+    """Yields plausible PMS5003 frames (count of them, or forever). With
+    probability corrupt a frame gets a flipped byte or is preceded by
+    garbage."""
+    rnd = random.Random(seed)
+    pm = 10.0
+    n = 0
+    while count is None or n < count:
+        n += 1
+        pm = min(500.0, max(0.0, pm + rnd.gauss(0, 1)))
+        pm1, pm2_5, pm10 = int(pm * 0.7), int(pm), int(pm * 1.3)
+        counts = [int(pm * k) for k in (150, 45, 10, 2, 1, 0)]
+        frame = bytearray(pms5003_frame([pm1, pm2_5, pm10, pm1, pm2_5, pm10] + counts + [0]))
+        if rnd.random() < corrupt:
+            if rnd.random() < 0.5:
+                frame[rnd.randrange(len(frame))] ^= 1 << rnd.randrange(8)
+            else:
+                frame[:0] = bytes(rnd.randrange(256) for _ in range(rnd.randrange(1, 40)))
+        yield bytes(frame)
+
+
+def replay(path, repeat=False, chunk=32):
+    """Yields chunks of a captured byte stream, e.g. saved with
+    `cat /dev/ttyAMA0 > capture.bin`."""
+    while True:
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(chunk)
+                if not data:
+                    break
+                yield data
+        if not repeat:
+            return
+
+
+class FakeSerial(object):
+    """Serial port look-alike fed from a generator of byte chunks by a
+    background thread through a pipe, so it works with blocking reads as
+    well as with selectors and asyncio readers.
+
+    Chunks are paced at speed times real time: one frame per period for
+    whole frames, or the 9600 baud byte rate otherwise.
+    """
+
+    def __init__(self, chunks, speed=1.0, period=PMS5003_PERIOD):
+        self._chunks = chunks
+        self._speed = speed
+        self._period = period
+        self._r, self._w = os.pipe()
+        self.bytes_written = 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        deadline = time.monotonic()
+        try:
+            for chunk in self._chunks:
+                if self._closed.is_set():
+                    break
+                if len(chunk) >= 32:
+                    deadline += self._period / self._speed
+                else:
+                    deadline += len(chunk) / SERIAL_BYTES_PER_SEC / self._speed
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._closed.wait(delay)
+                os.write(self._w, chunk)
+                self.bytes_written += len(chunk)
+        except OSError:
+            pass
+        except Exception as e:
+            # Readers see the end of the stream either way.
+            print('fake serial feeder stopped:', repr(e))
+        finally:
+            os.close(self._w)
+
+    def fileno(self):
+        return self._r
+
+    @property
+    def in_waiting(self):
+        buf = array.array('i', [0])
+        fcntl.ioctl(self._r, termios.FIONREAD, buf)
+        return buf[0]
+
+    def read(self, size=1):
+        data = bytearray()
+        while len(data) < size:
+            chunk = os.read(self._r, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self._thread.join()
+            os.close(self._r)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class FakeCCS811(object):
+    """Register model of a CCS811 producing one sample per drive mode
+    period, speed times faster than real time."""
+
+    PERIODS = {1: 1, 2: 10, 3: 60, 4: 0.25}
+
+    def __init__(self, speed=1.0, seed=None):
+        self._speed = speed
+        self._rnd = random.Random(seed)
+        self.fw_mode = 0
+        self.mode = 0
+        self.baseline = 0x8000
+        self.env_data = None
+        self._start = time.monotonic()
+        self._samples_read = 0
+
+    def _samples(self):
+        period = self.PERIODS.get(self.mode >> 4 & 0x7)
+        if period is None:
+            return 0
+        return int((time.monotonic() - self._start) * self._speed / period)
+
+    def _status(self):
+        data_ready = self.fw_mode and self._samples() > self._samples_read
+        return 0x10 | data_ready << 3 | self.fw_mode << 7
+
+    def nint(self):
+        """Level of the nINT pin: low while a sample is ready and the
+        interrupt is enabled."""
+        return 0 if self.mode & 0x08 and self._status() & 0x08 else 1
+
+    def read(self, reg, length):
+        if reg == 0x00:
+            return [self._status()]
+        if reg == 0x01:
+            return [self.mode]
+        if reg == 0x02:
+            status = self._status()
+            self._samples_read = self._samples()
+            e_co2 = 400 + self._rnd.randrange(200)
+            tvoc = self._rnd.randrange(100)
+            raw = self._rnd.randrange(64) << 10 | self._rnd.randrange(1024)
+            return [e_co2 >> 8, e_co2 & 0xff, tvoc >> 8, tvoc & 0xff,
+                    status, 0, raw >> 8, raw & 0xff][:length]
+        if reg == 0x11:
+            return [self.baseline & 0xff, self.baseline >> 8]
+        if reg == 0x20:
+            return [0x81]
+        if reg == 0xe0:
+            return [0]
+        return [0] * length
+
+    def write(self, reg, data):
+        if reg == 0xf4:
+            self.fw_mode = 1
+        elif reg == 0x01:
+            self.mode = data[0]
+            self._start = time.monotonic()
+            self._samples_read = 0
+        elif reg == 0x05:
+            self.env_data = list(data)
+        elif reg == 0x11:
+            self.baseline = data[0] | data[1] << 8
+        elif reg == 0xff:
+            self.fw_mode = 0
+            self.mode = 0
+
+
+def _invert(f, target, lo, hi):
+    """Smallest x in lo..hi with f(x) >= target, f increasing."""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if f(mid) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class FakeBME680(object):
+    """Register model of a BME680 with typical calibration values,
+    measuring around the given temperature (degC), humidity (%RH) and
+    pressure (hPa)."""
+
+    CALIBRATION = dict(t1=26000, t2=26500, t3=3, p1=36000, p2=-10300, p3=88, p4=6500,
+                       p5=-120, p6=30, p7=40, p8=-700, p9=-3000, p10=30, h1=800, h2=1000,
+                       h3=0, h4=45, h5=20, h6=120, h7=-100, gh1=-30, gh2=-12000, gh3=18,
+                       res_heat_val=40, res_heat_range=1, range_sw_err=0)
+
+    def __init__(self, temperature=22.0, humidity=45.0, pressure=1013.0, seed=None, **calibration):
+        c = dict(self.CALIBRATION, **calibration)
+        self.coeff1 = list(struct.pack('<hbxHhbxhhbbxxhhB', c['t2'], c['t3'], c['p1'], c['p2'],
+                                       c['p3'], c['p4'], c['p5'], c['p7'], c['p6'], c['p8'],
+                                       c['p9'], c['p10']))
+        self.coeff2 = [c['h2'] >> 4, (c['h2'] & 0xf) << 4 | c['h1'] & 0xf, c['h1'] >> 4] + \
+            list(struct.pack('<3bBbHhbb', c['h3'], c['h4'], c['h5'], c['h6'], c['h7'],
+                             c['t1'], c['gh2'], c['gh1'], c['gh3']))
+        self.coeff3 = [c['res_heat_val'] & 0xff, 0, c['res_heat_range'] << 4, 0,
+                       (c['range_sw_err'] << 4) & 0xff]
+        self.calibration = bme680.Calibration(self.coeff1, self.coeff2, self.coeff3)
+        self.temperature = temperature
+        self.humidity = humidity
+        self.pressure = pressure
+        self._rnd = random.Random(seed)
+        self.regs = {}
+        self.new_data = False
+        self.triggers = 0
+
+    def _adc(self):
+        cal = self.calibration
+        t = self.temperature + self._rnd.uniform(-0.1, 0.1)
+        temp_adc = _invert(lambda a: cal.temperature(cal.t_fine(a)), t * 100, 0, (1 << 20) - 1)
+        t_fine = cal.t_fine(temp_adc)
+        h = self.humidity + self._rnd.uniform(-0.5, 0.5)
+        hum_adc = _invert(lambda a: cal.humidity(t_fine, a), h * 1000, 0, (1 << 16) - 1)
+        # Pressure falls as the ADC value rises.
+        pres_adc = _invert(lambda a: -cal.pressure(t_fine, a), -self.pressure * 100,
+                           0, (1 << 20) - 1)
+        return temp_adc, hum_adc, pres_adc
+
+    def read(self, reg, length):
+        if reg == 0xd0:
+            return [bme680.CHIP_ID]
+        if reg == 0x8a:
+            return self.coeff1[:length]
+        if reg == 0xe1:
+            return self.coeff2[:length]
+        if reg == 0x00:
+            return self.coeff3[:length]
+        if reg == 0x1d:
+            if not self.new_data:
+                return [0] * length
+            self.new_data = False
+            temp_adc, hum_adc, pres_adc = self._adc()
+            gas = 0x30 | 5 if self.regs.get(0x71, 0) & 0x10 else 0
+            d = [0x80, 0, pres_adc >> 12, pres_adc >> 4 & 0xff, (pres_adc & 0xf) << 4,
+                 temp_adc >> 12, temp_adc >> 4 & 0xff, (temp_adc & 0xf) << 4,
+                 hum_adc >> 8, hum_adc & 0xff, 0, 0, 0, 0x80, gas]
+            return d[:length]
+        return [self.regs.get(reg + i, 0) for i in range(length)]
+
+    def write(self, reg, data):
+        for i, b in enumerate(data):
+            self.regs[reg + i] = b
+        if reg == 0x74 and data[0] & 0x3 == 1:
+            self.triggers += 1
+            self.new_data = True
+
+
+class FakeSSD1306(object):
+    """Keeps the display RAM, assuming horizontal addressing mode. Fails
+    on RAM writes while it scrolls, which the datasheet forbids."""
+
+    # Number of argument bytes of the multi-byte commands.
+    ARGS = {0x20: 1, 0x21: 2, 0x22: 2, 0x26: 6, 0x27: 6, 0x29: 5, 0x2a: 5,
+            0x81: 1, 0x8d: 1, 0xa3: 2, 0xa8: 1, 0xd3: 1, 0xd5: 1, 0xd9: 1,
+            0xda: 1, 0xdb: 1}
+
+    def __init__(self):
+        self.ram = bytearray(128 * 8)
+        self.on = False
+        self.start_line = 0
+        self.mux = 64
+        self.scrolling = False
+        # Arguments of the last scroll setup command.
+        self.scroll = None
+        self.cols = (0, 127)
+        self.pages = (0, 7)
+        self.col = 0
+        self.page = 0
+
+    def _command(self, bs):
+        i = 0
+        while i < len(bs):
+            c = bs[i]
+            args = bs[i + 1:i + 1 + self.ARGS.get(c, 0)]
+            i += 1 + len(args)
+            if c == 0x21:
+                self.cols = tuple(args)
+                self.col = args[0]
+            elif c == 0x22:
+                self.pages = tuple(args)
+                self.page = args[0]
+            elif c in (0xae, 0xaf):
+                self.on = c == 0xaf
+            elif 0x40 <= c < 0x80:
+                self.start_line = c - 0x40
+            elif c in (0x2e, 0x2f):
+                self.scrolling = c == 0x2f
+            elif c in (0x26, 0x27):
+                self.scroll = (c,) + tuple(args)
+            elif c == 0xa8:
+                self.mux = args[0] + 1
+
+    def _data(self, bs):
+        assert not self.scrolling, 'RAM written while scrolling'
+        for b in bs:
+            self.ram[self.page * 128 + self.col] = b
+            self.col += 1
+            if self.col > self.cols[1]:
+                self.col = self.cols[0]
+                self.page += 1
+                if self.page > self.pages[1]:
+                    self.page = self.pages[0]
+
+    def visible(self):
+        """Returns the pages of RAM the display shows, from the start line
+        (a multiple of 8) and multiplex ratio."""
+        first = self.start_line // 8
+        return [(first + i) % 8 for i in range(self.mux // 8)]
+
+    def write(self, reg, data):
+        if reg == 0:
+            self._command(list(data))
+        elif reg == 0x40:
+            self._data(data)
+
+    def read(self, reg, length):
+        if reg is None:
+            # Status byte: bit 6 is set while the display is off.
+            return [0 if self.on else 0x40]
+        return [0] * length
+
+
+class FakeSpiDev(object):
+    """spidev.SpiDev look-alike wired to a FakeSSD1306: bytes written while
+    board channel dc_pin of gpio (a FakeGPIO) is high are data, otherwise
+    commands. Counts writebytes calls and bytes."""
+
+    BUFSIZ = 4096
+
+    def __init__(self, display, gpio, dc_pin):
+        self.display = display
+        self.gpio = gpio
+        self.dc_pin = dc_pin
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.device = None
+        self.calls = 0
+        self.bytes = 0
+
+    def open(self, bus, device):
+        self.device = bus, device
+
+    def close(self):
+        self.device = None
+
+    def writebytes(self, data):
+        assert self.device is not None
+        if len(data) > self.BUFSIZ:
+            raise OverflowError('Argument list size exceeds %d bytes.' % self.BUFSIZ)
+        self.calls += 1
+        self.bytes += len(data)
+        self.display.write(0x40 if self.gpio.outputs.get(self.dc_pin) else 0, data)
+
+
+class FakeGPIO(object):
+    """RPi.GPIO look-alike. inputs maps a channel to a function returning
+    its level, e.g. FakeCCS811.nint; outputs keep the last value written
+    and writes lists every (channel, value) written."""
+
+    BOARD = 'BOARD'
+    IN = 'IN'
+    OUT = 'OUT'
+    FALLING = 'FALLING'
+    PUD_UP = 'PUD_UP'
+
+    def __init__(self, inputs=None, poll_interval=0.0005):
+        self.inputs = dict(inputs or {})
+        self.outputs = {}
+        self.writes = []
+        self.channels = {}
+        self.mode = None
+        self.poll_interval = poll_interval
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, ch, direction, initial=0, pull_up_down=None):
+        self.channels[ch] = direction
+        if direction == self.OUT:
+            self.output(ch, initial)
+
+    def input(self, ch):
+        assert self.channels.get(ch) == self.IN
+        f = self.inputs.get(ch)
+        return 1 if f is None else int(f())
+
+    def output(self, ch, value):
+        assert self.channels.get(ch) == self.OUT
+        self.outputs[ch] = value
+        self.writes.append((ch, value))
+
+    def wait_for_edge(self, ch, edge, timeout=None):
+        assert edge == self.FALLING
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+        last = self.input(ch)
+        while deadline is None or time.monotonic() < deadline:
+            level = self.input(ch)
+            if last and not level:
+                return ch
+            last = level
+            time.sleep(self.poll_interval)
+        return None
+
+    def cleanup(self, channels=None):
+        for ch in channels if channels is not None else list(self.channels):
+            self.channels.pop(ch, None)
+
+
+class FakeSMBus(object):
+    """smbus2.SMBus look-alike that dispatches to simulated devices by
+    address and counts transactions and bytes. i2c_rdwr takes write
+    messages of up to max_transfer bytes (any size by default; 0 for an
+    adapter without plain I2C)."""
+
+    def __init__(self, devices, max_transfer=None):
+        self.devices = devices
+        self.max_transfer = max_transfer
+        self.transactions = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def _device(self, addr):
+        try:
+            return self.devices[addr]
+        except KeyError:
+            raise OSError(121, 'Remote I/O error')
+
+    def _read(self, addr, reg, length):
+        with self._lock:
+            self.transactions += 1
+            self.bytes += length
+            return self._device(addr).read(reg, length)
+
+    def _write(self, addr, reg, data):
+        with self._lock:
+            self.transactions += 1
+            self.bytes += len(data)
+            self._device(addr).write(reg, data)
+
+    def read_byte(self, addr):
+        """Reads without a register; devices get reg None."""
+        return self._read(addr, None, 1)[0]
+
+    def read_byte_data(self, addr, reg):
+        return self._read(addr, reg, 1)[0]
+
+    def read_word_data(self, addr, reg):
+        lo, hi = self._read(addr, reg, 2)
+        return lo | hi << 8
+
+    def read_i2c_block_data(self, addr, reg, length):
+        return self._read(addr, reg, length)
+
+    def write_byte(self, addr, value):
+        self._write(addr, value, [])
+
+    def write_byte_data(self, addr, reg, value):
+        self._write(addr, reg, [value])
+
+    def write_word_data(self, addr, reg, value):
+        self._write(addr, reg, [value & 0xff, value >> 8])
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self._write(addr, reg, list(data))
+
+    def i2c_rdwr(self, *msgs):
+        """Write messages only: the first byte is the register."""
+        for m in msgs:
+            if m.flags & 1 or self.max_transfer is not None and m.len > self.max_transfer:
+                raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+        with self._lock:
+            self.transactions += 1
+            for m in msgs:
+                data = list(m)
+                self.bytes += len(data)
+                self._device(m.addr).write(data[0], data[1:])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
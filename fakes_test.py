@@ -0,0 +1,80 @@
+import itertools
+import unittest
+
+import ccs811
+import fakes
+import pm25
+import ssd1306
+
+
+class SyntheticPMS5003Test(unittest.TestCase):
+
+    def test_frames_are_valid(self):
+        for frame in fakes.synthetic_pms5003(100, seed=1):
+            self.assertTrue(pm25.is_valid(frame))
+
+    def test_corrupt_frames_are_rejected(self):
+        reader = pm25.PMS5003Reader()
+        messages = reader.feed(b''.join(fakes.synthetic_pms5003(200, corrupt=0.2, seed=2)))
+        self.assertLess(len(messages), 200)
+        self.assertGreater(len(messages), 100)
+        self.assertGreater(reader.invalid_frames + reader.garbage_bytes, 0)
+
+    def test_counts_are_clamped(self):
+        frame = fakes.pms5003_frame([500 * 150] + [-1] + [0] * 11)
+        self.assertTrue(pm25.is_valid(frame))
+        self.assertEqual([0xffff, 0], pm25.parse_pms5003_message(frame)[:2])
+
+
+class FakeSerialTest(unittest.TestCase):
+
+    def test_read_messages(self):
+        frames = list(fakes.synthetic_pms5003(20, seed=3))
+        with fakes.FakeSerial(iter(frames), speed=1000) as port:
+            messages = list(itertools.islice(pm25.generate_pms5003_message(port), 20))
+        self.assertEqual([list(m) for m in messages],
+                         [pm25.parse_pms5003_message(f) for f in frames])
+
+    def test_feeder_error_ends_stream(self):
+        def chunks():
+            yield fakes.pms5003_frame([1] * 13)
+            raise ValueError('bad chunk')
+
+        with fakes.FakeSerial(chunks(), speed=1000) as port:
+            self.assertEqual(32, len(port.read(32)))
+            self.assertEqual(b'', port.read(1))
+
+
+class FakeSMBusTest(unittest.TestCase):
+
+    def test_ccs811(self):
+        bus = fakes.FakeSMBus({0x5a: fakes.FakeCCS811(speed=1000)})
+        dev = ccs811.CCS811(bus, 0x5a)
+        self.assertTrue(dev.is_device())
+        dev.maybe_start_app()
+        dev.switch_mode(1)
+        self.assertEqual(dev.mode().drive_mode, 1)
+        while not dev.status().data_ready:
+            pass
+        result = dev.result()
+        self.assertGreaterEqual(result.e_co2, 400)
+        self.assertFalse(dev.status().data_ready)
+        dev.set_baseline(0x1234)
+        self.assertEqual(dev.baseline(), 0x1234)
+
+    def test_ssd1306(self):
+        display = fakes.FakeSSD1306()
+        dev = ssd1306.SSD1306Device(fakes.FakeSMBus({0x3c: display}), 0x3c)
+        dev.initialize()
+        dev.puts('AB', row=1, col=2)
+        dev.flush()
+        self.assertTrue(display.on)
+        self.assertEqual(bytes(display.ram), bytes(dev.fb.buf))
+
+    def test_missing_device(self):
+        with self.assertRaises(OSError):
+            fakes.FakeSMBus({}).read_byte_data(0x5a, 0x20)
+
+
+if __name__ == '__main__':
+    unittest.main()
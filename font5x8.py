@@ -1,7 +1,10 @@
+import functools
+
+
 class Font5x8:
     cols = 5
     rows = 8
-    bytes = [
+    bytes = bytes([
         0x00, 0x00, 0x00, 0x00, 0x00,
         0x3E, 0x5B, 0x4F, 0x5B, 0x3E,
         0x3E, 0x6B, 0x4F, 0x6B, 0x3E,
@@ -257,4 +260,39 @@ class Font5x8:
         0x00, 0x19, 0x1D, 0x17, 0x12,
         0x00, 0x3C, 0x3C, 0x3C, 0x3C,
         0x00, 0x00, 0x00, 0x00, 0x00,
-        ]
+        ])
+
+
+def _spread(bits, scale):
+    """Repeats each of the low 8 // scale bits of bits scale times."""
+    b = 0
+    for i in range(8 // scale):
+        if (bits >> i) & 1:
+            b |= ((1 << scale) - 1) << (i * scale)
+    return b
+
+
+@functools.lru_cache(maxsize=None)
+def glyph(ch, scale=1, padding=0):
+    """Returns ch scaled up by scale (1, 2 or 4) as a tuple of scale pages,
+    each a bytes of Font5x8.cols * scale + padding columns."""
+    assert scale in (1, 2, 4)
+    offset = ord(ch) * Font5x8.cols
+    cols = Font5x8.bytes[offset:offset + Font5x8.cols]
+    mask = (1 << (8 // scale)) - 1
+    pages = []
+    for page in range(scale):
+        shift = page * 8 // scale
+        bs = bytearray()
+        for c in cols:
+            bs.extend([_spread((c >> shift) & mask, scale)] * scale)
+        bs.extend(bytes(padding))
+        pages.append(bytes(bs))
+    return tuple(pages)
+
+
+def render(s, scale=1, padding=0):
+    """Returns s as a tuple of scale pages of bytes, built from cached
+    glyphs."""
+    glyphs = [glyph(ch, scale, padding) for ch in s]
+    return tuple(b''.join(g[page] for g in glyphs) for page in range(scale))
@@ -0,0 +1,31 @@
+import unittest
+
+import font5x8
+
+
+class GlyphTest(unittest.TestCase):
+
+    def test_glyph_1x(self):
+        offset = ord('A') * 5
+        self.assertEqual((bytes(font5x8.Font5x8.bytes[offset:offset + 5]) + b'\0\0',),
+                         font5x8.glyph('A', 1, 2))
+
+    def test_glyph_2x(self):
+        top, bottom = font5x8.glyph('\x08', 2)
+        # 0xff 0xe7 0xc3 0xe7 0xff
+        self.assertEqual(bytes([0xff] * 2 + [0x3f] * 2 + [0x0f] * 2 + [0x3f] * 2 + [0xff] * 2), top)
+        self.assertEqual(bytes([0xff] * 2 + [0xfc] * 2 + [0xf0] * 2 + [0xfc] * 2 + [0xff] * 2), bottom)
+
+    def test_glyph_4x(self):
+        pages = font5x8.glyph('\x08', 4)
+        self.assertEqual(4, len(pages))
+        self.assertEqual(bytes([0xff] * 4 + [0x0f] * 4 + [0x00] * 4 + [0x0f] * 4 + [0xff] * 4), pages[1])
+
+    def test_render(self):
+        pages = font5x8.render('AB', 2, 6)
+        self.assertEqual(2, len(pages))
+        self.assertEqual(font5x8.glyph('A', 2, 6)[1] + font5x8.glyph('B', 2, 6)[1], pages[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""History graphs for the display, computed with NumPy.
+
+A graph bins the readings of a history.History channel into one column
+per time slot, scales the columns between their overall minimum and
+maximum and packs them into SSD1306 page bytes (bit 0 the top row) with
+array operations only, so a whole graph costs about as much to draw as a
+line of text.
+"""
+
+import collections
+import time
+
+import numpy  # pip install numpy
+
+COLS = 128
+
+# A channel of a history to plot, under label.
+Plot = collections.namedtuple('Plot', 'label history channel')
+
+
+def columns(times, values, start, end, cols=COLS, spread=True):
+    """Bins the readings (times oldest first) of [start, end) into cols
+    equal time slots. Returns (means, mins, maxs) per slot, NaN where a
+    slot has no readings; just (means,) without spread."""
+    times = numpy.asarray(times, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    edges = numpy.searchsorted(times, start + (end - start) * numpy.arange(cols + 1) / cols)
+    counts = numpy.diff(edges)
+    full = counts > 0
+    ufuncs = (numpy.add, numpy.minimum, numpy.maximum) if spread else (numpy.add,)
+    stats = tuple(numpy.full(cols, numpy.nan) for _ in ufuncs)
+    if full.any():
+        # Empty slots are as wide as nothing, so each full one ends where
+        # the next full one starts.
+        values = values[:edges[-1]]
+        starts = edges[:-1][full]
+        for a, ufunc in zip(stats, ufuncs):
+            a[full] = ufunc.reduceat(values, starts)
+        stats[0][full] /= counts[full]
+    return stats
+
+
+def scale(lo, hi, rows, bottom=None, top=None):
+    """Maps lo..hi to pixel rows 0 (bottom) to rows - 1, between bottom
+    and top (by default the minimum and maximum). Returns (y0, y1, bottom,
+    top); y0 > y1 where lo or hi is NaN."""
+    if bottom is None:
+        bottom = numpy.fmin.reduce(lo)
+    if top is None:
+        top = numpy.fmax.reduce(hi)
+    k = (rows - 1) / max(top - bottom, 1e-9)
+    ys = []
+    for v, missing in ((lo, rows), (hi, -1)):
+        y = numpy.rint((v - bottom) * k)
+        # numpy.clip and nan_to_num take longer than the arithmetic here.
+        y = numpy.maximum(numpy.minimum(y, rows - 1), 0)
+        ys.append(numpy.where(numpy.isnan(y), missing, y).astype(int))
+    return ys[0], ys[1], bottom, top
+
+
+def _bits():
+    # _BITS[a, b] has bits a to b - 1 set.
+    a, b = numpy.ogrid[:9, :9]
+    return numpy.where(b > a, (1 << b) - (1 << a), 0).astype(numpy.uint8)
+
+
+_BITS = _bits()
+
+
+def pack(y0, y1, pages):
+    """Returns the page bytes (one bytes per page, top first) of a column
+    lit from row y0 to row y1 (counted from the bottom) in each column."""
+    # Rows counted from the top, as bits are within a page.
+    rows = 8 * pages
+    top = rows - 1 - numpy.asarray(y1)
+    bottom = rows - 1 - numpy.asarray(y0)
+    offsets = numpy.arange(0, rows, 8)[:, None]
+    a = numpy.maximum(numpy.minimum(top - offsets, 8), 0)
+    b = numpy.maximum(numpy.minimum(bottom + 1 - offsets, 8), 0)
+    return [p.tobytes() for p in _BITS[a, b]]
+
+
+def _duration(seconds):
+    if seconds % 3600 == 0:
+        return '%dh' % (seconds // 3600)
+    if seconds % 60 == 0:
+        return '%dm' % (seconds // 60)
+    return '%ds' % seconds
+
+
+def parse_span(s):
+    """Parses a duration such as 90s, 30m or 6h into seconds."""
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if s and s[-1] in units:
+        return int(s[:-1]) * units[s[-1]]
+    return int(s)
+
+
+class Graph(object):
+    """Draws plots of the last span seconds, bars up to the mean of each
+    column or, with bars=False, lines over its minimum to maximum."""
+
+    def __init__(self, plots, span=3600, bars=True):
+        self.plots = list(plots)
+        self.span = span
+        self.bars = bars
+
+    def ready(self, plot, now=None):
+        """Whether plot has readings to show."""
+        now = time.time() if now is None else now
+        return len(plot.history.times(since=now - self.span)) > 0
+
+    def render(self, plot, pages, now=None):
+        """Returns (title, page bytes) of plot, pages tall."""
+        now = time.time() if now is None else now
+        start = now - self.span
+        h = plot.history
+        # Both views cover the same readings unless one is appended in
+        # between; then the values are one longer.
+        times = numpy.asarray(h.times(since=start))
+        values = numpy.asarray(h.view(plot.channel, since=start))[:len(times)]
+        stats = columns(times[:len(values)], values, start, now, spread=not self.bars)
+        if numpy.isnan(stats[0]).all():
+            return '%s %s' % (plot.label, _duration(self.span)), [bytes(COLS)] * pages
+        if self.bars:
+            means, = stats
+            _, y1, bottom, top = scale(means, means, 8 * pages,
+                                       bottom=min(0, numpy.fmin.reduce(means)))
+            # Empty columns have y1 -1.
+            y0 = numpy.zeros_like(y1)
+        else:
+            _, mins, maxs = stats
+            y0, y1, bottom, top = scale(mins, maxs, 8 * pages)
+        title = '%s %s %g-%g' % (plot.label, _duration(self.span), round(bottom), round(top))
+        return title, pack(y0, y1, pages)
@@ -0,0 +1,97 @@
+import math
+import unittest
+
+import numpy
+
+import graph
+import history
+
+
+def pixels(pages):
+    """Returns the rows (top first) of page bytes as strings of # and ."""
+    return [''.join('#' if b >> bit & 1 else '.' for b in page)
+            for page in pages for bit in range(8)]
+
+
+class ColumnsTest(unittest.TestCase):
+
+    def test_bins(self):
+        times = [0, 1, 2, 6, 7, 7.5]
+        values = [1, 3, 2, 10, 20, 6]
+        means, mins, maxs = graph.columns(times, values, 0, 8, cols=4)
+        numpy.testing.assert_array_equal(mins, [1, 2, numpy.nan, 6])
+        numpy.testing.assert_array_equal(maxs, [3, 2, numpy.nan, 20])
+        numpy.testing.assert_array_equal(means, [2, 2, numpy.nan, 12])
+
+    def test_outside(self):
+        means, = graph.columns([-1, 0, 3, 4], [100, 1, 2, 100], 0, 4, cols=2, spread=False)
+        numpy.testing.assert_array_equal(means, [1, 2])
+
+    def test_empty(self):
+        for stats in graph.columns([], [], 0, 10, cols=3):
+            self.assertTrue(numpy.isnan(stats).all())
+
+
+class PackTest(unittest.TestCase):
+
+    def test_pack(self):
+        y0 = numpy.array([0, 0, 3, 8, 16])
+        y1 = numpy.array([-1, 15, 9, 8, 15])
+        rows = pixels(graph.pack(y0, y1, 2))
+        self.assertEqual(len(rows), 16)
+        for col in range(5):
+            lit = [15 - r for r in range(16) if rows[r][col] == '#']
+            self.assertEqual(sorted(lit), list(range(y0[col], y1[col] + 1)), col)
+
+    def test_scale(self):
+        y0, y1, bottom, top = graph.scale(numpy.array([10., numpy.nan, 20.]),
+                                          numpy.array([16., numpy.nan, 30.]), 11)
+        self.assertEqual((bottom, top), (10, 30))
+        self.assertEqual(list(y0), [0, 11, 5])
+        self.assertEqual(list(y1), [3, -1, 10])
+
+
+class GraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = history.History(['pm2_5'], 3600)
+        self.plot = graph.Plot('PM25', self.history, 'pm2_5')
+        self.graph = graph.Graph([self.plot], span=128)
+
+    def test_bars(self):
+        self.assertFalse(self.graph.ready(self.plot, now=1000))
+        # A ramp over the last 64 seconds: the right half of the graph.
+        for i in range(64):
+            self.history.append([i], 1000 - 64 + i)
+        self.assertTrue(self.graph.ready(self.plot, now=1000))
+        title, pages = self.graph.render(self.plot, 2, now=1000)
+        self.assertEqual(title, 'PM25 128s 0-63')
+        rows = pixels(pages)
+        self.assertEqual(rows[-1], '.' * 64 + '#' * 64)
+        self.assertEqual(rows[0], '.' * 125 + '###')
+        heights = [sum(r[col] == '#' for r in rows) for col in range(128)]
+        self.assertEqual(heights, sorted(heights))
+
+    def test_lines(self):
+        self.graph.bars = False
+        for i in range(256):
+            self.history.append([round(20 + 10 * math.sin(i / 8))], 1000 - 256 + i)
+        title, pages = self.graph.render(self.plot, 3, now=1000)
+        self.assertEqual(title, 'PM25 128s 10-30')
+        rows = pixels(pages)
+        # Every column spans two readings and is lit.
+        self.assertTrue(all('#' in (r[col] for r in rows) for col in range(128)))
+
+    def test_nothing_in_span(self):
+        self.history.append([5], 0)
+        self.assertEqual(self.graph.render(self.plot, 3, now=1000),
+                         ('PM25 128s', [bytes(128)] * 3))
+
+    def test_parse_span(self):
+        self.assertEqual(graph.parse_span('90'), 90)
+        self.assertEqual(graph.parse_span('30m'), 1800)
+        self.assertEqual(graph.parse_span('6h'), 6 * 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
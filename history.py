@@ -0,0 +1,83 @@
+import array
+import bisect
+import threading
+import time
+
+
+class History(object):
+    """Fixed capacity ring of timestamped multi-channel readings.
+
+    Every channel (and the timestamps) is stored twice back to back in one
+    typed array, so the last n readings are always contiguous and can be
+    returned as a memoryview without copying. Views are live: once the ring
+    wraps around, the oldest entries of an old view get overwritten.
+    """
+
+    def __init__(self, channels, capacity, typecode='H'):
+        assert capacity > 0
+        self.channels = tuple(channels)
+        self.capacity = capacity
+        self._index = {c: i for i, c in enumerate(self.channels)}
+        self._times = array.array('d', [0]) * (2 * capacity)
+        self._data = [array.array(typecode, [0]) * (2 * capacity)
+                      for _ in self.channels]
+        self._times_view = memoryview(self._times)
+        self._data_views = [memoryview(_) for _ in self._data]
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, values, when=None):
+        """Appends one reading; values are in channel order."""
+        if when is None:
+            when = time.time()
+        with self._lock:
+            i = self._next
+            j = i + self.capacity
+            self._times[i] = self._times[j] = when
+            for d, v in zip(self._data, values):
+                d[i] = d[j] = v
+            self._next = (i + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def _range(self, since=None, last=None):
+        with self._lock:
+            end = self._next + self.capacity
+            start = end - self._size
+        if last is not None:
+            start = max(start, end - last)
+        if since is not None:
+            start = bisect.bisect_left(self._times_view, since, start, end)
+        return start, end
+
+    def times(self, since=None, last=None):
+        """Timestamps of the readings at or after since (and at most the last
+        `last` of them), oldest first."""
+        start, end = self._range(since, last)
+        return self._times_view[start:end]
+
+    def view(self, channel, since=None, last=None):
+        """Values of channel over the same range as times()."""
+        start, end = self._range(since, last)
+        return self._data_views[self._index[channel]][start:end]
+
+    def latest(self):
+        """Returns (when, values) of the newest reading or None."""
+        with self._lock:
+            if not self._size:
+                return None
+            i = self._next + self.capacity - 1
+            return self._times[i], tuple(d[i] for d in self._data)
+
+    def min(self, channel, since=None, last=None):
+        return min(self.view(channel, since, last), default=None)
+
+    def max(self, channel, since=None, last=None):
+        return max(self.view(channel, since, last), default=None)
+
+    def mean(self, channel, since=None, last=None):
+        v = self.view(channel, since, last)
+        return sum(v) / len(v) if v else None
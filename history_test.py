@@ -0,0 +1,45 @@
+import unittest
+
+import history
+
+
+class HistoryTest(unittest.TestCase):
+
+    def test_empty(self):
+        h = history.History(['a', 'b'], 4)
+        self.assertEqual(0, len(h))
+        self.assertEqual([], list(h.view('a')))
+        self.assertIsNone(h.latest())
+        self.assertIsNone(h.min('a'))
+        self.assertIsNone(h.mean('a'))
+
+    def test_append_view(self):
+        h = history.History(['a', 'b'], 4)
+        for i in range(1, 7):
+            h.append((i, 10 * i), when=100 + i)
+        self.assertEqual(4, len(h))
+        self.assertEqual([3, 4, 5, 6], list(h.view('a')))
+        self.assertEqual([50, 60], list(h.view('b', last=2)))
+        self.assertEqual([105.0, 106.0], list(h.times(since=104.5)))
+        self.assertEqual([5, 6], list(h.view('a', since=104.5)))
+        self.assertEqual((106.0, (6, 60)), h.latest())
+
+    def test_stats(self):
+        h = history.History(['a'], 8)
+        for i, v in enumerate([5, 1, 9, 3]):
+            h.append((v,), when=i)
+        self.assertEqual(1, h.min('a'))
+        self.assertEqual(9, h.max('a'))
+        self.assertEqual(4.5, h.mean('a'))
+        self.assertEqual(6, h.mean('a', since=2))
+
+    def test_view_is_zero_copy(self):
+        h = history.History(['a'], 4)
+        h.append((1,), when=0)
+        v = h.view('a')
+        self.assertIsInstance(v, memoryview)
+        self.assertEqual('H', v.format)
+
+
+if __name__ == '__main__':
+    unittest.main()
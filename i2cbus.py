@@ -0,0 +1,209 @@
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import smbus2  # pip install smbus2
+import threading
+import time
+
+import metrics
+
+# Lower runs first.
+SENSOR = 0
+DISPLAY = 10
+
+
+class DeviceStats(object):
+
+    def __init__(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _Transaction(object):
+
+    def __init__(self, client, f, seq, key):
+        self.client = client
+        self.f = f
+        self.seq = seq
+        self.key = key
+        self.submitted = time.monotonic()
+        self.future = concurrent.futures.Future()
+        self.started = False
+
+    def __lt__(self, other):
+        return (self.client.priority, self.seq) < (other.client.priority, other.seq)
+
+
+def _payload_bytes(name, args, result):
+    if name in ('write_i2c_block_data', 'write_block_data'):
+        return len(args[2])
+    if name == 'read_i2c_block_data':
+        return args[2]
+    if name in ('read_word_data', 'write_word_data'):
+        return 2
+    if name == 'i2c_rdwr':
+        return sum(m.len for m in args)
+    return 1
+
+
+class BusManager(object):
+    """Owns a bus and runs every transaction on it from one thread.
+
+    Queued transactions run by client priority, except that one that has
+    waited longer than its client's max_wait runs next regardless, which
+    bounds how long a low priority client can be starved.
+    """
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._cond = threading.Condition()
+        self._heap = []
+        self._fifo = collections.deque()
+        self._queued = {}
+        self._seq = itertools.count()
+        self._stopped = False
+        self.clients = {}
+        self._thread = threading.Thread(target=self._run, name='i2cbus', daemon=True)
+        self._thread.start()
+
+    def client(self, name, priority=SENSOR, max_wait=1.0, registry=metrics.default):
+        c = Client(self, name, priority, max_wait)
+        self.clients[name] = c
+        stats = c.stats
+        registry.counter_func('i2c_transactions_total', 'I2C transactions.',
+                              lambda: stats.transactions, device=name)
+        registry.counter_func('i2c_bytes_total', 'Bytes read and written over I2C.',
+                              lambda: stats.bytes, device=name)
+        registry.counter_func('i2c_errors_total', 'Failed I2C transactions.',
+                              lambda: stats.errors, device=name)
+        registry.counter_func('i2c_wait_seconds_total', 'Time transactions waited for the bus.',
+                              lambda: stats.wait_total, device=name)
+        return c
+
+    def stats(self):
+        return {name: c.stats.as_dict() for name, c in self.clients.items()}
+
+    def in_worker(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, client, f, coalesce=None):
+        """Queues f(bus) and returns a Future of its result. If a transaction
+        of client with the same coalesce key is still queued, f replaces it
+        and both callers get the result of f."""
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('bus manager stopped')
+            key = None if coalesce is None else (client.name, coalesce)
+            t = self._queued.get(key) if key is not None else None
+            if t is not None and not t.started:
+                t.f = f
+                client.stats.coalesced += 1
+                return t.future
+            t = _Transaction(client, f, next(self._seq), key)
+            if key is not None:
+                self._queued[key] = t
+            heapq.heappush(self._heap, t)
+            self._fifo.append(t)
+            self._cond.notify()
+            return t.future
+
+    def _next(self):
+        while self._fifo and self._fifo[0].started:
+            self._fifo.popleft()
+        while self._heap and self._heap[0].started:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        oldest = self._fifo[0]
+        if time.monotonic() - oldest.submitted > oldest.client.max_wait:
+            return oldest
+        return self._heap[0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                t = self._next()
+                while t is None and not self._stopped:
+                    self._cond.wait()
+                    t = self._next()
+                if t is None:
+                    return
+                t.started = True
+                if t.key is not None:
+                    del self._queued[t.key]
+            if not t.future.set_running_or_notify_cancel():
+                continue
+            wait = time.monotonic() - t.submitted
+            stats = t.client.stats
+            stats.wait_total += wait
+            stats.wait_max = max(stats.wait_max, wait)
+            try:
+                t.future.set_result(t.f(t.client))
+            except BaseException as e:
+                stats.errors += 1
+                t.future.set_exception(e)
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self._bus.close()
+
+
+class Client(object):
+    """Stands in for an SMBus for one device. Every call is a transaction
+    queued on the BusManager; calls made from inside a transaction run
+    directly."""
+
+    def __init__(self, manager, name, priority, max_wait):
+        self._manager = manager
+        self.name = name
+        self.priority = priority
+        self.max_wait = max_wait
+        self.stats = DeviceStats()
+
+    def transaction(self, f, coalesce=None, wait=True):
+        """Runs f(self) as one transaction; other devices get the bus only
+        before or after it."""
+        if self._manager.in_worker():
+            return f(self)
+        future = self._manager.submit(self, f, coalesce)
+        return future.result() if wait else future
+
+    def _call(self, name, *args):
+        result = getattr(self._manager._bus, name)(*args)
+        self.stats.transactions += 1
+        self.stats.bytes += _payload_bytes(name, args, result)
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(self._manager._bus, name, None)):
+            raise AttributeError(name)
+        return lambda *args: self.transaction(lambda _: self._call(name, *args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+@contextlib.contextmanager
+def maybe_open(bus=None, bus_id=1):
+    """Yields bus, or a freshly opened SMBus(bus_id) that gets closed
+    afterwards."""
+    if bus is not None:
+        yield bus
+    else:
+        with smbus2.SMBus(bus_id) as bus:
+            yield bus
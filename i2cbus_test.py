@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+import i2cbus
+
+
+class FakeBus(object):
+
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def write_i2c_block_data(self, addr, reg, data):
+        self.gate.wait()
+        self.calls.append(('write', addr, list(data)))
+
+    def read_byte_data(self, addr, reg):
+        self.gate.wait()
+        self.calls.append(('read', addr, reg))
+        return reg + 1
+
+    def close(self):
+        pass
+
+
+class BusManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = FakeBus()
+        self.manager = i2cbus.BusManager(self.bus)
+
+    def tearDown(self):
+        self.bus.gate.set()
+        self.manager.close()
+
+    def test_proxy(self):
+        c = self.manager.client('a')
+        self.assertEqual(3, c.read_byte_data(0x5a, 2))
+        c.write_i2c_block_data(0x5a, 0, [1, 2, 3])
+        self.assertEqual([('read', 0x5a, 2), ('write', 0x5a, [1, 2, 3])], self.bus.calls)
+        stats = self.manager.stats()['a']
+        self.assertEqual(2, stats['transactions'])
+        self.assertEqual(4, stats['bytes'])
+        self.assertRaises(AttributeError, getattr, c, 'no_such_call')
+
+    def block(self):
+        # Occupies the worker until the gate opens.
+        self.bus.gate.clear()
+        c = self.manager.client('blocker')
+        return c.transaction(lambda bus: bus.read_byte_data(0, 0), wait=False)
+
+    def test_priority(self):
+        display = self.manager.client('display', i2cbus.DISPLAY)
+        sensor = self.manager.client('sensor', i2cbus.SENSOR)
+        blocker = self.block()
+        time.sleep(0.05)
+        d = display.transaction(lambda bus: bus.read_byte_data(0x3c, 0), wait=False)
+        s = sensor.transaction(lambda bus: bus.read_byte_data(0x5a, 0), wait=False)
+        self.bus.gate.set()
+        for f in (blocker, d, s):
+            f.result()
+        self.assertEqual([0, 0x5a, 0x3c], [c[1] for c in self.bus.calls])
+
+    def test_max_wait(self):
+        display = self.manager.client('display', i2cbus.DISPLAY, max_wait=0.01)
+        sensor = self.manager.client('sensor', i2cbus.SENSOR)
+        blocker = self.block()
+        time.sleep(0.05)
+        d = display.transaction(lambda bus: bus.read_byte_data(0x3c, 0), wait=False)
+        time.sleep(0.05)
+        s = sensor.transaction(lambda bus: bus.read_byte_data(0x5a, 0), wait=False)
+        self.bus.gate.set()
+        for f in (blocker, d, s):
+            f.result()
+        self.assertEqual([0, 0x3c, 0x5a], [c[1] for c in self.bus.calls])
+
+    def test_coalesce(self):
+        display = self.manager.client('display', i2cbus.DISPLAY)
+        blocker = self.block()
+        time.sleep(0.05)
+        first = display.transaction(lambda bus: bus.read_byte_data(0x3c, 1), coalesce='flush', wait=False)
+        second = display.transaction(lambda bus: bus.read_byte_data(0x3c, 2), coalesce='flush', wait=False)
+        self.bus.gate.set()
+        self.assertIs(first, second)
+        self.assertEqual(3, second.result())
+        blocker.result()
+        self.assertEqual(2, len(self.bus.calls))
+        self.assertEqual(1, self.manager.stats()['display']['coalesced'])
+
+
+if __name__ == '__main__':
+    unittest.main()
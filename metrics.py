@@ -0,0 +1,173 @@
+import bisect
+import http.server
+import os
+import threading
+
+# Upper bounds in seconds, from a display flush to a slow upload.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+                             for k, v in sorted(labels.items()))
+
+
+class Counter(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram(object):
+    """Counts of observations at or below each bucket bound, plus their
+    count and sum."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, v):
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        n = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            n += count
+            yield name + '_bucket', dict(labels, le=bound), n
+        yield name + '_count', labels, n
+        yield name + '_sum', labels, total
+
+
+class _Func(object):
+    """A counter or gauge read from f() at export time, for values the code
+    already keeps (e.g. pm25.PMS5003Reader counters)."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def samples(self, name, labels):
+        yield name, labels, self.f()
+
+
+class Registry(object):
+    """Named metrics with labels, exported in the Prometheus text format.
+
+    Updating a counter or histogram takes a lock and a few additions, so
+    they can stay on permanently; values the code already counts are better
+    registered as functions and only read at export time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help, {sorted label items: metric})
+        self._families = {}
+
+    def _get(self, name, kind, help, labels, make):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help, {}))
+            if family[0] != kind:
+                raise ValueError('%s is a %s' % (name, family[0]))
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = make()
+            return metric
+
+    def counter(self, name, help, **labels):
+        return self._get(name, 'counter', help, labels, Counter)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(name, 'histogram', help, labels, lambda: Histogram(buckets))
+
+    def counter_func(self, name, help, f, **labels):
+        """Exports f() as a counter; replaces an earlier f with the same
+        labels."""
+        self._set(name, 'counter', help, labels, _Func(f))
+
+    def gauge_func(self, name, help, f, **labels):
+        self._set(name, 'gauge', help, labels, _Func(f))
+
+    def _set(self, name, kind, help, labels, metric):
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help, {}))
+            family[2][tuple(sorted(labels.items()))] = metric
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in sorted(self._families.items())]
+        lines = []
+        for name, kind, help, metrics in families:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for key, metric in metrics:
+                try:
+                    for sample, labels, value in metric.samples(name, dict(key)):
+                        lines.append('%s%s %s' % (sample, _labels(labels), value))
+                except Exception as e:
+                    print('metric %s: %s' % (name, e))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Atomically replaces path with the metrics, e.g. for the
+        node_exporter textfile collector."""
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def export_loop(self, path, stop, interval=10):
+        """Writes the metrics to path every interval seconds and once more
+        when stop is set."""
+        while True:
+            stopped = stop.wait(interval)
+            try:
+                self.write(path)
+            except Exception as e:
+                print(e)
+            if stopped:
+                break
+
+    def serve(self, port, host=''):
+        """Serves the metrics over HTTP from a daemon thread; returns the
+        server (call shutdown() to stop it)."""
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+default = Registry()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+
+import metrics
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_counter(self):
+        r = metrics.Registry()
+        c = r.counter('polls_total', 'Polls.', device='0x5a')
+        c.inc()
+        c.inc(2)
+        self.assertIs(r.counter('polls_total', 'Polls.', device='0x5a'), c)
+        r.counter('polls_total', 'Polls.', device='0x5b').inc()
+        self.assertEqual(r.render(), '\n'.join([
+            '# HELP polls_total Polls.',
+            '# TYPE polls_total counter',
+            'polls_total{device="0x5a"} 3',
+            'polls_total{device="0x5b"} 1',
+        ]) + '\n')
+
+    def test_histogram(self):
+        r = metrics.Registry()
+        h = r.histogram('flush_seconds', 'Flushes.', buckets=(0.01, 0.1))
+        for v in (0.005, 0.01, 0.05, 1):
+            h.observe(v)
+        lines = r.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'flush_seconds_bucket{le="0.01"} 2',
+            'flush_seconds_bucket{le="0.1"} 3',
+            'flush_seconds_bucket{le="+Inf"} 4',
+            'flush_seconds_count 4',
+            'flush_seconds_sum 1.065',
+        ])
+
+    def test_func(self):
+        r = metrics.Registry()
+        value = [1]
+        r.counter_func('bytes_total', 'Bytes.', lambda: value[0], sensor=0)
+        value[0] = 5
+        self.assertIn('bytes_total{sensor="0"} 5\n', r.render())
+        r.counter_func('bytes_total', 'Bytes.', lambda: 7, sensor=0)
+        self.assertIn('bytes_total{sensor="0"} 7\n', r.render())
+
+    def test_type_mismatch(self):
+        r = metrics.Registry()
+        r.counter('x', 'X.')
+        with self.assertRaises(ValueError):
+            r.histogram('x', 'X.')
+
+    def test_write(self):
+        r = metrics.Registry()
+        r.counter('x_total', 'X.').inc()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'air_quality.prom')
+            r.write(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), r.render())
+            self.assertEqual(os.listdir(d), ['air_quality.prom'])
+
+    def test_serve(self):
+        r = metrics.Registry()
+        r.counter('x_total', 'X.').inc()
+        server = r.serve(0, '127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                self.assertEqual(response.read().decode(), r.render())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import fcntl
+import socket
+import struct
+import threading
+import time
+
+SIOCGIFADDR = 0x8915
+
+
+def ipv4_address(ifname, sock=None):
+    """Returns the IPv4 address of ifname as a string, or None if it has
+    none (or does not exist)."""
+    if sock is None:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            return ipv4_address(ifname, sock)
+    try:
+        ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFADDR,
+                            struct.pack('256s', ifname[:15].encode()))
+    except OSError:
+        return None
+    return socket.inet_ntoa(ifreq[20:24])
+
+
+class NetInfo(object):
+    """Interface addresses looked up in-process and cached for ttl seconds.
+
+    Listeners are called with (ifname, address) whenever a lookup finds an
+    address different from the previous one.
+    """
+
+    def __init__(self, interfaces=('eth0', 'wlan0'), ttl=30, lookup=None,
+                 clock=time.monotonic):
+        self.interfaces = tuple(interfaces)
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._listeners = []
+        if lookup is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            lookup = lambda ifname: ipv4_address(ifname, self._sock)
+        self._lookup = lookup
+
+    def add_listener(self, f):
+        self._listeners.append(f)
+
+    def address(self, ifname):
+        now = self._clock()
+        with self._lock:
+            cached = self._cache.get(ifname)
+            if cached is not None and now < cached[1]:
+                return cached[0]
+            previous = cached[0] if cached is not None else None
+            address = self._lookup(ifname)
+            self._cache[ifname] = address, now + self.ttl
+        if address != previous:
+            for f in self._listeners:
+                f(ifname, address)
+        return address
+
+    def addresses(self):
+        return {i: self.address(i) for i in self.interfaces}
+
+    def first(self):
+        """Returns (ifname, address) of the first interface that has an
+        address, or None."""
+        for i in self.interfaces:
+            address = self.address(i)
+            if address is not None:
+                return i, address
+        return None
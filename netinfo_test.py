@@ -0,0 +1,44 @@
+import unittest
+
+import netinfo
+
+
+class NetInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.table = {'eth0': None, 'wlan0': '10.0.0.2'}
+        self.lookups = 0
+        self.changes = []
+
+        def lookup(ifname):
+            self.lookups += 1
+            return self.table.get(ifname)
+
+        self.net = netinfo.NetInfo(ttl=10, lookup=lookup, clock=lambda: self.now)
+        self.net.add_listener(lambda *args: self.changes.append(args))
+
+    def test_first(self):
+        self.assertEqual(('wlan0', '10.0.0.2'), self.net.first())
+        self.table['eth0'] = '192.168.1.2'
+        self.now = 11
+        self.assertEqual(('eth0', '192.168.1.2'), self.net.first())
+
+    def test_cache_and_notify(self):
+        self.assertEqual('10.0.0.2', self.net.address('wlan0'))
+        self.table['wlan0'] = '10.0.0.3'
+        self.now = 5
+        self.assertEqual('10.0.0.2', self.net.address('wlan0'))
+        self.assertEqual(1, self.lookups)
+        self.now = 10
+        self.assertEqual('10.0.0.3', self.net.address('wlan0'))
+        self.assertEqual(2, self.lookups)
+        self.assertEqual([('wlan0', '10.0.0.2'), ('wlan0', '10.0.0.3')], self.changes)
+
+    def test_ipv4_address(self):
+        self.assertEqual('127.0.0.1', netinfo.ipv4_address('lo'))
+        self.assertIsNone(netinfo.ipv4_address('nosuchif0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
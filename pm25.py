@@ -1,9 +1,28 @@
+import collections
+import contextlib
+import os
+import selectors
 import serial
+import struct
 import time
 
+import metrics
+import readings
 import util
 
 
+Message = collections.namedtuple('Message', [
+    'pm1_0_cf1', 'pm2_5_cf1', 'pm10_cf1', 'pm1_0', 'pm2_5', 'pm10',
+    'gt0_3um', 'gt0_5um', 'gt1_0um', 'gt2_5um', 'gt5_0um', 'gt10um', 'reserved'])
+
+FORM_URL = 'https://docs.google.com/forms/d/e/1FAIpQLSePbFzMLyEaQVJ9aW-ZRPYsXO8kfm1ay7khmRADiDz0rondYw/viewform?usp=pp_url&entry.1441205787=1970-01-01&entry.1440681565=00:00&entry.1603777044=0&entry.8655809=1&entry.668218130=2&entry.1797950773=3&entry.1371427267=4&entry.1869212283=5&entry.671273885=6&entry.2022906028=7&entry.18109896=8&entry.1464624802=9&entry.2068592484=10&entry.1601194695=11&entry.1795391290=12'
+
+FRAME_SIZE = 32
+HEADER = b'\x42\x4d'
+# Header, frame length (always 28), 13 data words and the checksum.
+_FRAME = struct.Struct('>2sH13HH')
+
+
 def parse_pms5003_message(data):
     return [util.to_int16(data[i], data[i + 1]) for i in range(4, 30, 2)]
 
@@ -18,46 +37,278 @@ def is_valid(data):
                 ])
 
 
-def generate_pms5003_message(max_bytes=1024):
-    buf = util.RingBuffer(32)
-    bytes_read_since_last_message = 0
-    with serial.Serial('/dev/ttyAMA0', 9600) as s:
+class PMS5003Reader(object):
+    """Splits a PMS5003 byte stream into decoded messages.
+
+    Bytes are accumulated in a fixed bytearray; each candidate frame starting
+    at a 0x42 0x4d header is checked once for length and checksum and decoded
+    in place. Bytes that cannot be part of a valid frame are counted as
+    garbage and every loss of sync is counted as a resync.
+    """
+
+    def __init__(self, buf_size=256):
+        assert buf_size >= 2 * FRAME_SIZE
+        self.buf = bytearray(buf_size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.bytes_read = 0
+        self.frames = 0
+        self.invalid_frames = 0
+        self.resyncs = 0
+        self.garbage_bytes = 0
+        self.bytes_since_last_frame = 0
+        self.in_sync = False
+
+    def _compact(self):
+        n = self.end - self.start
+        if self.start:
+            self.buf[:n] = self.buf[self.start:self.end]
+            self.start, self.end = 0, n
+
+    def read(self, port):
+        """Reads whatever the port has (at least enough to finish a frame,
+        blocking if needed) and returns the decoded messages. Raises
+        OSError at the end of the stream, e.g. once the port is closed."""
+        self._compact()
+        pending = self.end - self.start
+        n = min(max(port.in_waiting, FRAME_SIZE - pending, 1),
+                len(self.buf) - self.end)
+        n = port.readinto(self.view[self.end:self.end + n])
+        if not n:
+            raise OSError('end of the PMS5003 stream')
+        self.end += n
+        self.bytes_read += n
+        self.bytes_since_last_frame += n
+        return self._scan()
+
+    def feed(self, data):
+        """Appends data to the buffer and returns the decoded messages."""
+        messages = []
+        data = memoryview(data)
+        while data:
+            self._compact()
+            n = min(len(data), len(self.buf) - self.end)
+            self.buf[self.end:self.end + n] = data[:n]
+            self.end += n
+            self.bytes_read += n
+            self.bytes_since_last_frame += n
+            data = data[n:]
+            messages.extend(self._scan())
+        return messages
+
+    def _discard(self, upto):
+        if upto > self.start:
+            self.garbage_bytes += upto - self.start
+            self.start = upto
+            if self.in_sync:
+                self.resyncs += 1
+                self.in_sync = False
+
+    def _scan(self):
+        messages = []
+        buf = self.buf
         while True:
-            b = ord(s.read())
-            buf.put(b)
-            data = buf.get()
-            if is_valid(data):
-                yield data
-                bytes_read_since_last_message = 0
-            else:
-                bytes_read_since_last_message += 1
-                if max_bytes > 0 and bytes_read_since_last_message >= max_bytes:
-                    raise RuntimeError(
-                        '%d bytes read without seeing a valid PMS5003 message.' % bytes_read_since_last_message)
+            i = buf.find(HEADER, self.start, self.end)
+            if i < 0:
+                # Keep a trailing 0x42, it may be the first half of a header.
+                keep = self.end > self.start and buf[self.end - 1] == 0x42
+                self._discard(self.end - keep)
+                break
+            self._discard(i)
+            if self.end - i < FRAME_SIZE:
+                break
+            _, length, *words, checksum = _FRAME.unpack_from(buf, i)
+            if length != FRAME_SIZE - 4 or \
+                    sum(self.view[i:i + FRAME_SIZE - 2]) != checksum:
+                self.invalid_frames += 1
+                # Skip the header only, a real frame may start inside.
+                self._discard(i + 1)
+                continue
+            messages.append(Message._make(words))
+            self.start = i + FRAME_SIZE
+            self.frames += 1
+            self.in_sync = True
+            self.bytes_since_last_frame = self.end - self.start
+        return messages
+
+    def stats(self):
+        return {'bytes_read': self.bytes_read, 'frames': self.frames,
+                'invalid_frames': self.invalid_frames,
+                'resyncs': self.resyncs, 'garbage_bytes': self.garbage_bytes}
+
+    def export_metrics(self, sensor=0, registry=metrics.default):
+        """Exports the counters of stats(); they are only read at export
+        time, so the read path pays nothing."""
+        for name, help in (('bytes_read', 'Bytes read from the PMS5003.'),
+                           ('frames', 'Valid PMS5003 frames.'),
+                           ('invalid_frames', 'PMS5003 frames with a bad checksum or length.'),
+                           ('resyncs', 'Times the PMS5003 stream lost frame sync.'),
+                           ('garbage_bytes', 'PMS5003 bytes skipped while looking for a frame.')):
+            registry.counter_func('pms5003_%s_total' % name, help,
+                                  lambda name=name: getattr(self, name), sensor=sensor)
+
+
+def open_pms5003(device='/dev/ttyAMA0'):
+    return serial.Serial(device, 9600)
+
 
-def pm25_loop(stop=None):
+def generate_pms5003_message(port=None, reader=None, max_bytes=1024):
+    """Yields decoded Messages from port (by default a freshly opened
+    /dev/ttyAMA0).
+
+    Raises RuntimeError after max_bytes without a valid message; the port is
+    left open so that the caller can carry on reading from it.
+    """
+    if port is None:
+        with open_pms5003() as port:
+            yield from generate_pms5003_message(port, reader, max_bytes)
+        return
+    if reader is None:
+        reader = PMS5003Reader()
+    while True:
+        messages = reader.read(port)
+        yield from messages
+        if not messages and max_bytes > 0 and reader.bytes_since_last_frame >= max_bytes:
+            n = reader.bytes_since_last_frame
+            reader.bytes_since_last_frame = 0
+            raise RuntimeError(
+                '%d bytes read without seeing a valid PMS5003 message (%s).' % (n, reader.stats()))
+
+
+def pm25_loop(stop=None, history=None, registry=readings.default, port=None,
+              device='/dev/ttyAMA0', retry_interval=1):
+    """Reads the PMS5003 on port or, if None, on device, which is opened
+    again after an error of the port (e.g. once it is plugged back in)."""
     with util.flock('/tmp/pm25.lock'):
-        throttle = util.Throttle(60)
-        # poster = util.GoogleFormPoster('https://docs.google.com/forms/d/e/1FAIpQLSePbFzMLyEaQVJ9aW-ZRPYsXO8kfm1ay7khmRADiDz0rondYw/viewform?usp=pp_url&entry.1441205787=1970-01-01&entry.1440681565=00:00&entry.1603777044=0&entry.8655809=1&entry.668218130=2&entry.1797950773=3&entry.1371427267=4&entry.1869212283=5&entry.671273885=6&entry.2022906028=7&entry.18109896=8&entry.1464624802=9&entry.2068592484=10&entry.1601194695=11&entry.1795391290=12')
-        status_file = '/tmp/pm25.txt'
-        while stop is None or not stop.is_set():
-            try:
-                for i in generate_pms5003_message():
-                    when = time.gmtime()
-                    ints = parse_pms5003_message(i)
-                    util.dump(ints[4], status_file)
-                    try:
-                      print(when, 'PM25:', ints) # , throttle.maybe_run(lambda: poster.post(when, ints)))
-                    except:
-                      pass
-                    if stop is not None and stop.is_set():
-                        break
-            except Exception as e:
-                print(e)
-                util.dump('error', status_file)
-                time.sleep(1)
+        reader = PMS5003Reader()
+        reader.export_metrics()
+        reopen = port is None
+        try:
+            while stop is None or not stop.is_set():
+                try:
+                    if port is None:
+                        port = open_pms5003(device)
+                    for ints in generate_pms5003_message(port, reader):
+                        when = time.gmtime()
+                        registry.publish('pm25', ints)
+                        if history is not None:
+                            history.append(ints)
+                        try:
+                          print(when, 'PM25:', ints)
+                        except:
+                          pass
+                        if stop is not None and stop.is_set():
+                            break
+                except Exception as e:
+                    print(e)
+                    registry.publish('pm25', e)
+                    # serial.SerialException is an OSError; a RuntimeError
+                    # about garbled data keeps the port.
+                    if reopen and port is not None and isinstance(e, OSError):
+                        port.close()
+                        port = None
+                    time.sleep(retry_interval)
+        finally:
+            if port is not None:
+                port.close()
         print('exit pm25')
 
 
+def sensor_key(sensor):
+    """Registry key of the readings of a sensor; sensor 0 keeps the plain
+    'pm25' of the single sensor setup."""
+    return 'pm25.%d' % sensor if sensor else 'pm25'
+
+
+class _Sensor(object):
+    """Port, frame sync state and retry time of one multiplexed sensor."""
+
+    def __init__(self, n, device):
+        self.n = n
+        self.key = sensor_key(n)
+        self.device = device
+        self.port = None
+        self.reader = PMS5003Reader()
+        self.reader.export_metrics(sensor=n)
+        self.retry_at = 0
+
+
+def multi_pm25_loop(devices, stop=None, histories=None, registry=readings.default,
+                    max_bytes=1024, retry_interval=10):
+    """Reads PMS5003 sensors on several serial ports from one thread.
+
+    devices are device paths or already open ports (anything with fileno(),
+    in_waiting and read(), e.g. fakes.FakeSerial). The sensor at index n
+    publishes under sensor_key(n) and appends to histories[n] if given. A
+    port that fails is closed and, if it was opened from a path, reopened
+    every retry_interval seconds.
+    """
+    sensors = [_Sensor(n, d) for n, d in enumerate(devices)]
+    histories = histories or {}
+    paths = [d for d in devices if isinstance(d, str)]
+    with contextlib.ExitStack() as stack:
+        for path in paths:
+            stack.enter_context(util.flock('/tmp/pm25.%s.lock' % os.path.basename(path)))
+        sel = stack.enter_context(selectors.DefaultSelector())
+
+        def close(sensor, e):
+            print('%s: %s' % (sensor.key, e))
+            registry.publish(sensor.key, e)
+            if sensor.port is not None:
+                sel.unregister(sensor.port)
+                sensor.port.close()
+                sensor.port = None
+            sensor.retry_at = time.monotonic() + retry_interval
+
+        def maybe_open(sensor):
+            if sensor.port is not None or time.monotonic() < sensor.retry_at:
+                return
+            if isinstance(sensor.device, str):
+                try:
+                    sensor.port = serial.Serial(sensor.device, 9600, timeout=0)
+                except Exception as e:
+                    close(sensor, e)
+                    return
+            elif sensor.retry_at:
+                # Can't reopen a port we were given.
+                return
+            else:
+                sensor.port = sensor.device
+            sel.register(sensor.port, selectors.EVENT_READ, sensor)
+
+        try:
+            while stop is None or not stop.is_set():
+                for sensor in sensors:
+                    maybe_open(sensor)
+                for key, _ in sel.select(timeout=1):
+                    sensor = key.data
+                    reader = sensor.reader
+                    try:
+                        messages = reader.feed(sensor.port.read(sensor.port.in_waiting or 1))
+                    except Exception as e:
+                        close(sensor, e)
+                        continue
+                    for m in messages:
+                        registry.publish(sensor.key, m)
+                        history = histories.get(sensor.n)
+                        if history is not None:
+                            history.append(m)
+                    if not messages and max_bytes > 0 and \
+                            reader.bytes_since_last_frame >= max_bytes:
+                        e = RuntimeError(
+                            '%d bytes read without seeing a valid PMS5003 message (%s).' %
+                            (reader.bytes_since_last_frame, reader.stats()))
+                        print('%s: %s' % (sensor.key, e))
+                        registry.publish(sensor.key, e)
+                        reader.bytes_since_last_frame = 0
+        finally:
+            for sensor in sensors:
+                if sensor.port is not None:
+                    sel.unregister(sensor.port)
+                    sensor.port.close()
+        print('exit pm25', ' '.join(s.key for s in sensors))
+
+
 if __name__ == '__main__':
     pm25_loop()
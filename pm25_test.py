@@ -0,0 +1,171 @@
+import struct
+import threading
+import unittest
+from unittest import mock
+
+import fakes
+import pm25
+import readings
+
+
+def frame(*words):
+    words = list(words) + [0] * (13 - len(words))
+    data = struct.pack('>2sH13H', b'BM', 28, *words)
+    return data + struct.pack('>H', sum(data))
+
+
+class FakePort(object):
+
+    def __init__(self, data, chunk=8):
+        self.data = data
+        self.chunk = chunk
+
+    @property
+    def in_waiting(self):
+        return min(len(self.data), self.chunk)
+
+    def readinto(self, b):
+        n = min(len(b), len(self.data), self.chunk)
+        b[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+class PMS5003ReaderTest(unittest.TestCase):
+
+    def test_frame_is_valid(self):
+        self.assertTrue(pm25.is_valid(list(frame(1, 2, 3))))
+
+    def test_feed(self):
+        reader = pm25.PMS5003Reader()
+        messages = reader.feed(frame(1, 2, 3, 4, 5) + frame(6))
+        self.assertEqual(2, len(messages))
+        self.assertEqual(5, messages[0].pm2_5)
+        self.assertEqual(pm25.parse_pms5003_message(frame(1, 2, 3, 4, 5)),
+                         list(messages[0]))
+        self.assertEqual(6, messages[1][0])
+        self.assertEqual(0, reader.garbage_bytes)
+        self.assertEqual(0, reader.resyncs)
+
+    def test_feed_split(self):
+        reader = pm25.PMS5003Reader()
+        data = frame(1) + frame(2) + frame(3)
+        messages = []
+        for i in range(len(data)):
+            messages.extend(reader.feed(data[i:i + 1]))
+        self.assertEqual([1, 2, 3], [m[0] for m in messages])
+
+    def test_feed_garbage(self):
+        reader = pm25.PMS5003Reader()
+        messages = reader.feed(b'\x00\x42\x4d\x42' + frame(1) + b'\x42\x42' + frame(2))
+        self.assertEqual([1, 2], [m[0] for m in messages])
+        self.assertEqual(6, reader.garbage_bytes)
+        self.assertEqual(1, reader.resyncs)
+        self.assertEqual(1, reader.invalid_frames)
+
+    def test_feed_bad_checksum(self):
+        reader = pm25.PMS5003Reader()
+        bad = bytearray(frame(9))
+        bad[-1] ^= 1
+        messages = reader.feed(frame(1) + bytes(bad) + frame(2))
+        self.assertEqual([1, 2], [m[0] for m in messages])
+        self.assertEqual(1, reader.invalid_frames)
+        self.assertEqual(1, reader.resyncs)
+        self.assertEqual(32, reader.garbage_bytes)
+
+    def test_generate_pms5003_message(self):
+        port = FakePort(b'\x00' * 7 + frame(1) + frame(2))
+        messages = pm25.generate_pms5003_message(port)
+        self.assertEqual(1, next(messages)[0])
+        self.assertEqual(2, next(messages)[0])
+
+    def test_generate_pms5003_message_max_bytes(self):
+        port = FakePort(b'\x00' * 80 + frame(1))
+        reader = pm25.PMS5003Reader()
+        messages = pm25.generate_pms5003_message(port, reader, max_bytes=64)
+        self.assertRaises(RuntimeError, next, messages)
+        # The port is still usable after the error.
+        messages = pm25.generate_pms5003_message(port, reader, max_bytes=64)
+        self.assertEqual(1, next(messages)[0])
+
+    def test_generate_pms5003_message_eof(self):
+        messages = pm25.generate_pms5003_message(FakePort(frame(1)))
+        self.assertEqual(1, next(messages)[0])
+        self.assertRaises(OSError, next, messages)
+
+
+class MultiPM25LoopTest(unittest.TestCase):
+
+    def test_sensors_publish_their_own_keys(self):
+        registry = readings.Registry()
+        stop = threading.Event()
+        ports = [fakes.FakeSerial(iter([frame(0, 0, 0, 0, n)] * 3 + [b'x' * 100]), speed=1000)
+                 for n in (10, 11, 12)]
+        published = {}
+
+        def listener(key):
+            published.setdefault(key, []).append(registry.get(key).value)
+            if sum(len(v) for v in published.values()) >= 12:
+                stop.set()
+
+        registry.add_listener(listener)
+        histories = {0: []}
+        thread = threading.Thread(target=pm25.multi_pm25_loop,
+                                  args=(ports, stop, histories, registry, 64))
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(published), ['pm25', 'pm25.1', 'pm25.2'])
+        for n, key in enumerate(['pm25', 'pm25.1', 'pm25.2']):
+            values = published[key]
+            self.assertEqual([m.pm2_5 for m in values[:3]], [10 + n] * 3)
+            self.assertIsInstance(values[3], RuntimeError)
+        self.assertEqual(len(histories[0]), 3)
+
+    def test_failed_port_is_closed(self):
+        registry = readings.Registry()
+        stop = threading.Event()
+
+        class BrokenPort(fakes.FakeSerial):
+            def read(self, size=1):
+                raise OSError('unplugged')
+
+        port = BrokenPort(iter([frame()]), speed=1000)
+        registry.add_listener(lambda key: stop.set())
+        pm25.multi_pm25_loop([port], stop, registry=registry)
+        self.assertIsInstance(registry.get('pm25').value, OSError)
+
+    def test_pm25_loop_reopens(self):
+        registry = readings.Registry()
+        stop = threading.Event()
+
+        class BrokenPort(fakes.FakeSerial):
+            def read(self, size=1):
+                raise OSError('unplugged')
+
+        broken = BrokenPort(iter([]))
+        opened = []
+
+        def open_pms5003(device):
+            opened.append(device)
+            if len(opened) == 1:
+                raise OSError('no such device')
+            if len(opened) == 2:
+                return broken
+            return fakes.FakeSerial(iter([frame(0, 0, 0, 0, 7)] * 10), speed=1000)
+
+        registry.add_listener(
+            lambda key: isinstance(registry.get(key).value, tuple) and stop.set())
+        with mock.patch.object(pm25, 'open_pms5003', open_pms5003):
+            thread = threading.Thread(target=pm25.pm25_loop,
+                                      args=(stop, None, registry, None, '/dev/x', 0.01))
+            thread.start()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(opened, ['/dev/x'] * 3)
+        self.assertTrue(broken._closed.is_set())
+        self.assertEqual(registry.get('pm25').value.pm2_5, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import collections
+import threading
+import time
+
+import util
+
+
+# value is whatever the producer published (e.g. a pm25.Message, a
+# ccs811.Result or an Exception), version increases with every publish and
+# when is the wall clock time of the publish.
+Reading = collections.namedtuple('Reading', ['value', 'version', 'when'])
+
+
+class Registry(object):
+    """Thread-safe latest value of every key, with change notification."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readings = {}
+        self._version = 0
+        self._listeners = []
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self, key, value, when=None):
+        if when is None:
+            when = time.time()
+        with self._cond:
+            self._version += 1
+            self._readings[key] = Reading(value, self._version, when)
+            self._cond.notify_all()
+        for f in self._listeners:
+            f(key)
+
+    def add_listener(self, f):
+        """Calls f(key) after every publish, from the publishing thread."""
+        self._listeners.append(f)
+
+    def remove_listener(self, f):
+        self._listeners.remove(f)
+
+    def get(self, key):
+        """Returns the latest Reading of key or None."""
+        return self._readings.get(key)
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self._readings)
+
+    def _changed(self, version, keys):
+        if keys is None:
+            return self._version > version
+        for k in keys:
+            r = self._readings.get(k)
+            if r is not None and r.version > version:
+                return True
+        return False
+
+    def wait(self, version, keys=None, timeout=None):
+        """Blocks until a key in keys (any key by default) is published with
+        a version newer than version, or until timeout. Returns the current
+        version, to be passed to the next call."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._changed(version, keys), timeout)
+            return self._version
+
+
+# Shared by all the device loops of air_quality.py.
+default = Registry()
+
+
+def export_loop(registry, files, stop=None):
+    """Writes changed readings to status files for external tools.
+
+    files maps a key to (path, f), where f turns a published value into what
+    is written. Exceptions are written as 'error'.
+    """
+    version = 0
+    while stop is None or not stop.is_set():
+        last, version = version, registry.wait(version, files.keys(), timeout=1)
+        for key, (path, f) in files.items():
+            r = registry.get(key)
+            if r is None or r.version <= last:
+                continue
+            try:
+                util.dump('error' if isinstance(r.value, Exception) else f(r.value), path)
+            except Exception as e:
+                print(e)
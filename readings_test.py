@@ -0,0 +1,63 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import readings
+
+
+class RegistryTest(unittest.TestCase):
+
+    def test_publish_get(self):
+        r = readings.Registry()
+        self.assertIsNone(r.get('a'))
+        r.publish('a', 1, when=10)
+        r.publish('b', 2)
+        self.assertEqual(readings.Reading(1, 1, 10), r.get('a'))
+        self.assertEqual(2, r.get('b').version)
+        self.assertEqual(2, r.version)
+        self.assertEqual({'a', 'b'}, set(r.snapshot()))
+
+    def test_wait_timeout(self):
+        r = readings.Registry()
+        r.publish('a', 1)
+        self.assertEqual(1, r.wait(1, timeout=0.01))
+        r.publish('b', 1)
+        # Only b changed since version 1.
+        self.assertEqual(2, r.wait(1, keys=['b'], timeout=0.01))
+        start = time.monotonic()
+        self.assertEqual(2, r.wait(1, keys=['a'], timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_wait_wakes_up(self):
+        r = readings.Registry()
+        t = threading.Timer(0.01, r.publish, args=('a', 1))
+        t.start()
+        self.assertEqual(1, r.wait(0, keys=['a'], timeout=10))
+        t.join()
+
+
+class ExportLoopTest(unittest.TestCase):
+
+    def test_export_loop(self):
+        r = readings.Registry()
+        stop = threading.Event()
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'a.txt')
+            t = threading.Thread(target=readings.export_loop,
+                                 args=(r, {'a': (path, lambda v: v * 2)}, stop))
+            t.start()
+            r.publish('a', 21)
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            stop.set()
+            t.join()
+            with open(path) as f:
+                self.assertEqual('42\n', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
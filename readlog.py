@@ -0,0 +1,210 @@
+import bisect
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Wall clock time, kind, sensor id and up to 13 values (the PMS5003 data
+# words, or e_co2, tvoc, raw current and raw voltage of a CCS811).
+RECORD = struct.Struct('<dBxH13H2x')
+NUM_VALUES = 13
+
+PMS5003 = 1
+CCS811 = 2
+
+Record = collections.namedtuple('Record', ['when', 'kind', 'sensor', 'values'])
+
+# Seconds records may be out of time order within a segment: readings of
+# different threads are published (and appended) slightly out of order.
+MAX_REORDER = 5
+_WHEN = struct.Struct('<d')
+
+
+def record_of(key, value):
+    """Returns (kind, sensor, values) for a reading published under key, or
+    None if it should not be logged."""
+    if isinstance(value, Exception):
+        return None
+    name, _, sensor = key.partition('.')
+    if name == 'pm25':
+        return PMS5003, int(sensor or 0), tuple(value)
+    if name == 'tvoc' and value.raw is not None:
+        return CCS811, int(sensor, 16), (value.e_co2, value.tvoc,
+                                         value.raw.current, value.raw.voltage)
+    return None
+
+
+def _segment_name(when, seq=0):
+    """Segments are named after their first record, plus a sequence number
+    if an earlier segment starts in the same second."""
+    if seq:
+        return '%012d.%d.log' % (when, seq)
+    return '%012d.log' % when
+
+
+def _segment_key(name):
+    """Returns (first second, sequence number) of a segment name."""
+    first, _, seq = name[:-len('.log')].partition('.')
+    return int(first), int(seq or 0)
+
+
+def _segments(path):
+    """Returns the sorted names of the segments in path."""
+    return sorted((f for f in os.listdir(path) if f.endswith('.log')), key=_segment_key)
+
+
+class Writer(object):
+    """Appends fixed size records to a directory of log segments.
+
+    append() only buffers. flush() writes the buffer out and run() does so
+    every flush_interval seconds, calling fsync at most every fsync_interval
+    seconds, so the SD card sees few large writes. Each flush is sorted by
+    time. A new segment is started every segment_records records, whenever
+    the clock steps back by more than MAX_REORDER seconds and by every
+    Writer, so that each segment is in time order up to MAX_REORDER and
+    none written before a restart is appended to.
+    """
+
+    def __init__(self, path, segment_records=1 << 16, flush_interval=10,
+                 fsync_interval=60):
+        self.path = path
+        self.segment_records = segment_records
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._buf = bytearray()
+        self._fd = None
+        self._records = 0
+        self._last_when = float('-inf')
+        self._last_fsync = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+
+    def _create(self, when):
+        """Starts a new segment for records from when on."""
+        seq = 0
+        while True:
+            name = os.path.join(self.path, _segment_name(when, seq))
+            try:
+                self._fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except FileExistsError:
+                seq += 1
+        self._records = 0
+        self._last_when = when
+
+    def _close_segment(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def append(self, when, kind, sensor, values):
+        values = tuple(values[:NUM_VALUES]) + (0,) * (NUM_VALUES - len(values))
+        with self._lock:
+            self._buf += RECORD.pack(when, kind, sensor, *values)
+
+    def on_publish(self, registry):
+        """Returns a registry listener that appends every loggable reading."""
+
+        def listener(key):
+            r = registry.get(key)
+            record = record_of(key, r.value)
+            if record is not None:
+                self.append(r.when, *record)
+
+        return listener
+
+    def flush(self, fsync=False):
+        with self._lock:
+            buf, self._buf = self._buf, bytearray()
+        records = [buf[i:i + RECORD.size] for i in range(0, len(buf), RECORD.size)]
+        records.sort(key=lambda r: _WHEN.unpack_from(r)[0])
+        view = memoryview(b''.join(records))
+        while view:
+            when, = _WHEN.unpack_from(view)
+            if (self._fd is None or self._records >= self.segment_records or
+                    when < self._last_when - MAX_REORDER):
+                self._close_segment()
+                self._create(when)
+            # Up to the end of the segment or a step back of the clock.
+            limit = min(len(view) // RECORD.size, self.segment_records - self._records)
+            n = 0
+            while n < limit:
+                when, = _WHEN.unpack_from(view, n * RECORD.size)
+                if when < self._last_when - MAX_REORDER:
+                    break
+                self._last_when = max(self._last_when, when)
+                n += 1
+            os.write(self._fd, view[:n * RECORD.size])
+            self._records += n
+            view = view[n * RECORD.size:]
+        now = time.monotonic()
+        if self._fd is not None and (fsync or now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._fd)
+            self._last_fsync = now
+
+    def run(self, stop):
+        while not stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(e)
+        self.close()
+
+    def close(self):
+        self.flush(fsync=True)
+        self._close_segment()
+
+
+class _Timestamps(object):
+    """Record timestamps of a mapped segment, as a sequence for bisect."""
+
+    def __init__(self, mm):
+        self._mm = mm
+
+    def __len__(self):
+        return len(self._mm) // RECORD.size
+
+    def __getitem__(self, i):
+        return _WHEN.unpack_from(self._mm, i * RECORD.size)[0]
+
+
+class Reader(object):
+    """Range queries over the segments written by Writer. Assumes records
+    were appended in time order within each segment, up to MAX_REORDER
+    seconds. A partial record at the end of a segment (left by a crash) is
+    ignored."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def range(self, start, end, kind=None, sensor=None):
+        """Yields the Records with start <= when < end."""
+        segments = _segments(self.path)
+        firsts = [_segment_key(name)[0] for name in segments]
+        # The segment that may hold start is the last one starting at or
+        # before it, give or take MAX_REORDER.
+        first = max(0, bisect.bisect_right(firsts, int(start - MAX_REORDER) - 1) - 1)
+        for i in range(first, len(segments)):
+            if firsts[i] >= end + MAX_REORDER:
+                break
+            with open(os.path.join(self.path, segments[i]), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % RECORD.size
+                if not size:
+                    continue
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                    # No record is more than MAX_REORDER older than one
+                    # before it, so none before lo is in range, nor any
+                    # from hi on.
+                    times = _Timestamps(mm)
+                    lo = bisect.bisect_left(times, start - MAX_REORDER)
+                    hi = bisect.bisect_left(times, end + MAX_REORDER, lo)
+                    for j in range(lo, hi):
+                        when, k, s, *values = RECORD.unpack_from(mm, j * RECORD.size)
+                        if not start <= when < end:
+                            continue
+                        if (kind is None or k == kind) and (sensor is None or s == sensor):
+                            yield Record(when, k, s, tuple(values))
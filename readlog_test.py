@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+import readings
+import readlog
+
+
+class ReadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_write_read(self):
+        w = readlog.Writer(self.path, segment_records=10)
+        for i in range(25):
+            w.append(1000 + i, readlog.PMS5003, 0, list(range(i, i + 13)))
+            w.append(1000 + i + 0.5, readlog.CCS811, 0x5a, (400 + i, i, 1, 2))
+        w.close()
+        self.assertEqual(5, len(os.listdir(self.path)))
+        r = readlog.Reader(self.path)
+        records = list(r.range(1003, 1020.5))
+        self.assertEqual(35, len(records))
+        self.assertEqual(1003, records[0].when)
+        self.assertEqual(1020, records[-1].when)
+        pms = list(r.range(1010, 1012, kind=readlog.PMS5003))
+        self.assertEqual([10, 11], [rec.values[0] for rec in pms])
+        ccs = list(r.range(0, 2000, sensor=0x5a))
+        self.assertEqual(25, len(ccs))
+        self.assertEqual((424, 24, 1, 2) + (0,) * 9, ccs[-1].values)
+
+    def test_reopen_ignores_partial_record(self):
+        w = readlog.Writer(self.path)
+        w.append(1, readlog.PMS5003, 0, [1])
+        w.close()
+        name = os.path.join(self.path, os.listdir(self.path)[0])
+        with open(name, 'ab') as f:
+            f.write(b'junk')
+        w = readlog.Writer(self.path)
+        w.append(2, readlog.PMS5003, 0, [2])
+        w.close()
+        self.assertEqual([1, 2], [rec.values[0] for rec in readlog.Reader(self.path).range(0, 10)])
+
+    def test_same_second_and_restart(self):
+        # More records in one second than fit a segment, then a restart and
+        # a clock step back: every segment is new and none is appended to.
+        w = readlog.Writer(self.path, segment_records=2)
+        for i in range(5):
+            w.append(100, readlog.PMS5003, 0, [i])
+        w.close()
+        w = readlog.Writer(self.path, segment_records=2)
+        w.append(100, readlog.PMS5003, 0, [5])
+        w.flush()
+        w.append(50, readlog.PMS5003, 0, [6])
+        w.close()
+        self.assertEqual(['000000000050.log', '000000000100.log', '000000000100.1.log',
+                          '000000000100.2.log', '000000000100.3.log'],
+                         readlog._segments(self.path))
+        self.assertEqual([6, 0, 1, 2, 3, 4, 5],
+                         [rec.values[0] for rec in readlog.Reader(self.path).range(0, 200)])
+
+    def test_small_reorder(self):
+        # Readings of other threads come a little late, within a flush and
+        # across flushes: no new segment, and ranges still find them.
+        w = readlog.Writer(self.path)
+        w.append(100, readlog.PMS5003, 0, [0])
+        w.append(99.5, readlog.PMS5003, 0, [1])
+        w.flush()
+        w.append(99.8, readlog.PMS5003, 0, [2])
+        w.append(101, readlog.PMS5003, 0, [3])
+        w.close()
+        self.assertEqual(['000000000099.log'], readlog._segments(self.path))
+        r = readlog.Reader(self.path)
+        self.assertEqual([1, 0, 2, 3], [rec.values[0] for rec in r.range(0, 200)])
+        self.assertEqual([1, 2], [rec.values[0] for rec in r.range(99, 100)])
+        self.assertEqual([0, 3], [rec.values[0] for rec in r.range(100, 102)])
+
+    def test_on_publish(self):
+        registry = readings.Registry()
+        w = readlog.Writer(self.path)
+        registry.add_listener(w.on_publish(registry))
+        registry.publish('pm25', tuple(range(13)), when=5)
+        registry.publish('pm25', RuntimeError('no data'), when=6)
+        registry.publish('other', 1, when=7)
+        w.close()
+        records = list(readlog.Reader(self.path).range(0, 10))
+        self.assertEqual([readlog.Record(5, readlog.PMS5003, 0, tuple(range(13)))], records)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import collections
+import math
+import operator
+import threading
+import time
+
+MINUTE = 60
+HOUR = 3600
+DAY = 24 * 3600
+
+Summary = collections.namedtuple(
+    'Summary', ['count', 'min', 'max', 'mean', 'stddev', 'quantiles'])
+
+# A finished window: stats maps a channel to its Summary.
+Window = collections.namedtuple('Window', ['key', 'period', 'start', 'stats'])
+
+
+class P2Quantile(object):
+    """Streaming estimate of quantile p with the P-square algorithm (Jain
+    and Chlamtac, 1985): five markers, O(1) memory and time per value."""
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if d >= 1 and n[i + 1] - n[i] > 1 or d <= -1 and n[i - 1] - n[i] < -1:
+                d = 1 if d > 0 else -1
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if not q:
+            return None
+        if len(q) < 5:
+            return q[min(len(q) - 1, int(round(self.p * (len(q) - 1))))]
+        return q[2]
+
+
+class Stats(object):
+    """Count, min, max, mean and variance (Welford) plus P-square quantile
+    estimates of a stream of values."""
+
+    def __init__(self, quantiles=()):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        self.count += 1
+        if self.count == 1:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        for q in self._quantiles:
+            q.add(x)
+
+    def summary(self):
+        stddev = math.sqrt(self._m2 / self.count) if self.count else None
+        return Summary(self.count, self.min, self.max,
+                       self.mean if self.count else None, stddev,
+                       {q.p: q.value() for q in self._quantiles})
+
+
+class Aggregator(object):
+    """Per-minute, per-hour and per-day rollups of published readings.
+
+    channels maps a registry key to the attributes (dotted names are fine)
+    of its readings to aggregate. Windows are aligned to multiples of their
+    period (in wall clock seconds) and are finished by the first reading
+    past their end, or by tick(). Subscribers get every finished Window.
+    """
+
+    def __init__(self, channels, periods=(MINUTE, HOUR, DAY),
+                 quantiles=(0.5, 0.9)):
+        self.channels = channels
+        self._getters = {k: [(c, operator.attrgetter(c)) for c in cs]
+                         for k, cs in channels.items()}
+        self.periods = tuple(periods)
+        self.quantiles = tuple(quantiles)
+        self._lock = threading.Lock()
+        # (key, period) -> (window start, {channel: Stats})
+        self._open = {}
+        self._subscribers = []
+
+    def subscribe(self, f, key=None, period=None):
+        """Calls f(window) for every finished Window, optionally only for
+        one key and/or period."""
+        self._subscribers.append((f, key, period))
+
+    def _new(self, key):
+        return {c: Stats(self.quantiles) for c in self.channels[key]}
+
+    def _finish(self, windows):
+        for w in windows:
+            for f, key, period in self._subscribers:
+                if (key is None or key == w.key) and (period is None or period == w.period):
+                    f(w)
+
+    def _close(self, key, period, start):
+        _, stats = self._open.pop((key, period))
+        return Window(key, period, start,
+                      {c: s.summary() for c, s in stats.items()})
+
+    def add(self, key, when, value):
+        """Adds the channels of value, published under key at when."""
+        finished = []
+        with self._lock:
+            for period in self.periods:
+                start = int(when) - int(when) % period
+                current = self._open.get((key, period))
+                if current is not None and current[0] != start:
+                    finished.append(self._close(key, period, current[0]))
+                    current = None
+                if current is None:
+                    current = self._open[key, period] = start, self._new(key)
+                stats = current[1]
+                for c, get in self._getters[key]:
+                    stats[c].add(get(value))
+        self._finish(finished)
+
+    def tick(self, now):
+        """Finishes the windows that ended before now."""
+        finished = []
+        with self._lock:
+            for (key, period), (start, _) in list(self._open.items()):
+                if start + period <= now:
+                    finished.append(self._close(key, period, start))
+        self._finish(finished)
+
+    def run(self, stop, interval=1):
+        """Ticks every interval seconds until stop is set, so windows finish
+        on time without new readings."""
+        while not stop.wait(interval):
+            self.tick(time.time())
+
+    def on_publish(self, registry):
+        """Returns a registry listener that adds the readings of the keys in
+        channels."""
+
+        def listener(key):
+            if key not in self.channels:
+                return
+            r = registry.get(key)
+            if not isinstance(r.value, Exception):
+                self.add(key, r.when, r.value)
+
+        return listener
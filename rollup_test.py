@@ -0,0 +1,79 @@
+import collections
+import random
+import statistics
+import threading
+import time
+import unittest
+
+import rollup
+
+
+Value = collections.namedtuple('Value', ['a', 'b'])
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_stats(self):
+        xs = [random.gauss(10, 3) for _ in range(10000)]
+        s = rollup.Stats((0.5, 0.9))
+        for x in xs:
+            s.add(x)
+        summary = s.summary()
+        self.assertEqual(len(xs), summary.count)
+        self.assertEqual(min(xs), summary.min)
+        self.assertEqual(max(xs), summary.max)
+        self.assertAlmostEqual(statistics.fmean(xs), summary.mean)
+        self.assertAlmostEqual(statistics.pstdev(xs), summary.stddev)
+        xs.sort()
+        self.assertAlmostEqual(xs[5000], summary.quantiles[0.5], delta=0.2)
+        self.assertAlmostEqual(xs[9000], summary.quantiles[0.9], delta=0.3)
+
+    def test_few_values(self):
+        s = rollup.Stats((0.5,))
+        self.assertEqual(rollup.Summary(0, None, None, None, None, {0.5: None}), s.summary())
+        for x in (3, 1, 2):
+            s.add(x)
+        self.assertEqual(2, s.summary().quantiles[0.5])
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def test_windows(self):
+        agg = rollup.Aggregator({'k': ('a', 'b')}, periods=(60, 3600), quantiles=())
+        minutes = []
+        hours = []
+        agg.subscribe(minutes.append, period=60)
+        agg.subscribe(hours.append, key='k', period=3600)
+        for t in range(3540, 3720):
+            agg.add('k', t, Value(t % 60, 1))
+        self.assertEqual([3540, 3600], [w.start for w in minutes])
+        self.assertEqual(60, minutes[0].stats['a'].count)
+        self.assertEqual(29.5, minutes[0].stats['a'].mean)
+        self.assertEqual(59, minutes[0].stats['a'].max)
+        self.assertEqual(0, minutes[0].stats['b'].stddev)
+        self.assertEqual([0], [w.start for w in hours])
+        agg.tick(3720)
+        self.assertEqual([3540, 3600, 3660], [w.start for w in minutes])
+        self.assertEqual(1, len(hours))
+
+    def test_dotted_channels(self):
+        agg = rollup.Aggregator({'k': ('a.b',)}, periods=(60,))
+        windows = []
+        agg.subscribe(windows.append)
+        agg.add('k', 0, Value(Value(0, 5), 0))
+        agg.tick(60)
+        self.assertEqual(5, windows[0].stats['a.b'].mean)
+
+    def test_run_ticks(self):
+        agg = rollup.Aggregator({'k': ('a',)}, periods=(60,))
+        stop = threading.Event()
+        agg.subscribe(lambda w: stop.set())
+        agg.add('k', time.time() - 60, Value(1, 0))
+        t = threading.Thread(target=agg.run, args=(stop, 0.01))
+        t.start()
+        t.join(5)
+        self.assertTrue(stop.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""Latest readings in a shared memory page, for sensor loops running as
+separate processes.
+
+The page is a file (by default in /dev/shm) mapped by every process: a
+header, a directory of key names and one fixed-size slot per key. Each slot
+has a single writer and is guarded by a sequence counter (a seqlock): the
+writer makes it odd, writes the slot and makes it even again, and readers
+retry until they see the same even value before and after reading. Reads
+take no lock and parse nothing but a struct.
+
+Run as a script to print the current readings of a page.
+"""
+
+import math
+import mmap
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+
+import bme680
+import ccs811
+import pm25
+import readings
+
+PATH = '/dev/shm/air_quality'
+
+_MAGIC = b'AQSHM001'
+_HEADER = struct.Struct('<8sII')
+_KEY = struct.Struct('32s')
+_SEQ = struct.Struct('<Q')
+# when, error flag, values (NaN when unused) and error message.
+_BODY = struct.Struct('<d?7x16d64s')
+_SLOT_SIZE = _SEQ.size + _BODY.size
+NUM_VALUES = 16
+
+_NAN = float('nan')
+
+
+def encode(value):
+    """Returns the numbers of a published value."""
+    if isinstance(value, ccs811.Result):
+        return value.to_bytes()
+    if isinstance(value, bme680.Measurement):
+        return [_NAN if v is None else v for v in value]
+    return list(value)
+
+
+def decode(key, values):
+    """Turns the numbers of a slot back into the value published under key."""
+    values = [v for v in values if not math.isnan(v)]
+    name = key.partition('.')[0]
+    if name == 'pm25':
+        return pm25.Message._make(int(v) for v in values)
+    if name == 'tvoc':
+        return ccs811.Result([int(v) for v in values])
+    if name == 'bme680':
+        return bme680.Measurement(*(values + [None] * (4 - len(values))))
+    return tuple(values)
+
+
+class Page(object):
+
+    def __init__(self, path, mm):
+        self.path = path
+        self._mm = mm
+        magic, n, slot_size = _HEADER.unpack_from(mm)
+        if magic != _MAGIC or slot_size != _SLOT_SIZE:
+            raise ValueError('%s is not a readings page' % path)
+        self.keys = [_KEY.unpack_from(mm, _HEADER.size + i * _KEY.size)[0].rstrip(b'\0').decode()
+                     for i in range(n)]
+        base = _HEADER.size + n * _KEY.size
+        self._offsets = {k: base + i * _SLOT_SIZE for i, k in enumerate(self.keys)}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, keys, path=PATH):
+        """Creates (or replaces) the page with a slot per key."""
+        size = _HEADER.size + len(keys) * (_KEY.size + _SLOT_SIZE)
+        buf = bytearray(size)
+        _HEADER.pack_into(buf, 0, _MAGIC, len(keys), _SLOT_SIZE)
+        for i, k in enumerate(keys):
+            _KEY.pack_into(buf, _HEADER.size + i * _KEY.size, k.encode())
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp, path)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path=PATH):
+        with open(path, 'r+b') as f:
+            return cls(path, mmap.mmap(f.fileno(), 0))
+
+    def close(self):
+        self._mm.close()
+
+    def seq(self, key):
+        """Changes whenever key is written; even unless a write is under
+        way."""
+        return _SEQ.unpack_from(self._mm, self._offsets[key])[0]
+
+    def write(self, key, value, when=None):
+        """Writes value (or an Exception) to the slot of key. Only one
+        process may write a slot."""
+        off = self._offsets[key]
+        if isinstance(value, Exception):
+            body = (when or time.time(), True) + (_NAN,) * NUM_VALUES + \
+                (str(value).encode()[:64],)
+        else:
+            values = encode(value)[:NUM_VALUES]
+            body = (when or time.time(), False) + tuple(values) + \
+                (_NAN,) * (NUM_VALUES - len(values)) + (b'',)
+        with self._lock:
+            seq = _SEQ.unpack_from(self._mm, off)[0]
+            # Odd if the previous writer died in the middle of a write.
+            seq += seq & 1
+            _SEQ.pack_into(self._mm, off, seq + 1)
+            _BODY.pack_into(self._mm, off + _SEQ.size, *body)
+            _SEQ.pack_into(self._mm, off, seq + 2)
+
+    def unlock(self, key):
+        """Makes the sequence number of key even again after its writer died
+        in the middle of a write. Only call it while nothing writes key."""
+        off = self._offsets[key]
+        with self._lock:
+            seq = _SEQ.unpack_from(self._mm, off)[0]
+            if seq & 1:
+                _SEQ.pack_into(self._mm, off, seq + 1)
+
+    def read(self, key, timeout=0.1):
+        """Returns the readings.Reading of key, its version being the
+        sequence number, or None if it was never written or a write does
+        not finish within timeout seconds (its writer died)."""
+        off = self._offsets[key]
+        deadline = None
+        while True:
+            seq = _SEQ.unpack_from(self._mm, off)[0]
+            if not seq & 1:
+                body = _BODY.unpack_from(self._mm, off + _SEQ.size)
+                if _SEQ.unpack_from(self._mm, off)[0] == seq:
+                    break
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                return None
+            time.sleep(0)
+        if not seq:
+            return None
+        when, error, values, message = body[0], body[1], body[2:-1], body[-1]
+        if error:
+            value = RuntimeError(message.rstrip(b'\0').decode(errors='replace'))
+        else:
+            value = decode(key, values)
+        return readings.Reading(value, seq, when)
+
+    def on_publish(self, registry):
+        """Returns a registry listener that writes the readings of the keys
+        of the page."""
+
+        def listener(key):
+            if key in self._offsets:
+                r = registry.get(key)
+                self.write(key, r.value, r.when)
+
+        return listener
+
+    def mirror(self, registry, stop, interval=0.1):
+        """Republishes every new reading of the page into registry until
+        stop is set."""
+        seen = {}
+        while not stop.wait(interval):
+            for key in self.keys:
+                seq = self.seq(key)
+                if seq != seen.get(key, 0) and not seq & 1:
+                    r = self.read(key)
+                    if r is None:
+                        continue
+                    seen[key] = r.version
+                    registry.publish(key, r.value, r.when)
+
+
+def _worker(path, target):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    page = Page.open(path)
+    registry = readings.Registry()
+    registry.add_listener(page.on_publish(registry))
+    target(stop, registry)
+
+
+class Supervisor(object):
+    """Runs target(stop, registry) functions in processes of their own,
+    their readings going to the page at path, and restarts the ones that
+    exit, waiting min_backoff seconds at first and up to max_backoff if
+    they keep failing. The slots of the keys a worker writes are unlocked
+    (see Page.unlock) before it restarts.
+
+    Processes are forked, so targets may be closures; they should open
+    their devices themselves. A process forked while other threads run
+    only gets the forking thread, and locks the others held (stdout,
+    registries, metrics) stay locked in it; so start() forks the
+    supervisor before the caller starts any thread, and workers are only
+    ever forked from that single-threaded process.
+    """
+
+    def __init__(self, path=PATH, min_backoff=1, max_backoff=60):
+        self.path = path
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.workers = {}
+        self.restarts = {}
+        self.keys = {}
+        self._ctx = multiprocessing.get_context('fork')
+        self._process = None
+
+    def add(self, name, target, keys=()):
+        """Adds a worker, which writes the slots of keys."""
+        self.workers[name] = target
+        self.restarts[name] = 0
+        self.keys[name] = list(keys)
+
+    def _start(self, name):
+        p = self._ctx.Process(target=_worker, args=(self.path, self.workers[name]),
+                              name=name, daemon=True)
+        p.start()
+        return p
+
+    def start(self, poll_interval=0.5):
+        """Runs the workers from a process of its own until stop(). Call
+        it before starting any thread."""
+        self._process = self._ctx.Process(target=self._serve, args=(poll_interval,),
+                                          name='supervisor')
+        self._process.start()
+
+    def stop(self, timeout=30):
+        """Stops the process of start(), which stops the workers."""
+        self._process.terminate()
+        self._process.join(timeout)
+
+    def _serve(self, poll_interval):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.run(stop, poll_interval)
+
+    def run(self, stop, poll_interval=0.5):
+        """Runs the workers from this process until stop is set; see
+        start()."""
+        page = Page.open(self.path)
+        # name -> (process, start time, backoff)
+        procs = {name: (self._start(name), time.monotonic(), self.min_backoff)
+                 for name in self.workers}
+        while not stop.wait(poll_interval):
+            now = time.monotonic()
+            for name, (p, started, backoff) in list(procs.items()):
+                if p is None:
+                    if now >= started:
+                        procs[name] = self._start(name), now, backoff
+                    continue
+                if p.is_alive():
+                    continue
+                print('%s exited with %s' % (name, p.exitcode))
+                self.restarts[name] += 1
+                for key in self.keys[name]:
+                    page.unlock(key)
+                if now - started > self.max_backoff:
+                    backoff = self.min_backoff
+                # Restart at now + backoff.
+                procs[name] = None, now + backoff, min(2 * backoff, self.max_backoff)
+        for p, _, _ in procs.values():
+            if p is not None and p.is_alive():
+                p.terminate()
+        for name, (p, _, _) in procs.items():
+            if p is not None:
+                p.join(5)
+                if p.is_alive():
+                    print('killing', name)
+                    p.kill()
+                    p.join()
+        page.close()
+
+
+def main():
+    page = Page.open(sys.argv[1] if len(sys.argv) > 1 else PATH)
+    for key in page.keys:
+        r = page.read(key)
+        if r is not None:
+            print(key, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r.when)), r.value)
+
+
+if __name__ == '__main__':
+    main()
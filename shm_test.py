@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import bme680
+import ccs811
+import pm25
+import readings
+import shm
+
+KEYS = ['pm25', 'pm25.1', 'tvoc.0x5a', 'bme680.0x77', 'other']
+
+
+class PageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.page = shm.Page.create(KEYS, os.path.join(self.dir, 'page'))
+
+    def tearDown(self):
+        self.page.close()
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        values = {
+            'pm25': pm25.Message._make(range(13)),
+            'tvoc.0x5a': ccs811.Result([1, 144, 0, 20, 0x98, 0, 0x2c, 0x10]),
+            'bme680.0x77': bme680.Measurement(21.5, 1001.25, 40.125, None),
+            'other': (1.5, 2.0),
+        }
+        for key, value in values.items():
+            self.page.write(key, value, when=1000)
+        other = shm.Page.open(self.page.path)
+        self.assertEqual(other.keys, KEYS)
+        for key, value in values.items():
+            r = other.read(key)
+            self.assertEqual(r.value, value)
+            self.assertEqual(r.when, 1000)
+        self.assertIsNone(other.read('pm25.1'))
+        other.close()
+
+    def test_error(self):
+        self.page.write('pm25', IOError('no data'))
+        value = self.page.read('pm25').value
+        self.assertIsInstance(value, RuntimeError)
+        self.assertEqual(str(value), 'no data')
+
+    def test_seq(self):
+        self.assertEqual(self.page.seq('pm25'), 0)
+        self.page.write('pm25', pm25.Message._make(range(13)))
+        self.page.write('pm25', pm25.Message._make(range(13)))
+        self.assertEqual(self.page.seq('pm25'), 4)
+        self.assertEqual(self.page.read('pm25').version, 4)
+
+    def test_dead_writer(self):
+        self.page.write('pm25', pm25.Message._make(range(13)))
+        # A writer killed in the middle of a write.
+        shm._SEQ.pack_into(self.page._mm, self.page._offsets['pm25'], 3)
+        self.assertIsNone(self.page.read('pm25', timeout=0.01))
+        self.page.unlock('pm25')
+        self.assertEqual(self.page.read('pm25').version, 4)
+        shm._SEQ.pack_into(self.page._mm, self.page._offsets['pm25'], 5)
+        self.page.write('pm25', pm25.Message._make(range(1, 14)))
+        self.assertEqual(self.page.read('pm25').version, 8)
+
+    def test_not_a_page(self):
+        path = os.path.join(self.dir, 'junk')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 100)
+        with self.assertRaises(ValueError):
+            shm.Page.open(path)
+
+    def test_no_torn_reads(self):
+        def write(path, n):
+            page = shm.Page.open(path)
+            for i in range(n):
+                page.write('other', (float(i),) * shm.NUM_VALUES)
+
+        p = multiprocessing.get_context('fork').Process(target=write, args=(self.page.path, 20000))
+        p.start()
+        while p.is_alive():
+            r = self.page.read('other')
+            if r is not None:
+                self.assertEqual(len(set(r.value)), 1)
+        p.join()
+        self.assertEqual(self.page.read('other').value, (19999.0,) * shm.NUM_VALUES)
+
+    def test_publish_and_mirror(self):
+        source = readings.Registry()
+        source.add_listener(self.page.on_publish(source))
+        source.publish('pm25', pm25.Message._make(range(13)), when=1000)
+        source.publish('not in page', 1)
+
+        registry = readings.Registry()
+        stop = threading.Event()
+        t = threading.Thread(target=self.page.mirror, args=(registry, stop, 0.01))
+        t.start()
+        try:
+            version = registry.wait(0, ['pm25'], timeout=5)
+            r = registry.get('pm25')
+            self.assertEqual(r.value, pm25.Message._make(range(13)))
+            self.assertEqual(r.when, 1000)
+            source.publish('pm25', pm25.Message._make(range(1, 14)))
+            registry.wait(version, ['pm25'], timeout=5)
+            self.assertEqual(registry.get('pm25').value, pm25.Message._make(range(1, 14)))
+        finally:
+            stop.set()
+            t.join()
+        self.assertIsNone(registry.get('pm25.1'))
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.page = shm.Page.create(['crash', 'run'], os.path.join(self.dir, 'page'))
+
+    def tearDown(self):
+        self.page.close()
+        shutil.rmtree(self.dir)
+
+    def test_restart(self):
+        path = self.page.path
+
+        def crash(stop, registry):
+            # Counts its runs.
+            r = shm.Page.open(path).read('crash')
+            registry.publish('crash', ((r.value[0] if r else 0) + 1,))
+            # Dies as if in the middle of the next write.
+            page = shm.Page.open(path)
+            shm._SEQ.pack_into(page._mm, page._offsets['crash'], page.seq('crash') + 1)
+            raise SystemExit(1)
+
+        def run(stop, registry):
+            while not stop.wait(0.01):
+                registry.publish('run', (float(threading.active_count()),))
+
+        supervisor = shm.Supervisor(path, min_backoff=0.05, max_backoff=0.2)
+        supervisor.add('crash', crash, ['crash'])
+        supervisor.add('run', run)
+        supervisor.start(0.01)
+        # Threads started now are not forked into the workers.
+        t = threading.Thread(target=time.sleep, args=(1,))
+        t.start()
+        t.join()
+        supervisor.stop()
+        self.assertEqual(supervisor._process.exitcode, 0)
+        # The last run may have died after the last check.
+        self.page.unlock('crash')
+        self.assertGreaterEqual(self.page.read('crash').value[0], 4)
+        self.assertEqual(self.page.read('run').value, (1.0,))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import json
+import os
+import requests  # pip install requests
+import threading
+import time
+
+import metrics
+
+
+def retryable(e):
+    """Whether a post that failed with e may succeed later."""
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is None or status >= 500 or status == 429
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+class Spooler(object):
+    """Uploads records from a background thread through a bounded on-disk
+    spool.
+
+    put() appends a record to the newest spool file and returns at once.
+    run() posts records oldest first with one pooled session, backing off
+    exponentially while posts fail, so records queued during an outage are
+    backfilled once the network is back. Only connection errors, timeouts
+    and 5xx (or 429) responses are retried; a record that can never be
+    posted, e.g. rejected with a 4xx or for a form without a poster, is
+    moved to the rejected file instead. Files are deleted once all their
+    records are posted; when there are more than max_files, the oldest ones
+    are dropped. Records are sent at least once: after a crash the posted
+    records of the oldest file are sent again.
+    """
+
+    def __init__(self, path, posters, records_per_file=100, max_files=100,
+                 min_backoff=1, max_backoff=600):
+        self.path = path
+        self.posters = posters
+        self.records_per_file = records_per_file
+        self.max_files = max_files
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.posted = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        os.makedirs(path, exist_ok=True)
+        files = self._files()
+        self._next_file = int(files[-1].split('.')[0]) + 1 if files else 0
+        self._records_in_file = self.records_per_file
+        # (file name, number of its records already posted)
+        self._done = None
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.upload_seconds = metrics.default.histogram(
+            'upload_seconds', 'Time to post a spooled record, failed posts included.')
+        for name, help in (('posted', 'Spooled records posted.'),
+                           ('failed', 'Failed posts of spooled records.'),
+                           ('dropped', 'Spooled records dropped because the spool was full.'),
+                           ('rejected', 'Spooled records that can never be posted.')):
+            metrics.default.counter_func('upload_%s_total' % name, help,
+                                         lambda name=name: getattr(self, name))
+        metrics.default.gauge_func('upload_spool_files', 'Files in the upload spool.',
+                                   lambda: len(self._files()))
+
+    def _files(self):
+        return sorted((f for f in os.listdir(self.path) if f.endswith('.spool')),
+                      key=lambda f: int(f.split('.')[0]))
+
+    def put(self, form, when, data):
+        """Queues data for posting with posters[form]; when is seconds since
+        the epoch."""
+        line = json.dumps({'form': form, 'when': when, 'data': list(data)}) + '\n'
+        with self._lock:
+            if self._records_in_file >= self.records_per_file:
+                self._next_file += 1
+                self._records_in_file = 0
+            with open(os.path.join(self.path, '%d.spool' % self._next_file), 'a') as f:
+                f.write(line)
+            self._records_in_file += 1
+            files = self._files()
+            for name in files[:max(0, len(files) - self.max_files)]:
+                with open(os.path.join(self.path, name)) as f:
+                    self.dropped += sum(1 for _ in f)
+                os.remove(os.path.join(self.path, name))
+        self._wakeup.set()
+
+    def _oldest(self):
+        """Returns (name, lines, complete) of the oldest spool file, or None.
+        complete is False for the file put() is still appending to."""
+        with self._lock:
+            files = self._files()
+            if not files:
+                return None
+            name = files[0]
+            with open(os.path.join(self.path, name)) as f:
+                lines = f.readlines()
+            complete = name != '%d.spool' % self._next_file or \
+                self._records_in_file >= self.records_per_file
+            return name, lines, complete
+
+    def send(self, record):
+        poster = self.posters[record['form']]
+        start = time.monotonic()
+        try:
+            r = poster.post(time.gmtime(record['when']), record['data'], session=self.session)
+            r.raise_for_status()
+        finally:
+            self.upload_seconds.observe(time.monotonic() - start)
+
+    def reject(self, record, error):
+        """Appends record and why it can't be posted to the rejected file."""
+        print('upload rejected:', error)
+        self.rejected += 1
+        with open(os.path.join(self.path, 'rejected'), 'a') as f:
+            f.write(json.dumps(dict(record, error=repr(error))) + '\n')
+
+    def upload(self, stop=None):
+        """Posts spooled records until the spool is empty. Returns False on
+        the first failure."""
+        while stop is None or not stop.is_set():
+            oldest = self._oldest()
+            if oldest is None:
+                return True
+            name, lines, complete = oldest
+            start = self._done[1] if self._done and self._done[0] == name else 0
+            for i in range(start, len(lines)):
+                if stop is not None and stop.is_set():
+                    return True
+                try:
+                    record = json.loads(lines[i])
+                except ValueError:
+                    # Partial line from a crash.
+                    self._done = name, i + 1
+                    continue
+                try:
+                    self.send(record)
+                    self.posted += 1
+                except Exception as e:
+                    if retryable(e):
+                        print('upload failed:', e)
+                        self.failed += 1
+                        return False
+                    self.reject(record, e)
+                self._done = name, i + 1
+            if not complete:
+                return True
+            with self._lock:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+            self._done = None
+        return True
+
+    def run(self, stop):
+        backoff = self.min_backoff
+        while not stop.is_set():
+            self._wakeup.clear()
+            if self.upload(stop):
+                backoff = self.min_backoff
+                # Until the next put(), checking stop every second.
+                while not self._wakeup.wait(1) and not stop.is_set():
+                    pass
+            else:
+                stop.wait(backoff)
+                backoff = min(2 * backoff, self.max_backoff)
+        self.session.close()
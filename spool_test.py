@@ -0,0 +1,128 @@
+import http.server
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+import spool
+import util
+
+
+class FormHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        server.connections.add(self.client_address)
+        if server.failures > 0:
+            server.failures -= 1
+            self.send_response(server.failure_status)
+        else:
+            server.posts.append((self.path, urllib.parse.parse_qs(body)))
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FormServer(http.server.ThreadingHTTPServer):
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FormHandler)
+        FormHandler.protocol_version = 'HTTP/1.1'
+        self.posts = []
+        self.failures = 0
+        self.failure_status = 500
+        self.connections = set()
+
+
+class SpoolerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FormServer()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        url = 'http://127.0.0.1:%d/forms/d/e/x/viewform?entry.1=0&entry.2=1' % self.server.server_port
+        self.spooler = spool.Spooler(self.tmp.name, {'f': util.GoogleFormPoster(url)},
+                                     records_per_file=2, min_backoff=0.01, max_backoff=0.05)
+
+    def tearDown(self):
+        self.spooler.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        self.tmp.cleanup()
+
+    def posted(self):
+        return [int(params['entry.1'][0]) for _, params in self.server.posts]
+
+    def test_upload(self):
+        for i in range(5):
+            self.spooler.put('f', 0, [i, 10 * i])
+        self.assertTrue(self.spooler.upload())
+        self.assertEqual([0, 1, 2, 3, 4], self.posted())
+        self.assertEqual('/forms/d/e/x/formResponse', self.server.posts[0][0])
+        self.assertEqual(['40'], self.server.posts[-1][1]['entry.2'])
+        # Connection reused by the session.
+        self.assertEqual(1, len(self.server.connections))
+        # Only the file still being appended to is left.
+        self.assertEqual(1, len(os.listdir(self.tmp.name)))
+        self.spooler.put('f', 0, [5, 50])
+        self.assertTrue(self.spooler.upload())
+        self.assertEqual([0, 1, 2, 3, 4, 5], self.posted())
+
+    def test_retry(self):
+        self.server.failures = 3
+        for i in range(3):
+            self.spooler.put('f', 0, [i, 0])
+        self.assertFalse(self.spooler.upload())
+        stop = threading.Event()
+        t = threading.Thread(target=self.spooler.run, args=(stop,))
+        t.start()
+        for _ in range(500):
+            if len(self.server.posts) == 3:
+                break
+            stop.wait(0.01)
+        stop.set()
+        t.join()
+        self.assertEqual([0, 1, 2], self.posted())
+        self.assertEqual(3, self.spooler.failed)
+
+    def test_rejected(self):
+        self.server.failures = 1
+        self.server.failure_status = 400
+        self.spooler.put('f', 0, [0, 0])
+        self.spooler.put('no such form', 0, [1, 0])
+        self.spooler.put('f', 0, [2, 0])
+        self.assertTrue(self.spooler.upload())
+        self.assertEqual([2], self.posted())
+        self.assertEqual((2, 0), (self.spooler.rejected, self.spooler.failed))
+        with open(os.path.join(self.tmp.name, 'rejected')) as f:
+            self.assertEqual(['f', 'no such form'], [json.loads(_)['form'] for _ in f])
+
+    def test_bounded(self):
+        self.spooler.max_files = 2
+        for i in range(7):
+            self.spooler.put('f', 0, [i, 0])
+        self.assertEqual(4, self.spooler.dropped)
+        self.spooler.upload()
+        self.assertEqual([4, 5, 6], self.posted())
+
+    def test_persistent(self):
+        for i in range(3):
+            self.spooler.put('f', 0, [i, 0])
+        url = 'http://127.0.0.1:%d/forms/d/e/x/viewform?entry.1=0&entry.2=1' % self.server.server_port
+        restarted = spool.Spooler(self.tmp.name, {'f': util.GoogleFormPoster(url)})
+        restarted.put('f', 0, [3, 0])
+        restarted.upload()
+        restarted.session.close()
+        self.assertEqual([0, 1, 2, 3], self.posted())
+
+
+if __name__ == '__main__':
+    unittest.main()
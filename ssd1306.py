@@ -1,26 +1,218 @@
+import contextlib
 import datetime
-import os
-import re
-import smbus2
-import subprocess
+import errno
+import functools
+import smbus2  # pip install smbus2
 import time
 
 import font5x8
+import i2cbus
+import metrics
+import netinfo
+import readings
 import util
 
+class FrameBuffer(object):
+    """In-memory copy of the 128x64 display RAM.
+
+    Drawing only touches memory; SSD1306Device.flush() sends the parts of
+    each page that differ from what was sent last.
+    """
+
+    COLS = 128
+    PAGES = 8
+
+    def __init__(self):
+        self.buf = bytearray(self.COLS * self.PAGES)
+        # What the display RAM holds, as far as we know.
+        self.sent = bytearray(self.COLS * self.PAGES)
+
+    def write(self, data, page=0, col=0):
+        """Writes data the way the display does in horizontal addressing
+        mode with columns col..127 and pages page..7, wrapping to the next
+        page (and from the last page back to the first one)."""
+        width = self.COLS - col
+        pages = self.PAGES - page
+        p = 0
+        for i in range(0, len(data), width):
+            chunk = data[i:i + width]
+            offset = (page + p) * self.COLS + col
+            self.buf[offset:offset + len(chunk)] = bytes(chunk)
+            p = (p + 1) % pages
+
+    def fill(self, b=0):
+        self.buf[:] = bytes([b]) * len(self.buf)
+
+    def invalidate(self, pages=None):
+        """Forgets what the display holds (in pages, all by default) so
+        that the next flush sends it."""
+        for page in range(self.PAGES) if pages is None else pages:
+            for i in range(page * self.COLS, (page + 1) * self.COLS):
+                self.sent[i] = ~self.buf[i] & 0xff
+
+    def mark_sent(self):
+        self.sent[:] = self.buf
+
+    def dirty(self, buf=None):
+        """Yields (page, first_col, last_col) of every page that changed, in
+        buf (a copy of the frame buffer) if given."""
+        buf = self.buf if buf is None else buf
+        cols = self.COLS
+        for page in range(self.PAGES):
+            new = buf[page * cols:(page + 1) * cols]
+            old = self.sent[page * cols:(page + 1) * cols]
+            if new == old:
+                continue
+            diff = int.from_bytes(new, 'big') ^ int.from_bytes(old, 'big')
+            first = cols - 1 - (diff.bit_length() - 1) // 8
+            last = cols - 1 - ((diff & -diff).bit_length() - 1) // 8
+            yield page, first, last
+
+
+# Largest SMBus block.
+SMBUS_BLOCK = 32
+# Most messages the kernel takes in one I2C_RDWR ioctl.
+MAX_MSGS = 42
+# errnos of adapters that can't do (such large) plain I2C transfers.
+_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL)
+# What one more transfer costs, in bytes sent: flush() sends one
+# rectangle around all changes when that is cheaper than one per page.
+TRANSFER_COST = 16
+
+
+class I2CTransport(object):
+    """Sends commands and data to the SSD1306 at addr on bus. With
+    max_transfer above SMBUS_BLOCK and a bus that has i2c_rdwr (smbus2),
+    they go out in plain I2C messages of up to max_transfer bytes, many per
+    call; otherwise, or once the adapter refuses them, in SMBus blocks."""
+
+    def __init__(self, bus, addr=0x3c, max_transfer=1025):
+        self.bus = bus
+        self.addr = addr
+        self.name = hex(addr)
+        self.max_transfer = max_transfer
+        self._rdwr = (max_transfer > SMBUS_BLOCK and
+                      callable(getattr(bus, 'i2c_rdwr', None)))
+
+    def write(self, transfers):
+        """Sends (control byte, bytes) pairs in order, as few calls as
+        possible. The control byte is 0 for commands and 0x40 for data."""
+        if self._rdwr:
+            msgs = []
+            step = self.max_transfer - 1
+            for control, bs in transfers:
+                for i in range(0, len(bs), step):
+                    msgs.append(smbus2.i2c_msg.write(
+                        self.addr, bytes((control,)) + bytes(bs[i:i + step])))
+            try:
+                for i in range(0, len(msgs), MAX_MSGS):
+                    self.bus.i2c_rdwr(*msgs[i:i + MAX_MSGS])
+                return
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                print('no large I2C transfers, using SMBus blocks:', e)
+                self._rdwr = False
+        for control, bs in transfers:
+            for i in range(0, len(bs), SMBUS_BLOCK):
+                self.bus.write_i2c_block_data(self.addr, control, bs[i:i + SMBUS_BLOCK])
+
+    def status(self):
+        return self.bus.read_byte(self.addr)
+
+    def run(self, f, coalesce=None, wait=True):
+        """Calls f(), as one i2cbus transaction if the bus is a BusManager
+        client (queued ones with the same coalesce key get merged); without
+        wait, returns its Future then instead of waiting for it."""
+        transaction = getattr(self.bus, 'transaction', None)
+        if transaction is None:
+            return f()
+        return transaction(lambda _: f(), coalesce=coalesce, wait=wait)
+
+
+class SPITransport(object):
+    """Sends commands and data over 4-wire SPI: spi is a spidev.SpiDev (or
+    fakes.FakeSpiDev) and dc the util.OutputChannel of the D/C pin, low for
+    commands and high for data. Each run of bytes goes out in writebytes
+    calls of up to max_transfer bytes, the spidev buffer size, so a whole
+    frame takes one call. The panel can't be read over SPI."""
+
+    def __init__(self, spi, dc, max_transfer=4096, name='spi'):
+        self.spi = spi
+        self.dc = dc
+        self.max_transfer = max_transfer
+        self.name = name
+        self._data = None
+
+    def write(self, transfers):
+        for control, bs in transfers:
+            data = control == 0x40
+            if data != self._data:
+                self.dc.put(int(data))
+                self._data = data
+            for i in range(0, len(bs), self.max_transfer):
+                self.spi.writebytes(list(bs[i:i + self.max_transfer]))
+
+    def status(self):
+        raise OSError(errno.EOPNOTSUPP, 'no status over SPI')
+
+    def run(self, f, coalesce=None, wait=True):
+        return f()
+
+
+@contextlib.contextmanager
+def open_spi(dc_pin, reset_pin=None, bus=0, device=0, speed_hz=8000000, GPIO=None,
+             SpiDev=None):
+    """Yields an SPITransport for the display on /dev/spidev<bus>.<device>
+    with D/C (and, if wired, RES) on board pins dc_pin and reset_pin,
+    resetting it first. GPIO and SpiDev default to RPi.GPIO and
+    spidev.SpiDev; tests pass fakes."""
+    if SpiDev is None:
+        import spidev  # pip install spidev
+        SpiDev = spidev.SpiDev
+    outputs = [(dc_pin, 0)] + ([(reset_pin, 1)] if reset_pin is not None else [])
+    with util.gpio(outputs=outputs, GPIO=GPIO) as (_, outputs):
+        if reset_pin is not None:
+            outputs[1].put(0)
+            time.sleep(0.001)
+            outputs[1].put(1)
+        spi = SpiDev()
+        spi.open(bus, device)
+        try:
+            spi.max_speed_hz = speed_hz
+            spi.mode = 0
+            yield SPITransport(spi, outputs[0], name='spi%d.%d' % (bus, device))
+        finally:
+            spi.close()
+
+
 class SSD1306Device(object):
 
-    def __init__(self, bus, addr):
+    def __init__(self, bus=None, addr=0x3c, max_transfer=1025, transport=None):
+        """Talks I2C to addr on bus (see I2CTransport) unless given another
+        transport."""
         self.bus = bus
         self.addr = addr
+        self.transport = transport or I2CTransport(bus, addr, max_transfer)
+        self.name = 'ssd1306.' + self.transport.name
+        self.fb = FrameBuffer()
+        # First pages of the halves of the RAM that text goes to, see
+        # drawing_half().
+        self._halves = (0, 4)
+        # (start_page, end_page) while the display scrolls them.
+        self.scrolling = None
+        # Future of the last queued flush, see flush().
+        self._pending = None
+        self.flush_seconds = metrics.default.histogram(
+            'ssd1306_flush_seconds', 'Time to send the changed parts of the frame buffer.',
+            device=self.transport.name)
 
     def command(self, *bs):
         # print('command', ' '.join(map(hex, bs)))
-        self.bus.write_i2c_block_data(self.addr, 0, bs)
+        self.transport.write([(0, bs)])
 
     def data(self, *bs):
-        for i in range(0, len(bs), 32):
-            self.bus.write_i2c_block_data(self.addr, 0x40, bs[i:i+32])
+        self.transport.write([(0x40, bs)])
 
     # 4. Hardware configuration
 
@@ -99,14 +291,128 @@ class SSD1306Device(object):
         assert 0 <= low and low <= high and high <= 7
         self.command(0x22, low, high)
 
+    # 2. Scrolling
+
+    # Frames between scroll steps -> interval code of the scroll setup.
+    SCROLL_FRAMES = {5: 0, 64: 1, 128: 2, 256: 3, 3: 4, 4: 5, 25: 6, 2: 7}
+
+    def scroll(self, start_page, end_page, left=False, frames=5):
+        """Makes the display rotate pages start_page..end_page of its RAM
+        one column every frames frames by itself. The RAM must not be
+        written while the display scrolls, so flush() sends nothing until
+        stop_scroll()."""
+        assert 0 <= start_page <= end_page <= 7
+        # Deactivate, set up and activate in one transaction.
+        self.command(0x2e, 0x26 + left, 0, start_page, self.SCROLL_FRAMES[frames], end_page,
+                     0, 0xff, 0x2f)
+        self.scrolling = start_page, end_page
+
+    def stop_scroll(self):
+        """Stops scrolling. The scrolled pages no longer hold what the frame
+        buffer has, so the next flush sends them again."""
+        self.command(0x2e)
+        if self.scrolling is not None:
+            self.fb.invalidate(range(self.scrolling[0], self.scrolling[1] + 1))
+            self.scrolling = None
+
+    def ticker(self, s, row, left=False, frames=5):
+        """Shows s (up to 21 characters) on text row row of the half being
+        drawn and scrolls it in hardware, which costs no bus traffic per
+        step. Other changes are only sent after stop_scroll() or the next
+        ticker(). Only works on one half at a time, see drawing_half()."""
+        assert len(self._halves) == 1, 'ticker() needs drawing_half()'
+        if self.scrolling is not None:
+            self.stop_scroll()
+        self.puts(s, row=row)
+        self.flush()
+        page = self._halves[0] + row
+        self.scroll(page, page, left, frames)
+
+    # Two screens in the RAM
+
+    def use_halves(self, on=True):
+        """With on, the display shows 32 rows, pages 0-3 or 4-7 of its RAM
+        as picked by show_half(), so that it can hold two screens.
+        Otherwise it shows all 64 rows."""
+        self.set_mux_ratio(0x1f if on else 0x3f)
+        self.show_half(0)
+
+    def show_half(self, half):
+        """Switches to the screen in half 0 or 1 of the RAM with a single
+        command, through the display start line."""
+        assert half in (0, 1)
+        self.set_display_line_start(32 * half)
+
+    @contextlib.contextmanager
+    def drawing_half(self, half):
+        """Makes puts() and friends draw into half 0 or 1 of the frame
+        buffer only, instead of into both, within the block."""
+        halves = self._halves
+        self._halves = (4 * half,)
+        try:
+            yield
+        finally:
+            self._halves = halves
+
     def set_all(self, b=0):
         self.set_addressing_mode()
         self.set_column_address()
         self.set_page_address()
         self.data(*([b] * 128 * 8))
+        self.fb.fill(b)
+        self.fb.mark_sent()
+
+    def flush(self):
+        """Sends the changed parts of the frame buffer, unless the display
+        scrolls (see scroll()). Assumes horizontal addressing mode, which
+        set_all() and initialize() leave behind.
+
+        On a BusManager client the flush is only queued, and replaces one
+        still queued, which the newer one covers; its Future is returned.
+        The error of an earlier failed flush is raised here. Commands wait
+        for the flushes queued before them.
+        """
+        if self.scrolling is not None:
+            return None
+        pending, self._pending = self._pending, None
+        if pending is not None and pending.done():
+            pending.result()
+        self._pending = self.transport.run(self._flush, coalesce='flush', wait=False)
+        return self._pending
+
+    def _flush(self):
+        start = time.monotonic()
+        fb = self.fb
+        # Drawing goes on while a queued flush runs: send and record one
+        # snapshot of the frame buffer.
+        buf = bytes(fb.buf)
+        dirty = list(fb.dirty(buf))
+        if dirty:
+            # (first page, last page, first column, last column)
+            rects = [(page, page, first, last) for page, first, last in dirty]
+            box = (dirty[0][0], dirty[-1][0], min(d[1] for d in dirty), max(d[2] for d in dirty))
+            box_cost = (box[1] - box[0] + 1) * (box[3] - box[2] + 1) + TRANSFER_COST
+            if len(rects) > 1 and box_cost < sum(last - first + 1 + TRANSFER_COST
+                                                 for _, first, last in dirty):
+                rects = [box]
+            transfers = []
+            for first_page, last_page, first, last in rects:
+                # Page and column addresses, then the bytes of the rectangle.
+                transfers += [
+                    (0, (0x22, first_page, last_page, 0x21, first, last)),
+                    (0x40, b''.join(buf[p * fb.COLS + first:p * fb.COLS + last + 1]
+                                    for p in range(first_page, last_page + 1)))]
+            self.transport.write(transfers)
+            for first_page, last_page, first, last in rects:
+                for p in range(first_page, last_page + 1):
+                    fb.sent[p * fb.COLS + first:p * fb.COLS + last + 1] = \
+                        buf[p * fb.COLS + first:p * fb.COLS + last + 1]
+        self.flush_seconds.observe(time.monotonic() - start)
 
     def initialize(self):
         self.off()
+        # A scroll survives a restart of this program.
+        self.stop_scroll()
         self.set_mux_ratio()
         self.set_display_offset()
         self.set_display_line_start()
@@ -126,6 +432,48 @@ class SSD1306Device(object):
         time.sleep(0.1)
         self.set_all(0)
 
+    def is_on(self):
+        """Reads the status byte, whose bit 6 is set while the display is
+        off."""
+        return not self.transport.status() & 0x40
+
+    def resume(self):
+        """Takes over a display that initialize() set up earlier and that
+        was left on. Returns False if it is off, e.g. because it was power
+        cycled."""
+        if not self.is_on():
+            return False
+        # Stop any scroll and set the addressing mode, in one transaction.
+        self.command(0x2e, 0x20, 0)
+        # Its RAM holds whatever was drawn last.
+        self.fb.invalidate()
+        return True
+
+    def bring_up(self, checkpoint=None):
+        """Initializes the display, unless checkpoint (a
+        checkpoint.Checkpoint) shows it was initialized earlier in this boot
+        and left on, and it can be resumed. Returns True for a warm start.
+
+        A display shut_down() turned off is initialized again: it looks the
+        same as one that was power cycled since."""
+        state = checkpoint and checkpoint.load(self.name)
+        warm = False
+        if state and state['on']:
+            try:
+                warm = self.resume()
+            except OSError as e:
+                print('no status byte, initializing:', e)
+        if not warm:
+            self.initialize()
+        if checkpoint is not None:
+            checkpoint.save(self.name, on=True)
+        return warm
+
+    def shut_down(self, checkpoint=None):
+        self.off()
+        if checkpoint is not None:
+            checkpoint.save(self.name, on=False)
+
 
     def draw1(self, col_start=0x10, col_end=0x1f, page_start=2, page_end=5):
         self.set_column_address(col_start, col_end)
@@ -140,170 +488,186 @@ class SSD1306Device(object):
                     time.sleep(0.1)
 
     def draw2(self):
-        self.puts('This is a very long string with lots of letters. ~~~>_<~~~ @_@')
-        n = 0
-        while True:
-            self.puts(hex(n), row=1, col=2, wrap=True)
-            n += 1
-
-    def puts(self, s, row=0, col=0, clear=True, wrap=False):
+        self.use_halves()
+        with self.drawing_half(0):
+            n = 0
+            while True:
+                # The display scrolls the first line by itself, but its RAM
+                # can only be written with the scroll stopped: ticker()
+                # stops it, sends the counter and starts it again.
+                self.puts(hex(n), row=1, col=2, wrap=True)
+                self.ticker('~~~>_<~~~ @_@ ~~~>_<~', row=0, frames=2)
+                time.sleep(1)
+                n += 1
+
+    def _puts(self, s, scale, row, col, clear, wrap):
         font = font5x8.Font5x8
-        height = font.rows
-        width = font.cols
-        assert height == 8
+        assert font.rows == 8
+        width = font.cols * scale
         padding = 1
         while 128 % (width + padding) != 0:
             padding += 1
         padded_width = width + padding
-        bs = []
-        for i in s:
-            offset = ord(i) * width
-            bs.extend(font.bytes[offset:offset + width])
-            bs.extend([0] * padding)
-        if clear:
-            bs.extend([0] * (128 - (col + len(s)) * padded_width))
         col_start = col * padded_width
+        pages = font5x8.render(s, scale, padding)
+        if clear:
+            blank = bytes(max(0, 128 - (col + len(s)) * padded_width))
+            pages = [bs + blank for bs in pages]
         if not wrap:
-            bs = bs[:128 - col_start]
-        for r in [row, row + 4]:
-            self.set_page_address(r)
-            self.set_column_address(col_start)
-            self.data(*bs)
+            pages = [bs[:128 - col_start] for bs in pages]
+        for r in [half + row for half in self._halves]:
+            for i, bs in enumerate(pages):
+                self.fb.write(bs, r + i, col_start)
+
+    def puts(self, s, row=0, col=0, clear=True, wrap=False):
+        self._puts(s, 1, row, col, clear, wrap)
 
     def puts2(self, s, row=0, col=0, clear=True, wrap=False):
-        font = font5x8.Font5x8
-        height = font.rows
-        width = font.cols * 2
-        assert height == 8
-        padding = 1
-        while 128 % (width + padding) != 0:
-            padding += 1
-        padded_width = width + padding
-        bs = []
-        for i in s:
-            offset = ord(i) * font.cols
-            for b in font.bytes[offset:offset + font.cols]:
-                bs.append(b)
-                bs.append(b)
-            bs.extend([0] * padding)
-        if clear:
-            bs.extend([0] * (128 - (col + len(s)) * padded_width))
-        col_start = col * padded_width
-        if not wrap:
-            bs = bs[:128 - col_start]
-
-        def scale2x(b4):
-            b0 = b4 & 1
-            b1 = (b4 >> 1) & 1
-            b2 = (b4 >> 2) & 1
-            b3 = (b4 >> 3) & 1
-            return b0 | (b0 << 1) | (b1 << 2) | (b1 << 3) | (b2 << 4) | (b2 << 5) | (b3 << 6) | (b3 << 7)
-
-        for r in [row, row + 4]:
-            self.set_column_address(col_start)
-            self.set_page_address(r)
-            self.data(*[scale2x(i & 0xf) for i in bs])
-            self.set_page_address(r + 1)
-            self.data(*[scale2x(i >> 4) for i in bs])
+        self._puts(s, 2, row, col, clear, wrap)
 
     def puts4(self, s, row=0, col=0, clear=True, wrap=False):
         assert row == 0
-        font = font5x8.Font5x8
-        height = font.rows
-        width = font.cols * 4
-        assert height == 8
-        padding = 1
-        while 128 % (width + padding) != 0:
-            padding += 1
-        padded_width = width + padding
-        bs = []
-        for i in s:
-            offset = ord(i) * font.cols
-            for b in font.bytes[offset:offset + font.cols]:
-                bs.append(b)
-                bs.append(b)
-                bs.append(b)
-                bs.append(b)
-            bs.extend([0] * padding)
-        if clear:
-            bs.extend([0] * (128 - (col + len(s)) * padded_width))
-        col_start = col * padded_width
-        if not wrap:
-            bs = bs[:128 - col_start]
-
-        def scale4x(b2):
-            b0 = b2 & 1
-            b1 = (b2 >> 1) & 1
-            return b0 | (b0 << 1) | (b0 << 2) | (b0 << 3) | (b1 << 4) | (b1 << 5) | (b1 << 6) | (b1 << 7)
-
-        for r in [row, row + 4]:
-            self.set_column_address(col_start)
-            self.set_page_address(r)
-            self.data(*[scale4x(i & 0x3) for i in bs])
-            self.set_page_address(r + 1)
-            self.data(*[scale4x((i >> 2) & 0x3) for i in bs])
-            self.set_page_address(r + 2)
-            self.data(*[scale4x((i >> 4) & 0x3) for i in bs])
-            self.set_page_address(r + 3)
-            self.data(*[scale4x((i >> 6) & 0x3) for i in bs])
+        self._puts(s, 4, row, col, clear, wrap)
+
+    def blit(self, pages, row=0, col=0):
+        """Draws pages (bytes of columns, one per page) from row and col,
+        like puts()."""
+        for r in [half + row for half in self._halves]:
+            for i, bs in enumerate(pages):
+                self.fb.write(bs[:128 - col], r + i, col)
 
 class Display(object):
 
     UNK = '???'
-
-    def __init__(self, dev):
+    KEYS = ('pm25', 'aqi')
+    # Longest time between redraws.
+    INTERVAL = 2
+
+    def __init__(self, dev, registry=readings.default, net=None, flip=False, graph=None):
+        """With flip, consecutive screens are drawn into alternate halves of
+        the display RAM and switched to with one command, see
+        SSD1306Device.use_halves(). With two screens each keeps its half,
+        so switching sends only what changed on the next one.
+
+        graph (a graph.Graph) adds a screen for each of its plots that has
+        readings."""
         self._dev = dev
+        self._registry = registry
+        self._netinfo = net or netinfo.NetInfo()
+        self.flip = flip
+        self.graph = graph
+        self._shown = 0
 
     def get_ip(self):
-        try:
-            stdout = str(subprocess.check_output(['ip', 'addr', 'show', 'dev', 'eth0']))
-        except:
-            return self.UNK
-        ip = re.search('inet ([0-9.]*)/', stdout)
+        ip = self._netinfo.first()
         if ip:
-            return ip.group(1)
+            return ip[1]
         else:
             return self.UNK
 
-    def read_file(self, path):
-        try:
-            if time.time() - os.stat(path).st_mtime > 5 * 60:
-                return self.UNK
-            with open(path) as f:
-                return f.read().strip()
-        except:
+    def read(self, key, f, max_age=5 * 60):
+        """Formats f(value) of the latest reading of key."""
+        r = self._registry.get(key)
+        if r is None or time.time() - r.when > max_age:
             return self.UNK
+        if isinstance(r.value, Exception):
+            return 'error'
+        return str(f(r.value))
+
+    def show_info(self):
+        self._dev.puts('IP:' + self.get_ip(), row=0)
+        self._dev.puts('TIME:' + datetime.datetime.now().strftime('%H:%M:%S'), row=1)
+        self._dev.puts2('PM25:' + self.read('pm25', lambda m: m.pm2_5), row=2)
+        #self._dev.puts('TVOC(a):' + self.read('tvoc.0x5a', lambda r: r.tvoc), row=2)
+        #self._dev.puts('TVOC(b):' + self.read('tvoc.0x5b', lambda r: r.tvoc), row=3)
+
+    def show_pm25(self):
+        self._dev.puts4(' ' + self.read('pm25', lambda m: m.pm2_5))
+
+    def show_aqi(self):
+        # The NowCast is updated hourly.
+        self._dev.puts2('AQI:' + self.read('aqi', lambda a: a.aqi, 2 * 3600), row=0)
+        self._dev.puts(self.read('aqi', lambda a: a.short, 2 * 3600), row=2)
+        self._dev.puts('', row=3)
+
+    def show_graph(self, plot):
+        # A title line over three pages of graph.
+        title, pages = self.graph.render(plot, 3)
+        self._dev.puts(title, row=0)
+        self._dev.blit(pages, row=1)
+
+    def screens(self):
+        """Returns (show, seconds) of every screen, in order."""
+        screens = [(self.show_info, self.INTERVAL), (self.show_pm25, 4 * self.INTERVAL)]
+        if self._registry.get('aqi') is not None:
+            screens.append((self.show_aqi, 2 * self.INTERVAL))
+        if self.graph is not None:
+            screens += [(functools.partial(self.show_graph, plot), 2 * self.INTERVAL)
+                        for plot in self.graph.plots if self.graph.ready(plot)]
+        return screens
+
+    def start(self):
+        """Sets up the display for the flip setting."""
+        self._dev.use_halves(self.flip)
+        self._shown = 0
+
+    def draw(self, show, half):
+        """Draws the screen of show and flushes it; with flip, into half of
+        the RAM, which is then shown."""
+        if not self.flip:
+            show()
+            self._dev.flush()
+            return
+        with self._dev.drawing_half(half):
+            show()
+        self._dev.flush()
+        if half != self._shown:
+            self._dev.show_half(half)
+            self._shown = half
 
     def run(self, stop=None):
-        interval = 2
+        interval = self.INTERVAL
+        version = 0
+        half = 0
+        self.start()
         while stop is None or not stop.is_set():
-            try:
-                self._dev.puts('IP:' + self.get_ip(), row=0)
-                self._dev.puts('TIME:' + datetime.datetime.now().strftime('%H:%M:%S'), row=1)
-                self._dev.puts2('PM25:' + self.read_file('/tmp/pm25.txt'), row=2)
-                #self._dev.puts('TVOC(a):' + self.read_file('/tmp/tvoc.0x5a.txt'), row=2)
-                #self._dev.puts('TVOC(b):' + self.read_file('/tmp/tvoc.0x5b.txt'), row=3)
-            except Exception as e:
-                print('Exception:', e)
-            time.sleep(interval)
-            for _ in range(4):
-                try:
-                    self._dev.puts4(' ' + self.read_file('/tmp/pm25.txt'))
-                except Exception as e:
-                    print('Exception:', e)
-                time.sleep(interval)
+            for show, duration in self.screens():
+                # The next screen goes to the hidden half.
+                half ^= 1
+                end = time.monotonic() + duration
+                now = time.monotonic()
+                while now < end and (stop is None or not stop.is_set()):
+                    try:
+                        self.draw(show, half)
+                    except Exception as e:
+                        print('Exception:', e)
+                    # Redraw as soon as a reading changes.
+                    version = self._registry.wait(
+                        version, self.KEYS, timeout=min(end - now, interval))
+                    now = time.monotonic()
         print('exit ssd1306')
 
-def display_loop(addr, stop=None):
+@contextlib.contextmanager
+def open_device(addr=0x3c, bus=None, spi=None):
+    """Yields the SSD1306Device at addr on bus (I2C bus 1 by default) or,
+    given spi (keyword arguments of open_spi), the one on SPI."""
+    if spi is None:
+        with i2cbus.maybe_open(bus) as bus:
+            yield SSD1306Device(bus, addr)
+    else:
+        with open_spi(**spi) as transport:
+            yield SSD1306Device(transport=transport)
+
+
+def display_loop(addr, stop=None, registry=readings.default, bus=None, checkpoint=None,
+                 flip=False, spi=None, graph=None):
     with util.flock('/tmp/ssd1306.{}.lock'.format(hex(addr))):
-        with smbus2.SMBus(1) as bus:
-            dev = SSD1306Device(bus, addr)
-            dev.initialize()
-            print('init done')
+        with open_device(addr, bus, spi) as dev:
+            print('resumed' if dev.bring_up(checkpoint) else 'init done')
             try:
-                Display(dev).run(stop)
+                Display(dev, registry, flip=flip, graph=graph).run(stop)
             finally:
-                dev.off()
+                dev.shut_down(checkpoint)
 
 if __name__ == '__main__':
     display_loop(0x3c)
@@ -0,0 +1,395 @@
+import tempfile
+import threading
+import time
+import unittest
+
+import checkpoint
+import fakes
+import graph
+import history
+import i2cbus
+import readings
+import ssd1306
+
+
+class FakeBus(object):
+    """Records I2C writes and keeps a copy of the display RAM, assuming
+    horizontal addressing mode."""
+
+    def __init__(self):
+        self.ram = bytearray(128 * 8)
+        self.writes = []
+        self.cols = (0, 127)
+        self.pages = (0, 7)
+        self.col = 0
+        self.page = 0
+
+    def write_i2c_block_data(self, addr, reg, data):
+        data = list(data)
+        self.writes.append((reg, data))
+        if reg == 0:
+            i = 0
+            while i < len(data):
+                c = data[i]
+                args = data[i + 1:i + 1 + fakes.FakeSSD1306.ARGS.get(c, 0)]
+                i += 1 + len(args)
+                if c == 0x21:
+                    self.cols = tuple(args)
+                    self.col = self.cols[0]
+                elif c == 0x22:
+                    self.pages = tuple(args)
+                    self.page = self.pages[0]
+            return
+        for b in data:
+            self.ram[self.page * 128 + self.col] = b
+            self.col += 1
+            if self.col > self.cols[1]:
+                self.col = self.cols[0]
+                self.page += 1
+                if self.page > self.pages[1]:
+                    self.page = self.pages[0]
+
+    def data_bytes(self):
+        return sum(len(d) for reg, d in self.writes if reg == 0x40)
+
+
+class FrameBufferTest(unittest.TestCase):
+
+    def test_write_wraps(self):
+        fb = ssd1306.FrameBuffer()
+        fb.write(b'\x01' * 130, page=6, col=126)
+        self.assertEqual(b'\x01\x01', fb.buf[6 * 128 + 126:6 * 128 + 128])
+        self.assertEqual(b'\x01\x01', fb.buf[7 * 128 + 126:7 * 128 + 128])
+        self.assertEqual(b'\x00\x00', fb.buf[6 * 128 + 124:6 * 128 + 126])
+
+    def test_dirty(self):
+        fb = ssd1306.FrameBuffer()
+        self.assertEqual([], list(fb.dirty()))
+        fb.buf[3 * 128 + 5] = 1
+        fb.buf[3 * 128 + 9] = 1
+        fb.buf[127] = 1
+        self.assertEqual([(0, 127, 127), (3, 5, 9)], list(fb.dirty()))
+        fb.mark_sent()
+        self.assertEqual([], list(fb.dirty()))
+        fb.invalidate()
+        self.assertEqual([(p, 0, 127) for p in range(8)], list(fb.dirty()))
+
+
+class SSD1306DeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = FakeBus()
+        self.dev = ssd1306.SSD1306Device(self.bus, 0x3c)
+        self.dev.set_all(0)
+        self.bus.writes = []
+
+    def test_flush_sends_changes_only(self):
+        self.dev.puts('AB', row=1, col=3, clear=False)
+        self.dev.flush()
+        self.assertEqual(self.dev.fb.buf, self.bus.ram)
+        # At most two glyphs on each of the two pages.
+        self.assertLessEqual(self.bus.data_bytes(), 2 * 2 * 8)
+        self.bus.writes = []
+        self.dev.puts('AB', row=1, col=3, clear=False)
+        self.dev.flush()
+        self.assertEqual([], self.bus.writes)
+
+    def test_puts2_puts4(self):
+        self.dev.puts2('PM25:12', row=2)
+        self.dev.flush()
+        self.assertEqual(self.dev.fb.buf, self.bus.ram)
+        self.dev.puts4(' 123')
+        self.dev.flush()
+        self.assertEqual(self.dev.fb.buf, self.bus.ram)
+        self.assertTrue(any(self.bus.ram))
+
+    def test_flush_rectangles(self):
+        fb = self.dev.fb
+        # Close together: one rectangle over both pages.
+        fb.buf[2 * 128 + 10] = 1
+        fb.buf[3 * 128 + 12] = 1
+        self.dev.flush()
+        self.assertEqual([(0, [0x22, 2, 3, 0x21, 10, 12]), (0x40, [1, 0, 0, 0, 0, 1])],
+                         self.bus.writes)
+        self.assertEqual(fb.buf, self.bus.ram)
+        # Far apart: one rectangle per page.
+        self.bus.writes = []
+        fb.buf[0] = 1
+        fb.buf[7 * 128 + 127] = 1
+        self.dev.flush()
+        self.assertEqual(self.bus.data_bytes(), 2)
+        self.assertEqual(fb.buf, self.bus.ram)
+        self.assertEqual([], list(fb.dirty()))
+
+
+class TransferTest(unittest.TestCase):
+
+    def full_frame(self, dev):
+        """Returns the bus calls of flushing a whole frame."""
+        dev.fb.fill(0x55)
+        dev.fb.invalidate()
+        bus = dev.transport.bus
+        before = bus.transactions
+        dev.flush()
+        self.assertEqual(bus.devices[0x3c].ram, dev.fb.buf)
+        return bus.transactions - before
+
+    def device(self, adapter_max=None, **kwargs):
+        bus = fakes.FakeSMBus({0x3c: fakes.FakeSSD1306()}, max_transfer=adapter_max)
+        return ssd1306.SSD1306Device(bus, 0x3c, **kwargs)
+
+    def test_one_call_per_frame(self):
+        self.assertEqual(self.full_frame(self.device()), 1)
+
+    def test_max_transfer(self):
+        self.assertEqual(self.full_frame(self.device(65, max_transfer=65)), 1)
+
+    def test_smbus_blocks(self):
+        # An address command and 32 blocks.
+        self.assertEqual(self.full_frame(self.device(max_transfer=32)), 33)
+
+    def test_fallback(self):
+        dev = self.device(0)
+        self.assertEqual(self.full_frame(dev), 33)
+        self.assertFalse(dev.transport._rdwr)
+        self.assertEqual(self.full_frame(dev), 33)
+
+    def test_other_errors(self):
+        dev = ssd1306.SSD1306Device(fakes.FakeSMBus({}), 0x3c)
+        with self.assertRaises(OSError):
+            dev.data(1, 2, 3)
+        self.assertTrue(dev.transport._rdwr)
+
+
+class BusManagerFlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fakes.FakeSSD1306()
+        self.manager = i2cbus.BusManager(fakes.FakeSMBus({0x3c: self.fake}))
+        self.dev = ssd1306.SSD1306Device(self.manager.client('display', i2cbus.DISPLAY), 0x3c)
+        self.dev.set_all(0)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_queued_flushes_merge(self):
+        gate = threading.Event()
+        blocker = self.manager.client('sensor').transaction(lambda bus: gate.wait(), wait=False)
+        self.dev.puts('AB', row=1)
+        first = self.dev.flush()
+        self.dev.puts('CD', row=2)
+        second = self.dev.flush()
+        self.assertIs(first, second)
+        gate.set()
+        second.result()
+        blocker.result()
+        self.assertEqual(self.fake.ram, self.dev.fb.buf)
+        self.assertEqual(self.manager.stats()['display']['coalesced'], 1)
+        # Commands wait for the flushes queued before them.
+        self.dev.puts('EF', row=3)
+        self.dev.flush()
+        self.dev.off()
+        self.assertEqual(self.fake.ram, self.dev.fb.buf)
+
+
+class SPITest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fakes.FakeSSD1306()
+        self.gpio = fakes.FakeGPIO()
+        self.spi = []
+
+        def spidev():
+            self.spi.append(fakes.FakeSpiDev(self.fake, self.gpio, 18))
+            return self.spi[-1]
+
+        self.open = ssd1306.open_spi(18, 22, GPIO=self.gpio, SpiDev=spidev)
+
+    def test_frame(self):
+        with self.open as transport:
+            self.assertEqual(transport.name, 'spi0.0')
+            spi = self.spi[0]
+            self.assertEqual(spi.device, (0, 0))
+            dev = ssd1306.SSD1306Device(transport=transport)
+            self.assertEqual(dev.name, 'ssd1306.spi0.0')
+            dev.initialize()
+            self.assertTrue(self.fake.on)
+            dev.fb.fill(0x55)
+            dev.fb.invalidate()
+            calls, writes = spi.calls, len(self.gpio.writes)
+            dev.flush()
+            # D/C low for the window command, high for the frame.
+            self.assertEqual(spi.calls - calls, 2)
+            self.assertEqual(self.gpio.writes[writes:], [(18, 0), (18, 1)])
+            self.assertEqual(self.fake.ram, dev.fb.buf)
+            dev.off()
+            self.assertEqual(self.gpio.writes[-1], (18, 0))
+            self.assertFalse(self.fake.on)
+        self.assertIsNone(spi.device)
+        # RES pulsed low before the device was opened.
+        self.assertEqual(self.gpio.writes[:3], [(18, 0), (22, 1), (22, 0)])
+
+    def test_chunks(self):
+        with self.open as transport:
+            transport.max_transfer = 100
+            transport.write([(0x40, bytes(250))])
+            self.assertEqual(self.spi[0].calls, 3)
+
+    def test_no_status(self):
+        # Nothing to check a checkpoint against: always a cold start.
+        with tempfile.TemporaryDirectory() as d:
+            state = checkpoint.Checkpoint(d, boot='boot')
+            with self.open as transport:
+                dev = ssd1306.SSD1306Device(transport=transport)
+                self.assertFalse(dev.bring_up(state))
+                dev.shut_down(state)
+                self.assertFalse(dev.bring_up(state))
+                self.assertTrue(self.fake.on)
+
+
+class NoNet(object):
+
+    def first(self):
+        return None
+
+
+class ScrollTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fakes.FakeSSD1306()
+        self.bus = fakes.FakeSMBus({0x3c: self.fake})
+        self.dev = ssd1306.SSD1306Device(self.bus, 0x3c)
+        self.dev.set_all(0)
+
+    def test_scroll(self):
+        before = self.bus.transactions
+        self.dev.scroll(2, 2, left=True, frames=2)
+        self.assertEqual(self.bus.transactions - before, 1)
+        self.assertTrue(self.fake.scrolling)
+        self.assertEqual(self.fake.scroll, (0x27, 0, 2, 7, 2, 0, 0xff))
+        # Nothing is written while the display scrolls (FakeSSD1306 fails
+        # on RAM writes then), not even pages outside the scroll.
+        self.dev.puts('AB', row=2)
+        before = self.bus.transactions
+        self.dev.flush()
+        self.assertEqual(self.bus.transactions, before)
+        self.assertFalse(any(self.fake.ram))
+        self.dev.stop_scroll()
+        self.assertFalse(self.fake.scrolling)
+        self.dev.flush()
+        self.assertEqual(self.dev.fb.buf, self.fake.ram)
+
+    def test_scroll_survives_restart(self):
+        self.dev.scroll(2, 2)
+        # A new program finds the display scrolling.
+        dev = ssd1306.SSD1306Device(self.bus, 0x3c)
+        dev.initialize()
+        self.assertFalse(self.fake.scrolling)
+
+    def test_ticker(self):
+        with self.assertRaises(AssertionError):
+            self.dev.ticker('news', row=1)
+        with self.dev.drawing_half(1):
+            self.dev.ticker('news', row=1)
+            self.dev.ticker('more news', row=1)
+        self.assertEqual(self.fake.scroll[2], 5)
+        self.assertTrue(any(self.fake.ram[5 * 128:6 * 128]))
+        self.assertFalse(any(self.fake.ram[1 * 128:2 * 128]))
+
+    def test_flip(self):
+        registry = readings.Registry()
+        display = ssd1306.Display(self.dev, registry, NoNet(), flip=True)
+        display.start()
+        self.assertEqual(self.fake.mux, 32)
+        display.draw(display.show_pm25, 1)
+        self.assertEqual(self.fake.visible(), [4, 5, 6, 7])
+        display.draw(display.show_info, 0)
+        self.assertEqual(self.fake.visible(), [0, 1, 2, 3])
+        self.assertEqual(self.dev.fb.buf, self.fake.ram)
+        # Back to the first screen: one command (and its control byte) and
+        # whatever changed.
+        before = self.bus.bytes
+        display.draw(display.show_pm25, 1)
+        self.assertEqual(self.fake.visible(), [4, 5, 6, 7])
+        self.assertEqual(self.bus.bytes - before, 2)
+        display.flip = False
+        display.start()
+        self.assertEqual(self.fake.mux, 64)
+        self.assertEqual(self.fake.visible(), list(range(8)))
+
+
+class GraphScreenTest(unittest.TestCase):
+
+    def test_graph_screens(self):
+        fake = fakes.FakeSSD1306()
+        dev = ssd1306.SSD1306Device(fakes.FakeSMBus({0x3c: fake}), 0x3c)
+        dev.set_all(0)
+        h = history.History(['pm2_5'], 100)
+        g = graph.Graph([graph.Plot('PM25', h, 'pm2_5'),
+                         graph.Plot('TVOC5a', history.History(['tvoc'], 10), 'tvoc')], span=100)
+        display = ssd1306.Display(dev, readings.Registry(), NoNet(), graph=g)
+        # Only plots with readings get a screen.
+        self.assertEqual(len(display.screens()), 2)
+        for i in range(100):
+            h.append([i], time.time() - 100 + i)
+        screens = display.screens()
+        self.assertEqual(len(screens), 3)
+        display.draw(screens[-1][0], 0)
+        self.assertEqual(dev.fb.buf, fake.ram)
+        # The title, then the graph in pages 1-3 of both halves: a bar in
+        # each column with a reading.
+        self.assertTrue(any(fake.ram[:128]))
+        for half in (0, 4):
+            bottom = fake.ram[(half + 3) * 128:(half + 4) * 128]
+            self.assertGreaterEqual(sum(b != 0 for b in bottom), 99)
+
+
+class WarmStartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = checkpoint.Checkpoint(self.tmp.name, boot='a')
+        self.fake = fakes.FakeSSD1306()
+        self.bus = fakes.FakeSMBus({0x3c: self.fake})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cold_then_warm(self):
+        dev = ssd1306.SSD1306Device(self.bus, 0x3c)
+        self.assertFalse(dev.bring_up(self.checkpoint))
+        self.assertTrue(self.fake.on)
+        before = self.bus.transactions
+        # Restarted after a crash, with the display still on.
+        dev = ssd1306.SSD1306Device(self.bus, 0x3c)
+        self.assertTrue(dev.bring_up(self.checkpoint))
+        # The status read and the addressing mode.
+        self.assertEqual(self.bus.transactions - before, 2)
+        dev.puts('A')
+        dev.flush()
+        self.assertEqual(dev.fb.buf, self.fake.ram)
+
+    def test_initialize_after_shut_down(self):
+        ssd1306.SSD1306Device(self.bus, 0x3c).bring_up(self.checkpoint)
+        before = self.bus.transactions
+        ssd1306.SSD1306Device(self.bus, 0x3c).shut_down(self.checkpoint)
+        # Just the off command.
+        self.assertEqual(self.bus.transactions - before, 1)
+        self.assertFalse(self.fake.on)
+        # Off, as after a power cycle: initialized again.
+        self.assertFalse(ssd1306.SSD1306Device(self.bus, 0x3c).bring_up(self.checkpoint))
+        self.assertTrue(self.fake.on)
+
+    def test_power_cycled(self):
+        ssd1306.SSD1306Device(self.bus, 0x3c).bring_up(self.checkpoint)
+        self.bus.devices[0x3c] = fake = fakes.FakeSSD1306()
+        self.assertFalse(ssd1306.SSD1306Device(self.bus, 0x3c).bring_up(self.checkpoint))
+        self.assertTrue(fake.on)
+
+    def test_without_checkpoint(self):
+        self.assertFalse(ssd1306.SSD1306Device(self.bus, 0x3c).bring_up())
+        self.assertFalse(ssd1306.SSD1306Device(self.bus, 0x3c).bring_up())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,13 @@ import os
 import time
 import urllib
 
-# import RPi.GPIO as GPIO  # yaourt -S python-raspberry-gpio
+
+
+def rpi_gpio():
+    """Returns the RPi.GPIO module, imported on first use so that the rest
+    runs off the Pi."""
+    import RPi.GPIO as GPIO  # yaourt -S python-raspberry-gpio
+    return GPIO
 
 
 class RingBuffer(object):
@@ -46,7 +52,7 @@ class GoogleFormPoster(object):
                     keys[int(v)] = k
         self.keys = keys
 
-    def post(self, when, data):
+    def post(self, when, data, session=None):
         params = {}
         for k, v in self.keys.items():
             if k == 'date':
@@ -58,7 +64,7 @@ class GoogleFormPoster(object):
         post_url = self.prefix + '/formResponse'
         user_agent = {'Referer': self.prefix + '/viewform',
                       'User-Agent': "Mozilla/5.0 (X11; Linux i686) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/28.0.1500.52 Safari/537.36"}
-        return requests.post(post_url, data=params, headers=user_agent)
+        return (session or requests).post(post_url, data=params, headers=user_agent)
 
 class Throttle(object):
 
@@ -78,30 +84,53 @@ class Throttle(object):
 
 class InputChannel(object):
 
-    def __init__(self, ch):
+    def __init__(self, ch, GPIO):
         self.ch = ch
+        self.GPIO = GPIO
 
     @property
     def get(self):
-        return GPIO.input(self.ch)
+        return self.GPIO.input(self.ch)
+
+    def wait_low(self, timeout):
+        """Returns True once the input is low, or False after timeout
+        seconds; sleeps in the GPIO library until a falling edge."""
+        if not self.GPIO.input(self.ch):
+            return True
+        return self.GPIO.wait_for_edge(self.ch, self.GPIO.FALLING,
+                                       timeout=max(1, int(timeout * 1000))) is not None
 
 
 class OutputChannel(object):
 
-    def __init__(self, ch):
+    def __init__(self, ch, GPIO):
         self.ch = ch
+        self.GPIO = GPIO
 
     def put(self, bit):
-        GPIO.output(self.ch, bit)
+        self.GPIO.output(self.ch, bit)
 
 
 @contextlib.contextmanager
-def gpio(inputs=(), outputs=()):
+def gpio(inputs=(), outputs=(), GPIO=None):
+    """Sets up board numbered channels. Inputs are channels or (channel,
+    pull up) pairs, outputs channels or (channel, initial value) pairs. GPIO
+    defaults to RPi.GPIO; tests pass fakes.FakeGPIO."""
+    if GPIO is None:
+        GPIO = rpi_gpio()
     GPIO.setmode(GPIO.BOARD)
     input_channels = []
     for i in inputs:
-        GPIO.setup(i, GPIO.IN)
-        input_channels.append(InputChannel(i))
+        if isinstance(i, tuple):
+            i, pull_up = i
+        else:
+            assert isinstance(i, int)
+            pull_up = False
+        if pull_up:
+            GPIO.setup(i, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        else:
+            GPIO.setup(i, GPIO.IN)
+        input_channels.append(InputChannel(i, GPIO))
     output_channels = []
     for o in outputs:
         if isinstance(o, tuple):
@@ -110,9 +139,11 @@ def gpio(inputs=(), outputs=()):
             assert isinstance(o, int)
             o, init = o, 0
         GPIO.setup(o, GPIO.OUT, initial=init)
-        output_channels.append(OutputChannel(o))
-    yield tuple(input_channels), tuple(output_channels)
-    GPIO.cleanup([_.ch for _ in input_channels + output_channels])
+        output_channels.append(OutputChannel(o, GPIO))
+    try:
+        yield tuple(input_channels), tuple(output_channels)
+    finally:
+        GPIO.cleanup([_.ch for _ in input_channels + output_channels])
 
 def dump(v, path):
     with open(path, 'w') as f: